@@ -0,0 +1,187 @@
+from fastapi import APIRouter, Depends, Query, Response
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
+from typing import List, Optional
+from datetime import datetime
+
+from database import get_async_db
+from models import User, Project, Workflow
+from schemas import ProjectCreate, ProjectResponse, WorkflowCreate, WorkflowResponse
+from schemas import ProjectListItem, WorkflowListItem, PROJECT_LIST_FIELDS, PROJECT_SUMMARY_FIELDS, WORKFLOW_LIST_FIELDS, WORKFLOW_SUMMARY_FIELDS
+from token_cache import token_cache, UserSnapshot
+from route_helpers import owned_project_query, owned_workflow_query, found_or_404, token_user_id, remember_user
+from route_helpers import project_response, workflow_response, workflow_list_items
+from dashboard import dashboard_stats_query, dashboard_stats_from_row, dashboard_cache
+from workflow_versions import record_version
+from websocket_manager import manager
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, keyset_filter, keyset_order, parse_fields, paginate, select_fields, columns_for
+
+# AsyncSession versions of the project, workflow and dashboard endpoints.
+# main.py mounts this router ahead of the sync handlers when ASYNC_DB_ENABLED is set.
+router = APIRouter()
+
+security = HTTPBearer()
+
+async def get_current_user_async(credentials: HTTPAuthorizationCredentials = Depends(security), db: AsyncSession = Depends(get_async_db)):
+    """Get current authenticated user using the async session"""
+    token = credentials.credentials
+
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached.user
+
+    payload, user_id = token_user_id(token)
+    user = (await db.execute(select(User).where(User.id == user_id))).scalar_one_or_none()
+    return remember_user(token, payload, user)
+
+async def _get_owned_project(db: AsyncSession, project_id: int, user_id: int) -> Project:
+    """Load a project owned by the user or raise 404"""
+    project = (await db.execute(owned_project_query(project_id, user_id))).scalar_one_or_none()
+    return found_or_404(project, "Project not found")
+
+# Dashboard endpoints
+@router.get("/dashboard/stats")
+async def get_dashboard_stats(current_user: UserSnapshot = Depends(get_current_user_async), db: AsyncSession = Depends(get_async_db)):
+    """Get dashboard statistics"""
+    stats = dashboard_cache.get(current_user.id)
+    if stats is None:
+        row = (await db.execute(dashboard_stats_query(current_user.id))).one()
+        stats = dashboard_stats_from_row(row)
+        dashboard_cache.set(current_user.id, stats)
+
+    return stats
+
+# Project endpoints
+@router.get("/projects", response_model=List[ProjectListItem], response_model_exclude_unset=True)
+async def get_projects(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    summary: bool = False,
+    current_user: UserSnapshot = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get user's projects, one keyset page at a time"""
+    selected = parse_fields(fields, PROJECT_LIST_FIELDS, PROJECT_SUMMARY_FIELDS if summary else PROJECT_LIST_FIELDS)
+
+    stmt = select(Project).options(load_only(*columns_for(Project, selected))).where(
+        Project.owner_id == current_user.id
+    )
+    if cursor:
+        stmt = stmt.where(keyset_filter(Project, cursor))
+    rows = (await db.execute(stmt.order_by(*keyset_order(Project)).limit(limit + 1))).scalars().all()
+
+    projects, next_cursor = paginate(rows, limit)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return [select_fields(p, selected) for p in projects]
+
+@router.post("/projects", response_model=ProjectResponse)
+async def create_project(project_data: ProjectCreate, current_user: UserSnapshot = Depends(get_current_user_async), db: AsyncSession = Depends(get_async_db)):
+    """Create a new project"""
+    project = Project(
+        name=project_data.name,
+        description=project_data.description,
+        industry=project_data.industry,
+        objectives=project_data.objectives,
+        owner_id=current_user.id
+    )
+
+    db.add(project)
+    await db.commit()
+    await db.refresh(project)
+    dashboard_cache.invalidate(current_user.id)
+
+    return project_response(project)
+
+@router.get("/projects/{project_id}", response_model=ProjectResponse)
+async def get_project(project_id: int, current_user: UserSnapshot = Depends(get_current_user_async), db: AsyncSession = Depends(get_async_db)):
+    """Get a specific project"""
+    project = await _get_owned_project(db, project_id, current_user.id)
+    return project_response(project)
+
+# Workflow endpoints
+@router.get("/projects/{project_id}/workflows", response_model=List[WorkflowListItem], response_model_exclude_unset=True)
+async def get_workflows(
+    project_id: int,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    summary: bool = False,
+    current_user: UserSnapshot = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get workflows for a project, one keyset page at a time"""
+    await _get_owned_project(db, project_id, current_user.id)
+
+    selected = parse_fields(fields, WORKFLOW_LIST_FIELDS, WORKFLOW_SUMMARY_FIELDS if summary else WORKFLOW_LIST_FIELDS)
+
+    stmt = select(Workflow).options(load_only(*columns_for(Workflow, selected))).where(
+        Workflow.project_id == project_id
+    )
+    if cursor:
+        stmt = stmt.where(keyset_filter(Workflow, cursor))
+    rows = (await db.execute(stmt.order_by(*keyset_order(Workflow)).limit(limit + 1))).scalars().all()
+
+    workflows, next_cursor = paginate(rows, limit)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+    return workflow_list_items(workflows, selected)
+
+@router.post("/projects/{project_id}/workflows", response_model=WorkflowResponse)
+async def create_workflow(
+    project_id: int,
+    workflow_data: WorkflowCreate,
+    current_user: UserSnapshot = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Create a new workflow"""
+    await _get_owned_project(db, project_id, current_user.id)
+
+    workflow = Workflow(
+        name=workflow_data.name,
+        description=workflow_data.description,
+        project_id=project_id,
+        nodes=workflow_data.nodes or [],
+        edges=workflow_data.edges or []
+    )
+
+    db.add(workflow)
+    await db.flush()
+    await db.run_sync(lambda session: record_version(session, workflow.id, workflow.nodes, workflow.edges, author_id=current_user.id))
+    await db.commit()
+    await db.refresh(workflow)
+    dashboard_cache.invalidate(current_user.id)
+
+    return workflow_response(workflow)
+
+@router.put("/workflows/{workflow_id}", response_model=WorkflowResponse)
+async def update_workflow(
+    workflow_id: int,
+    workflow_data: WorkflowCreate,
+    current_user: UserSnapshot = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Update a workflow"""
+    workflow = (await db.execute(owned_workflow_query(workflow_id, current_user.id))).scalar_one_or_none()
+    found_or_404(workflow, "Workflow not found")
+
+    workflow.name = workflow_data.name
+    workflow.description = workflow_data.description
+    workflow.nodes = workflow_data.nodes or []
+    workflow.edges = workflow_data.edges or []
+    workflow.updated_at = datetime.utcnow()
+    saved = await db.run_sync(lambda session: record_version(session, workflow.id, workflow.nodes, workflow.edges, author_id=current_user.id))
+
+    await db.commit()
+    await db.refresh(workflow)
+    dashboard_cache.invalidate(current_user.id)
+    # Collaboration sessions editing the workflow would otherwise save over this update
+    await manager.reload_workflow(workflow.id, saved.version)
+
+    return workflow_response(workflow)
@@ -1,5 +1,8 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Dict, Callable, Any
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 import os
@@ -9,6 +12,10 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-this-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# bcrypt worker pool configuration
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+PASSWORD_HASH_MAX_INFLIGHT = int(os.getenv("PASSWORD_HASH_MAX_INFLIGHT", "64"))
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -19,6 +26,73 @@ def get_password_hash(password: str) -> str:
     """Hash a password"""
     return pwd_context.hash(password)
 
+class PasswordHasherOverloaded(Exception):
+    """Raised when the password hashing pool already has max_inflight operations"""
+
+class PasswordHasher:
+    """Runs bcrypt hashing and verification on a dedicated, size-limited thread pool
+    
+    bcrypt releases the GIL, so a small thread pool keeps ~250ms hashes off the
+    event loop. Calls beyond max_inflight are rejected instead of queueing forever.
+    """
+    
+    def __init__(self, max_workers: int = PASSWORD_HASH_WORKERS, max_inflight: int = PASSWORD_HASH_MAX_INFLIGHT):
+        self.max_workers = max_workers
+        self.max_inflight = max_inflight
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+    
+    async def hash(self, password: str) -> str:
+        """Hash a password without blocking the event loop"""
+        return await self._submit(get_password_hash, password)
+    
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """Verify a password without blocking the event loop"""
+        return await self._submit(verify_password, plain_password, hashed_password)
+    
+    async def _submit(self, func: Callable[..., Any], *args) -> Any:
+        with self._lock:
+            if self.in_flight >= self.max_inflight:
+                self.rejected += 1
+                raise PasswordHasherOverloaded("Too many password operations in progress")
+            self.in_flight += 1
+        
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, self._run, func, *args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+    
+    def _run(self, func: Callable[..., Any], *args) -> Any:
+        with self._lock:
+            self.running += 1
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Get pool size, queue depth and rejection counts"""
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_inflight": self.max_inflight,
+                "in_flight": self.in_flight,
+                "running": self.running,
+                "queued": self.in_flight - self.running,
+                "completed": self.completed,
+                "rejected": self.rejected
+            }
+
+password_hasher = PasswordHasher()
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create a JWT access token"""
     to_encode = data.copy()
@@ -1,34 +1,168 @@
+import asyncio
 import boto3
+import functools
+import inspect
 import json
+import logging
 import os
-from typing import Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, AsyncIterator, Awaitable, Callable, Optional
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+from textract_blocks import resolve_blocks
+from result_cache import ResultCache, create_result_cache, sha256_digest
+from comprehend_batcher import MicroBatcher, batchable
+
+logger = logging.getLogger(__name__)
+
+# Default number of in-flight calls allowed per AWS service
+DEFAULT_SERVICE_CONCURRENCY = {
+    's3': 16,
+    'textract': 4,
+    'comprehend': 10,
+    'rekognition': 8,
+    'lambda': 8
+}
+
+# Size of each part of a multipart upload; S3 requires at least 5 MB for all but the last part
+S3_MULTIPART_CHUNK_SIZE = max(int(os.getenv('S3_MULTIPART_CHUNK_SIZE', str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+
+# Seconds between GetDocumentAnalysis polls while a Textract job is running
+TEXTRACT_JOB_POLL_INTERVAL = float(os.getenv('TEXTRACT_JOB_POLL_INTERVAL', '5'))
+
+# Textract features requested for document analysis; part of the result cache key
+TEXTRACT_FEATURE_TYPES = ['TABLES', 'FORMS']
+
+# S3 object metadata entry holding the SHA-256 of objects uploaded in a single part
+S3_SHA256_METADATA = 'sha256'
+
+class AsyncServiceClient:
+    """Runs blocking boto3 client calls on a thread pool with a per-service limit"""
+    
+    def __init__(self, client, executor: ThreadPoolExecutor, max_concurrency: int):
+        self.client = client
+        self.executor = executor
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = None
+        self._loop = None
+    
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Semaphores are bound to the loop they are first used on (Python 3.9),
+        # so create one lazily for whichever loop is serving requests
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._semaphore
+    
+    async def call(self, method: str, **kwargs) -> Any:
+        """Call a client method without blocking the event loop"""
+        semaphore = self._get_semaphore()
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor,
+                functools.partial(getattr(self.client, method), **kwargs)
+            )
+        finally:
+            self.in_flight -= 1
+            semaphore.release()
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Get concurrency statistics for this service"""
+        return {
+            'max_concurrency': self.max_concurrency,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting
+        }
+
 class AWSServices:
     def __init__(self):
         self.region = os.getenv('AWS_REGION', 'us-east-1')
-        self.s3_client = boto3.client('s3', region_name=self.region)
-        self.textract_client = boto3.client('textract', region_name=self.region)
-        self.comprehend_client = boto3.client('comprehend', region_name=self.region)
-        self.rekognition_client = boto3.client('rekognition', region_name=self.region)
-        self.lambda_client = boto3.client('lambda', region_name=self.region)
+        
+        # boto3 clients are thread-safe; all calls go through a shared bounded pool
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('AWS_CLIENT_MAX_WORKERS', '32')),
+            thread_name_prefix='aws-client'
+        )
+        self.async_clients: Dict[str, AsyncServiceClient] = {}
+        for service, default_limit in DEFAULT_SERVICE_CONCURRENCY.items():
+            limit = int(os.getenv(f'AWS_{service.upper()}_MAX_CONCURRENCY', str(default_limit)))
+            client = boto3.client(
+                service,
+                region_name=self.region,
+                config=Config(max_pool_connections=max(limit, 10))
+            )
+            self.async_clients[service] = AsyncServiceClient(client, self.executor, limit)
+        
+        # API versions are part of the result cache key, so a service upgrade does not serve stale results
+        self.api_versions = {
+            service: client.client.meta.service_model.api_version
+            for service, client in self.async_clients.items()
+        }
+        self.result_cache: ResultCache = create_result_cache()
+        
+        # Concurrent Comprehend requests share BatchDetect* calls
+        self.sentiment_batcher = MicroBatcher(self._batch_detect_sentiment)
+        self.entity_batcher = MicroBatcher(self._batch_detect_entities)
+        
+        self.s3_client = self.async_clients['s3'].client
+        self.textract_client = self.async_clients['textract'].client
+        self.comprehend_client = self.async_clients['comprehend'].client
+        self.rekognition_client = self.async_clients['rekognition'].client
+        self.lambda_client = self.async_clients['lambda'].client
         
         # S3 bucket names from environment
         self.data_bucket = os.getenv('S3_DATA_BUCKET')
         self.models_bucket = os.getenv('S3_MODELS_BUCKET')
         self.static_bucket = os.getenv('S3_STATIC_BUCKET')
+        
+        # Maximum number of workflow steps run at the same time, per workflow
+        self.workflow_max_concurrency = int(os.getenv('WORKFLOW_MAX_CONCURRENCY', '4'))
+    
+    async def _call(self, service: str, method: str, **kwargs) -> Any:
+        """Call a boto3 client method off the event loop"""
+        return await self.async_clients[service].call(method, **kwargs)
+    
+    def get_client_stats(self) -> Dict[str, Dict[str, int]]:
+        """Get in-flight and queued call counts for each AWS service"""
+        return {service: client.get_stats() for service, client in self.async_clients.items()}
+    
+    def get_batch_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Get Comprehend micro-batching statistics"""
+        return {
+            'sentiment': self.sentiment_batcher.get_stats(),
+            'entities': self.entity_batcher.get_stats()
+        }
     
     async def health_check(self) -> str:
         """Check AWS services health"""
         try:
             # Test S3 access
-            self.s3_client.head_bucket(Bucket=self.data_bucket)
+            await self._call('s3', 'head_bucket', Bucket=self.data_bucket)
             return "healthy"
         except Exception as e:
             return f"unhealthy: {str(e)}"
     
-    async def upload_file(self, file_content: bytes, file_name: str, bucket_type: str = 'data') -> str:
-        """Upload file to S3"""
+    async def upload_file(self, file_content: Any, file_name: str, bucket_type: str = 'data',
+                          content_type: str = None) -> str:
+        """Upload file to S3
+        
+        file_content is either bytes or a file-like object with a (sync or
+        async) ``read(size)``, such as an UploadFile. File objects are streamed
+        in S3_MULTIPART_CHUNK_SIZE parts through a multipart upload, so at most
+        two parts are held in memory whatever the file size.
+        """
         bucket_map = {
             'data': self.data_bucket,
             'models': self.models_bucket,
@@ -36,120 +170,285 @@ class AWSServices:
         }
         
         bucket = bucket_map.get(bucket_type, self.data_bucket)
+        extra = {'ContentType': content_type} if content_type else {}
         
         try:
-            self.s3_client.put_object(
-                Bucket=bucket,
-                Key=file_name,
-                Body=file_content
-            )
+            if isinstance(file_content, (bytes, bytearray)):
+                await self._put_object(bucket, file_name, file_content, extra)
+            else:
+                await self._upload_stream(file_content, bucket, file_name, extra)
             return f"s3://{bucket}/{file_name}"
         except ClientError as e:
             raise Exception(f"Failed to upload file: {str(e)}")
     
+    async def _put_object(self, bucket: str, key: str, body: bytes, extra: Dict[str, str]):
+        # The content hash lets analysis results be cached by content rather than by key
+        await self._call('s3', 'put_object', Bucket=bucket, Key=key, Body=body,
+                         Metadata={S3_SHA256_METADATA: sha256_digest(body)}, **extra)
+    
+    async def _object_digest(self, s3_uri: str) -> Optional[str]:
+        """Content digest of an S3 object: its uploaded SHA-256, else its ETag"""
+        bucket, key = s3_uri.replace('s3://', '').split('/', 1)
+        try:
+            response = await self._call('s3', 'head_object', Bucket=bucket, Key=key)
+        except ClientError:
+            # Not cacheable; the analysis call reports the error
+            return None
+        
+        sha256 = response.get('Metadata', {}).get(S3_SHA256_METADATA)
+        if sha256:
+            return f"sha256:{sha256}"
+        # Multipart ETags depend on the part size, which is fixed by S3_MULTIPART_CHUNK_SIZE
+        return f"etag:{response['ETag']}" if response.get('ETag') else None
+    
+    async def _cached(self, service: str, operation: str, content_digest: Optional[str], features: List[Any],
+                      compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Serve an analysis from the result cache, computing it on a miss"""
+        if content_digest is None:
+            return await compute()
+        key = self.result_cache.make_key(
+            f"{service}.{operation}", content_digest, features, self.api_versions.get(service, '')
+        )
+        return await self.result_cache.get_or_compute(key, compute)
+    
+    async def _upload_stream(self, stream: Any, bucket: str, key: str, extra: Dict[str, str]):
+        async def read_chunk() -> bytes:
+            chunk = stream.read(S3_MULTIPART_CHUNK_SIZE)
+            return await chunk if inspect.isawaitable(chunk) else chunk
+        
+        chunk = await read_chunk()
+        if len(chunk) < S3_MULTIPART_CHUNK_SIZE:
+            # Fits in a single part
+            await self._put_object(bucket, key, chunk, extra)
+            return
+        
+        upload_id = (await self._call('s3', 'create_multipart_upload', Bucket=bucket, Key=key, **extra))['UploadId']
+        try:
+            parts = []
+            while chunk:
+                part_number = len(parts) + 1
+                # Read the next part while this one uploads
+                upload = asyncio.ensure_future(self._call('s3', 'upload_part',
+                    Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=chunk
+                ))
+                try:
+                    next_chunk = await read_chunk()
+                finally:
+                    response = await upload
+                parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+                chunk = next_chunk
+            
+            await self._call('s3', 'complete_multipart_upload',
+                Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts}
+            )
+        except BaseException:
+            try:
+                await self._call('s3', 'abort_multipart_upload', Bucket=bucket, Key=key, UploadId=upload_id)
+            except Exception:
+                # Surface the upload's own error; the orphaned parts are left to the bucket's lifecycle rules
+                logger.exception(f"Failed to abort multipart upload {upload_id} of s3://{bucket}/{key}")
+            raise
+    
     async def analyze_document(self, s3_uri: str) -> Dict[str, Any]:
-        """Analyze document using AWS Textract"""
+        """Analyze document using AWS Textract; results are cached by document content"""
+        return await self._cached('textract', 'analyze_document', await self._object_digest(s3_uri),
+                                  TEXTRACT_FEATURE_TYPES, lambda: self._analyze_document(s3_uri))
+    
+    async def _analyze_document(self, s3_uri: str) -> Dict[str, Any]:
         try:
             # Parse S3 URI
             bucket, key = s3_uri.replace('s3://', '').split('/', 1)
             
-            response = self.textract_client.analyze_document(
+            response = await self._call('textract', 'analyze_document',
                 Document={
                     'S3Object': {
                         'Bucket': bucket,
                         'Name': key
                     }
                 },
-                FeatureTypes=['TABLES', 'FORMS']
+                FeatureTypes=TEXTRACT_FEATURE_TYPES
             )
             
             # Extract text and structured data
-            extracted_text = []
-            tables = []
-            forms = []
+            return resolve_blocks(response['Blocks'])
+        
+        except ClientError as e:
+            raise Exception(f"Document analysis failed: {str(e)}")
+    
+    async def start_document_analysis(self, s3_uri: str) -> str:
+        """Start an asynchronous Textract analysis of a (multi-page) document; returns the job ID"""
+        try:
+            bucket, key = s3_uri.replace('s3://', '').split('/', 1)
             
-            for block in response['Blocks']:
-                if block['BlockType'] == 'LINE':
-                    extracted_text.append(block['Text'])
-                elif block['BlockType'] == 'TABLE':
-                    # Process table data
-                    tables.append(self._process_table(block, response['Blocks']))
-                elif block['BlockType'] == 'KEY_VALUE_SET':
-                    # Process form data
-                    forms.append(self._process_form(block, response['Blocks']))
+            response = await self._call('textract', 'start_document_analysis',
+                DocumentLocation={
+                    'S3Object': {
+                        'Bucket': bucket,
+                        'Name': key
+                    }
+                },
+                FeatureTypes=TEXTRACT_FEATURE_TYPES
+            )
+            return response['JobId']
+        
+        except ClientError as e:
+            raise Exception(f"Document analysis failed: {str(e)}")
+    
+    async def document_analysis_pages(self, job_id: str, poll_interval: float = TEXTRACT_JOB_POLL_INTERVAL) -> AsyncIterator[Dict[str, Any]]:
+        """Wait for a Textract job, then yield its GetDocumentAnalysis result pages one at a time"""
+        try:
+            while True:
+                response = await self._call('textract', 'get_document_analysis', JobId=job_id)
+                if response['JobStatus'] != 'IN_PROGRESS':
+                    break
+                await asyncio.sleep(poll_interval)
             
-            return {
-                'text': '\n'.join(extracted_text),
-                'tables': tables,
-                'forms': forms,
-                'confidence': self._calculate_average_confidence(response['Blocks'])
-            }
+            if response['JobStatus'] == 'FAILED':
+                raise Exception(f"Textract job {job_id} failed: {response.get('StatusMessage', 'unknown error')}")
+            
+            while True:
+                yield response
+                if not response.get('NextToken'):
+                    return
+                response = await self._call('textract', 'get_document_analysis', JobId=job_id, NextToken=response['NextToken'])
         
         except ClientError as e:
             raise Exception(f"Document analysis failed: {str(e)}")
     
     async def analyze_sentiment(self, text: str) -> Dict[str, Any]:
-        """Analyze text sentiment using AWS Comprehend"""
+        """Analyze text sentiment using AWS Comprehend; results are cached by text"""
+        return await self._cached('comprehend', 'detect_sentiment', f"sha256:{sha256_digest(text)}",
+                                  ['en'], lambda: self._analyze_sentiment(text))
+    
+    async def _analyze_sentiment(self, text: str) -> Dict[str, Any]:
+        if batchable(text):
+            return await self.sentiment_batcher.submit(text)
+        return await self._detect_sentiment(text)
+    
+    async def _detect_sentiment(self, text: str) -> Dict[str, Any]:
         try:
-            response = self.comprehend_client.detect_sentiment(
+            response = await self._call('comprehend', 'detect_sentiment',
                 Text=text,
                 LanguageCode='en'
             )
-            
-            return {
-                'sentiment': response['Sentiment'],
-                'confidence_scores': response['SentimentScore']
-            }
+            return self._sentiment_result(response)
         
         except ClientError as e:
             raise Exception(f"Sentiment analysis failed: {str(e)}")
     
+    async def _batch_detect_sentiment(self, texts: List[str]) -> List[Any]:
+        try:
+            response = await self._call('comprehend', 'batch_detect_sentiment',
+                TextList=texts,
+                LanguageCode='en'
+            )
+            return self._batch_results(response, len(texts), self._sentiment_result, 'Sentiment analysis failed')
+        
+        except ClientError as e:
+            raise Exception(f"Sentiment analysis failed: {str(e)}")
+    
+    @staticmethod
+    def _sentiment_result(response: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'sentiment': response['Sentiment'],
+            'confidence_scores': response['SentimentScore']
+        }
+    
+    @staticmethod
+    def _batch_results(response: Dict[str, Any], count: int, convert: Callable[[Dict[str, Any]], Any],
+                       failure: str) -> List[Any]:
+        """Order a BatchDetect* response by document, with an exception for each failed document"""
+        results: List[Any] = [Exception(f"{failure}: no result returned")] * count
+        for item in response['ResultList']:
+            results[item['Index']] = convert(item)
+        for error in response['ErrorList']:
+            results[error['Index']] = Exception(f"{failure}: {error['ErrorCode']}: {error.get('ErrorMessage', '')}")
+        return results
+    
     async def extract_entities(self, text: str) -> List[Dict[str, Any]]:
-        """Extract entities from text using AWS Comprehend"""
+        """Extract entities from text using AWS Comprehend; results are cached by text"""
+        return await self._cached('comprehend', 'detect_entities', f"sha256:{sha256_digest(text)}",
+                                  ['en'], lambda: self._extract_entities(text))
+    
+    async def _extract_entities(self, text: str) -> List[Dict[str, Any]]:
+        if batchable(text):
+            return await self.entity_batcher.submit(text)
+        # Documents over the batch size limit are still accepted by DetectEntities
+        return await self._detect_entities(text)
+    
+    async def _detect_entities(self, text: str) -> List[Dict[str, Any]]:
+        try:
+            response = await self._call('comprehend', 'detect_entities',
+                Text=text,
+                LanguageCode='en'
+            )
+            return self._entity_result(response)
+        
+        except ClientError as e:
+            raise Exception(f"Entity extraction failed: {str(e)}")
+    
+    async def _batch_detect_entities(self, texts: List[str]) -> List[Any]:
+        try:
+            response = await self._call('comprehend', 'batch_detect_entities',
+                TextList=texts,
+                LanguageCode='en'
+            )
+            return self._batch_results(response, len(texts), self._entity_result, 'Entity extraction failed')
+        
+        except ClientError as e:
+            raise Exception(f"Entity extraction failed: {str(e)}")
+    
+    @staticmethod
+    def _entity_result(response: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [
+            {
+                'text': entity['Text'],
+                'type': entity['Type'],
+                'confidence': entity['Score']
+            }
+            for entity in response['Entities']
+        ]
+    
+    async def extract_key_phrases(self, text: str) -> List[Dict[str, Any]]:
+        """Extract key phrases from text using AWS Comprehend"""
         try:
-            response = self.comprehend_client.detect_entities(
+            response = await self._call('comprehend', 'detect_key_phrases',
                 Text=text,
                 LanguageCode='en'
             )
             
             return [
                 {
-                    'text': entity['Text'],
-                    'type': entity['Type'],
-                    'confidence': entity['Score']
+                    'text': phrase['Text'],
+                    'confidence': phrase['Score']
                 }
-                for entity in response['Entities']
+                for phrase in response['KeyPhrases']
             ]
         
         except ClientError as e:
-            raise Exception(f"Entity extraction failed: {str(e)}")
+            raise Exception(f"Key phrase extraction failed: {str(e)}")
     
     async def analyze_image(self, s3_uri: str) -> Dict[str, Any]:
-        """Analyze image using AWS Rekognition"""
+        """Analyze image using AWS Rekognition; results are cached by image content"""
+        return await self._cached('rekognition', 'analyze_image', await self._object_digest(s3_uri),
+                                  ['labels:20:70', 'text'], lambda: self._analyze_image(s3_uri))
+    
+    async def _analyze_image(self, s3_uri: str) -> Dict[str, Any]:
         try:
             # Parse S3 URI
             bucket, key = s3_uri.replace('s3://', '').split('/', 1)
             
-            # Detect labels
-            labels_response = self.rekognition_client.detect_labels(
-                Image={
-                    'S3Object': {
-                        'Bucket': bucket,
-                        'Name': key
-                    }
-                },
-                MaxLabels=20,
-                MinConfidence=70
-            )
-            
-            # Detect text in image
-            text_response = self.rekognition_client.detect_text(
-                Image={
-                    'S3Object': {
-                        'Bucket': bucket,
-                        'Name': key
-                    }
+            image = {
+                'S3Object': {
+                    'Bucket': bucket,
+                    'Name': key
                 }
+            }
+            
+            # Detect labels and text in the image concurrently
+            labels_response, text_response = await asyncio.gather(
+                self._call('rekognition', 'detect_labels', Image=image, MaxLabels=20, MinConfidence=70),
+                self._call('rekognition', 'detect_text', Image=image)
             )
             
             return {
@@ -174,29 +473,15 @@ class AWSServices:
             raise Exception(f"Image analysis failed: {str(e)}")
     
     async def execute_workflow(self, workflow_config: Dict[str, Any]) -> Dict[str, Any]:
-        """Execute a workflow based on configuration"""
+        """Execute a workflow based on configuration
+        
+        Steps that reference another step through ``input_step`` wait for it;
+        all other steps run concurrently, up to ``max_concurrency`` at a time.
+        """
         try:
-            results = {}
-            
-            for step in workflow_config.get('steps', []):
-                step_type = step.get('type')
-                step_config = step.get('config', {})
-                
-                if step_type == 'document_analysis':
-                    s3_uri = step_config.get('input_uri')
-                    results[step['id']] = await self.analyze_document(s3_uri)
-                
-                elif step_type == 'sentiment_analysis':
-                    text = step_config.get('text') or results.get(step_config.get('input_step'), {}).get('text', '')
-                    results[step['id']] = await self.analyze_sentiment(text)
-                
-                elif step_type == 'entity_extraction':
-                    text = step_config.get('text') or results.get(step_config.get('input_step'), {}).get('text', '')
-                    results[step['id']] = await self.extract_entities(text)
-                
-                elif step_type == 'image_analysis':
-                    s3_uri = step_config.get('input_uri')
-                    results[step['id']] = await self.analyze_image(s3_uri)
+            steps = workflow_config.get('steps', [])
+            max_concurrency = workflow_config.get('max_concurrency') or self.workflow_max_concurrency
+            results = await self._run_steps(steps, max(1, int(max_concurrency)))
             
             return {
                 'status': 'completed',
@@ -211,25 +496,69 @@ class AWSServices:
                 'workflow_id': workflow_config.get('id')
             }
     
-    def _process_table(self, table_block: Dict, all_blocks: List[Dict]) -> Dict[str, Any]:
-        """Process table data from Textract response"""
-        # Simplified table processing - in production, this would be more sophisticated
-        return {
-            'id': table_block['Id'],
-            'confidence': table_block.get('Confidence', 0),
-            'rows': []  # Would extract actual table data here
-        }
-    
-    def _process_form(self, form_block: Dict, all_blocks: List[Dict]) -> Dict[str, Any]:
-        """Process form data from Textract response"""
-        # Simplified form processing - in production, this would be more sophisticated
-        return {
-            'id': form_block['Id'],
-            'confidence': form_block.get('Confidence', 0),
-            'key_value_pairs': []  # Would extract actual form data here
-        }
+    async def _run_steps(self, steps: List[Dict[str, Any]], max_concurrency: int) -> Dict[str, Any]:
+        """Run workflow steps as soon as their input step has completed"""
+        step_ids = {step['id'] for step in steps}
+        dependencies = {}
+        for step in steps:
+            input_step = step.get('config', {}).get('input_step')
+            # Steps given their text directly do not need to wait for input_step
+            if input_step in step_ids and not step.get('config', {}).get('text'):
+                dependencies[step['id']] = input_step
+        
+        # Reject dependency cycles before scheduling anything
+        for step_id in dependencies:
+            seen = {step_id}
+            current = dependencies.get(step_id)
+            while current is not None:
+                if current in seen:
+                    raise Exception(f"Circular input_step dependency at step {step_id}")
+                seen.add(current)
+                current = dependencies.get(current)
+        
+        results = {}
+        done = {step['id']: asyncio.Event() for step in steps}
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def run_step(step: Dict[str, Any]):
+            input_step = dependencies.get(step['id'])
+            if input_step is not None:
+                await done[input_step].wait()
+            async with semaphore:
+                result = await self._execute_step(step, results)
+            if result is not None:
+                results[step['id']] = result
+            done[step['id']].set()
+        
+        tasks = [asyncio.ensure_future(run_step(step)) for step in steps]
+        try:
+            await asyncio.gather(*tasks)
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        
+        # Preserve the declared step order in the results
+        return {step['id']: results[step['id']] for step in steps if step['id'] in results}
     
-    def _calculate_average_confidence(self, blocks: List[Dict]) -> float:
-        """Calculate average confidence score from Textract blocks"""
-        confidences = [block.get('Confidence', 0) for block in blocks if 'Confidence' in block]
-        return sum(confidences) / len(confidences) if confidences else 0
+    async def _execute_step(self, step: Dict[str, Any], results: Dict[str, Any]) -> Any:
+        """Execute a single workflow step"""
+        step_type = step.get('type')
+        step_config = step.get('config', {})
+        
+        if step_type == 'document_analysis':
+            return await self.analyze_document(step_config.get('input_uri'))
+        
+        elif step_type == 'sentiment_analysis':
+            text = step_config.get('text') or results.get(step_config.get('input_step'), {}).get('text', '')
+            return await self.analyze_sentiment(text)
+        
+        elif step_type == 'entity_extraction':
+            text = step_config.get('text') or results.get(step_config.get('input_step'), {}).get('text', '')
+            return await self.extract_entities(text)
+        
+        elif step_type == 'image_analysis':
+            return await self.analyze_image(step_config.get('input_uri'))
+        
+        return None
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+# Pub/sub used to share collaboration messages between backend nodes:
+# "memory" for a single node, "redis" for any Redis-compatible server
+COLLAB_BACKPLANE = os.getenv('COLLAB_BACKPLANE', 'memory')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+# Prefix of the per-session pub/sub channels
+COLLAB_CHANNEL_PREFIX = os.getenv('COLLAB_CHANNEL_PREFIX', 'collab:')
+
+logger = logging.getLogger(__name__)
+
+# Called with (session_id, data) for every message published to a subscribed session
+MessageHandler = Callable[[str, str], Awaitable[None]]
+
+class Backplane:
+    """Pub/sub channel per collaboration session, shared by all backend nodes
+
+    A node subscribes to a session while it holds at least one local socket in
+    it. Each message published to a session is delivered once to the handler
+    of every subscribed node, including the publisher.
+    """
+
+    def __init__(self):
+        self.handler: Optional[MessageHandler] = None
+        self.published = 0
+        self.received = 0
+
+    def set_handler(self, handler: MessageHandler):
+        self.handler = handler
+
+    async def subscribe(self, session_id: str):
+        raise NotImplementedError
+
+    async def unsubscribe(self, session_id: str):
+        raise NotImplementedError
+
+    async def publish(self, session_id: str, data: str):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    async def _dispatch(self, session_id: str, data: str):
+        self.received += 1
+        if self.handler is not None:
+            await self.handler(session_id, data)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'published': self.published,
+            'received': self.received
+        }
+
+class InMemoryHub:
+    """Process-local broker connecting InMemoryBackplane instances"""
+
+    def __init__(self):
+        self.subscribers: Dict[str, Set['InMemoryBackplane']] = {}
+
+class InMemoryBackplane(Backplane):
+    """Backplane for a single node; backplanes sharing a hub behave like separate nodes"""
+
+    def __init__(self, hub: InMemoryHub = None):
+        super().__init__()
+        self.hub = hub or InMemoryHub()
+        self.sessions: Set[str] = set()
+
+    async def subscribe(self, session_id: str):
+        self.sessions.add(session_id)
+        self.hub.subscribers.setdefault(session_id, set()).add(self)
+
+    async def unsubscribe(self, session_id: str):
+        self.sessions.discard(session_id)
+        subscribers = self.hub.subscribers.get(session_id)
+        if subscribers is not None:
+            subscribers.discard(self)
+            if not subscribers:
+                del self.hub.subscribers[session_id]
+
+    async def publish(self, session_id: str, data: str):
+        self.published += 1
+        for backplane in list(self.hub.subscribers.get(session_id, ())):
+            await backplane._dispatch(session_id, data)
+
+    async def close(self):
+        for session_id in list(self.sessions):
+            await self.unsubscribe(session_id)
+
+    def get_stats(self) -> Dict[str, int]:
+        stats = super().get_stats()
+        stats['subscribed_sessions'] = len(self.sessions)
+        return stats
+
+class RedisBackplane(Backplane):
+    """Backplane over Redis PUBLISH/SUBSCRIBE, one channel per session
+
+    Works with any server speaking the Redis protocol (Redis, ElastiCache,
+    Valkey). Requires the optional ``redis`` package.
+    """
+
+    def __init__(self, url: str = REDIS_URL, channel_prefix: str = COLLAB_CHANNEL_PREFIX):
+        super().__init__()
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            raise RuntimeError("COLLAB_BACKPLANE=redis requires the 'redis' package")
+
+        self.channel_prefix = channel_prefix
+        self.redis = aioredis.from_url(url)
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self.sessions: Set[str] = set()
+        self._listener: Optional[asyncio.Task] = None
+
+    def channel(self, session_id: str) -> str:
+        return f"{self.channel_prefix}{session_id}"
+
+    async def subscribe(self, session_id: str):
+        if session_id in self.sessions:
+            return
+        self.sessions.add(session_id)
+        await self.pubsub.subscribe(self.channel(session_id))
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def unsubscribe(self, session_id: str):
+        if session_id not in self.sessions:
+            return
+        self.sessions.discard(session_id)
+        await self.pubsub.unsubscribe(self.channel(session_id))
+
+    async def publish(self, session_id: str, data: str):
+        self.published += 1
+        await self.redis.publish(self.channel(session_id), data)
+
+    async def _listen(self):
+        while True:
+            try:
+                if not self.sessions:
+                    # get_message() returns immediately while nothing is subscribed
+                    await asyncio.sleep(1.0)
+                    continue
+                message = await self.pubsub.get_message(timeout=1.0)
+                if message is None or message['type'] != 'message':
+                    continue
+
+                channel = message['channel']
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                data = message['data']
+                if isinstance(data, bytes):
+                    data = data.decode()
+                await self._dispatch(channel[len(self.channel_prefix):], data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Backplane listener error: {str(e)}")
+                await asyncio.sleep(1.0)
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+        await self.pubsub.close()
+        await self.redis.close()
+
+    def get_stats(self) -> Dict[str, int]:
+        stats = super().get_stats()
+        stats['subscribed_sessions'] = len(self.sessions)
+        return stats
+
+def create_backplane(kind: str = COLLAB_BACKPLANE) -> Backplane:
+    """Build the backplane selected by COLLAB_BACKPLANE"""
+    if kind == 'memory':
+        return InMemoryBackplane()
+    if kind == 'redis':
+        return RedisBackplane()
+    raise ValueError(f"Unknown collaboration backplane: {kind}")
@@ -0,0 +1,179 @@
+import copy
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+from models import Workflow
+from database import SessionLocal
+from workflow_versions import record_version, latest_version, lock_workflow
+
+# Patch operations accepted by SessionGraph.apply
+PATCH_OPERATIONS = ('add_node', 'move_node', 'update_node', 'remove_node', 'add_edge', 'remove_edge')
+
+class PatchError(ValueError):
+    """Raised when a patch operation does not apply to the current graph"""
+
+class GraphConflict(Exception):
+    """Raised when a workflow was saved outside the session since its graph was loaded"""
+
+class SessionGraph:
+    """Authoritative node/edge graph of the workflow edited in a collaboration session
+
+    Clients send lists of patch operations; each patch that changes the graph
+    bumps the version by one, so clients can detect missed deltas.
+    """
+
+    def __init__(self, workflow_id: int, nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]], version: int = 0,
+                 project_id: int = None, saved_version: Optional[int] = None):
+        self.workflow_id = workflow_id
+        # Project the workflow was loaded from; snapshots are only written back to it
+        self.project_id = project_id
+        # Stored WorkflowVersion this graph is based on
+        self.saved_version = saved_version
+        self.nodes: Dict[str, Dict[str, Any]] = {str(node['id']): node for node in nodes or []}
+        self.edges: Dict[str, Dict[str, Any]] = {str(edge['id']): edge for edge in edges or []}
+        self.version = version
+        # Changed since the last persisted snapshot
+        self.dirty = False
+
+    def apply(self, ops: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Apply operations in order; returns the applied and the rejected ones"""
+        applied, rejected = [], []
+        for op in ops:
+            try:
+                applied.append(self._apply_op(op))
+            except PatchError as e:
+                rejected.append({'op': op, 'error': str(e)})
+
+        if applied:
+            self.version += 1
+            self.dirty = True
+        return applied, rejected
+
+    def _apply_op(self, op: Dict[str, Any]) -> Dict[str, Any]:
+        kind = op.get('op') if isinstance(op, dict) else None
+        if kind not in PATCH_OPERATIONS:
+            raise PatchError(f"Unknown operation: {kind}")
+
+        if kind == 'add_node':
+            node = op.get('node') or {}
+            node_id = str(node.get('id', ''))
+            if not node_id or node_id in self.nodes:
+                raise PatchError(f"Cannot add node {node_id!r}")
+            self.nodes[node_id] = node
+            return op
+
+        if kind == 'add_edge':
+            edge = op.get('edge') or {}
+            edge_id = str(edge.get('id', ''))
+            if not edge_id or edge_id in self.edges:
+                raise PatchError(f"Cannot add edge {edge_id!r}")
+            if str(edge.get('source')) not in self.nodes or str(edge.get('target')) not in self.nodes:
+                raise PatchError(f"Edge {edge_id!r} references an unknown node")
+            self.edges[edge_id] = edge
+            return op
+
+        if kind == 'remove_edge':
+            if self.edges.pop(str(op.get('id')), None) is None:
+                raise PatchError(f"Unknown edge: {op.get('id')!r}")
+            return op
+
+        node_id = str(op.get('id'))
+        if node_id not in self.nodes:
+            raise PatchError(f"Unknown node: {op.get('id')!r}")
+
+        if kind == 'move_node':
+            self.nodes[node_id] = {**self.nodes[node_id], 'position': op.get('position')}
+            return op
+
+        if kind == 'update_node':
+            self.nodes[node_id] = {**(op.get('node') or {}), 'id': self.nodes[node_id]['id']}
+            return op
+
+        # remove_node also drops the node's edges; they are listed so clients need not infer them
+        del self.nodes[node_id]
+        removed_edges = [edge_id for edge_id, edge in self.edges.items()
+                         if str(edge.get('source')) == node_id or str(edge.get('target')) == node_id]
+        for edge_id in removed_edges:
+            del self.edges[edge_id]
+        return {**op, 'removed_edges': removed_edges}
+
+    def diff(self, nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Operations turning the current graph into the given full graph"""
+        new_nodes = {str(node['id']): node for node in nodes or []}
+        new_edges = {str(edge['id']): edge for edge in edges or []}
+        ops = []
+
+        for edge_id, edge in self.edges.items():
+            if new_edges.get(edge_id) != edge:
+                ops.append({'op': 'remove_edge', 'id': edge['id']})
+        for node_id, node in self.nodes.items():
+            if node_id not in new_nodes:
+                ops.append({'op': 'remove_node', 'id': node['id']})
+
+        for node_id, node in new_nodes.items():
+            current = self.nodes.get(node_id)
+            if current is None:
+                ops.append({'op': 'add_node', 'node': node})
+            elif current != node:
+                if {**current, 'position': node.get('position')} == node:
+                    ops.append({'op': 'move_node', 'id': node['id'], 'position': node.get('position')})
+                else:
+                    ops.append({'op': 'update_node', 'id': node['id'], 'node': node})
+        for edge_id, edge in new_edges.items():
+            if self.edges.get(edge_id) != edge:
+                ops.append({'op': 'add_edge', 'edge': edge})
+
+        return ops
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Full graph and version, for clients that join or fall behind"""
+        return {
+            'workflow_id': self.workflow_id,
+            'version': self.version,
+            'nodes': list(self.nodes.values()),
+            'edges': list(self.edges.values())
+        }
+
+class WorkflowGraphStore:
+    """Loads and saves the nodes/edges columns of a project's workflow, recording each save as a version"""
+
+    def load(self, workflow_id: int, project_id: int) -> Optional[Tuple[List[Any], List[Any], Optional[int]]]:
+        """Nodes, edges and latest stored version number of a workflow"""
+        db = SessionLocal()
+        try:
+            row = db.query(Workflow.nodes, Workflow.edges).filter(
+                Workflow.id == workflow_id, Workflow.project_id == project_id
+            ).first()
+            if row is None:
+                return None
+            latest = latest_version(db, workflow_id)
+            return copy.deepcopy(row.nodes or []), copy.deepcopy(row.edges or []), latest.version if latest else None
+        finally:
+            db.close()
+
+    def save(self, workflow_id: int, project_id: int, nodes: List[Any], edges: List[Any],
+             base_version: Optional[int] = None) -> Optional[int]:
+        """Write a session graph and return its version number
+
+        Raises GraphConflict if another version (an HTTP save or a restore)
+        was stored after base_version, rather than overwriting it.
+        """
+        db = SessionLocal()
+        try:
+            lock_workflow(db, workflow_id)
+            latest = latest_version(db, workflow_id)
+            if (latest.version if latest else None) != base_version:
+                raise GraphConflict(f"Workflow {workflow_id} was changed outside the session")
+
+            updated = db.query(Workflow).filter(Workflow.id == workflow_id, Workflow.project_id == project_id).update(
+                {'nodes': nodes, 'edges': edges, 'updated_at': datetime.utcnow()},
+                synchronize_session=False
+            )
+            if not updated:
+                # The workflow was deleted or moved to another project
+                return None
+            version = record_version(db, workflow_id, nodes, edges).version
+            db.commit()
+            return version
+        finally:
+            db.close()
@@ -0,0 +1,97 @@
+import asyncio
+import os
+from typing import Dict, Any, Awaitable, Callable, List, Set, Tuple
+
+# Documents per BatchDetect* call; Comprehend accepts at most 25
+COMPREHEND_BATCH_SIZE = min(int(os.getenv('COMPREHEND_BATCH_SIZE', '25')), 25)
+# Seconds a request waits for others to share its batch
+COMPREHEND_BATCH_WINDOW = float(os.getenv('COMPREHEND_BATCH_WINDOW', '0.01'))
+# Largest document the BatchDetect* APIs accept, in UTF-8 bytes
+COMPREHEND_BATCH_MAX_TEXT_BYTES = 5000
+
+def batchable(text: str) -> bool:
+    """Whether a document can share a batch call; empty or oversized ones would fail the whole batch"""
+    return bool(text) and len(text.encode('utf-8')) <= COMPREHEND_BATCH_MAX_TEXT_BYTES
+
+class BatchFailed(Exception):
+    """Raised to each request of a batch call that failed as a whole; the call's error is its cause"""
+    pass
+
+class MicroBatcher:
+    """Collects concurrent single-document requests into batch calls
+
+    A request waits at most ``window`` seconds for others to join its batch;
+    a full batch is sent straight away. ``run_batch`` takes the batch's texts
+    and returns one result per text, in order, where an exception instance
+    fails only the request it belongs to.
+    """
+
+    def __init__(self, run_batch: Callable[[List[str]], Awaitable[List[Any]]],
+                 max_batch_size: int = COMPREHEND_BATCH_SIZE, window: float = COMPREHEND_BATCH_WINDOW):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self.pending: List[Tuple[str, asyncio.Future]] = []
+        self.flush_task = None
+        self.running: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.documents = 0
+
+    async def submit(self, text: str) -> Any:
+        """Queue a document for the next batch and wait for its result"""
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((text, future))
+        if len(self.pending) >= self.max_batch_size:
+            self._send(self.max_batch_size)
+        elif self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_after_window())
+        return await future
+
+    async def _flush_after_window(self):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            self.flush_task = None
+        while self.pending:
+            self._send(self.max_batch_size)
+
+    def _send(self, count: int):
+        batch, self.pending = self.pending[:count], self.pending[count:]
+        task = asyncio.create_task(self._run(batch))
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]):
+        self.batches += 1
+        self.documents += len(batch)
+        try:
+            results = await self.run_batch([text for text, _ in batch])
+        except Exception as e:
+            # A separate exception per caller, so raising it in one caller
+            # does not extend the traceback the others see
+            results = [self._batch_failed(e) for _ in batch]
+
+        for (_, future), result in zip(batch, results):
+            # Skip callers that were cancelled while the batch ran
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    @staticmethod
+    def _batch_failed(error: Exception) -> BatchFailed:
+        failure = BatchFailed(str(error))
+        failure.__cause__ = error
+        return failure
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get batch counts and the queue of documents waiting for a batch"""
+        return {
+            'pending': len(self.pending),
+            'in_flight_batches': len(self.running),
+            'batches': self.batches,
+            'documents': self.documents,
+            'average_batch_size': round(self.documents / self.batches, 2) if self.batches else 0
+        }
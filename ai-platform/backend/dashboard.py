@@ -0,0 +1,70 @@
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from sqlalchemy import select, func, case, distinct
+from sqlalchemy.sql import Select
+
+from models import Project, Workflow, WorkflowExecution
+
+# Seconds a user's dashboard counters are served from memory
+DASHBOARD_CACHE_TTL_SECONDS = float(os.getenv("DASHBOARD_CACHE_TTL_SECONDS", "5"))
+
+def dashboard_stats_query(user_id: int) -> Select:
+    """Build a single aggregate query for all of a user's dashboard counters"""
+    return (
+        select(
+            func.count(distinct(Project.id)).label("total_projects"),
+            func.count(distinct(case((Workflow.status == "active", Workflow.id)))).label("active_workflows"),
+            func.count(case((WorkflowExecution.status == "completed", WorkflowExecution.id))).label("completed_tasks"),
+            # Every workflow run calls the AI services
+            func.count(WorkflowExecution.id).label("ai_services_used")
+        )
+        .select_from(Project)
+        .outerjoin(Workflow, Workflow.project_id == Project.id)
+        .outerjoin(WorkflowExecution, WorkflowExecution.workflow_id == Workflow.id)
+        .where(Project.owner_id == user_id)
+    )
+
+def dashboard_stats_from_row(row) -> Dict[str, int]:
+    """Convert the aggregate row into the dashboard response"""
+    return {
+        "total_projects": row.total_projects or 0,
+        "active_workflows": row.active_workflows or 0,
+        "completed_tasks": row.completed_tasks or 0,
+        "ai_services_used": row.ai_services_used or 0
+    }
+
+class DashboardCache:
+    """Short-lived per-user cache of dashboard counters"""
+
+    def __init__(self, ttl_seconds: float = DASHBOARD_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[int, Tuple[float, Dict[str, int]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[Dict[str, int]]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            return entry[1]
+
+    def set(self, user_id: int, stats: Dict[str, int]):
+        now = time.monotonic()
+        with self._lock:
+            self._entries[user_id] = (now + self.ttl_seconds, stats)
+            # Drop expired entries of users who have not come back
+            if len(self._entries) > 10000:
+                self._entries = {key: entry for key, entry in self._entries.items() if entry[0] > now}
+
+    def invalidate(self, user_id: int):
+        """Drop a user's counters after a project, workflow or execution write"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+# Global dashboard cache instance
+dashboard_cache = DashboardCache()
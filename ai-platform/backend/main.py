@@ -1,19 +1,32 @@
-from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File
+from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File, Form, Body, Query, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.orm import Session, load_only
 from typing import List, Optional, Dict, Any
+import asyncio
 import os
-import json
+import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
 from dotenv import load_dotenv
 
-from database import get_db, engine
-from models import Base, User, Project, Workflow
-from schemas import UserCreate, UserResponse, ProjectCreate, ProjectResponse, WorkflowCreate, WorkflowResponse, UserLogin
-from auth import get_password_hash, verify_password, create_access_token, verify_token
+from database import get_db, engine, get_pool_stats, ASYNC_DB_ENABLED
+from models import Base, User, Project, Workflow, WorkflowVersion, WorkflowExecution
+from schemas import UserCreate, UserResponse, ProjectCreate, ProjectResponse, WorkflowCreate, WorkflowResponse, UserLogin, WorkflowExecutionResponse
+from schemas import WorkflowVersionResponse, WorkflowVersionDetail
+from schemas import ProjectListItem, WorkflowListItem, PROJECT_LIST_FIELDS, PROJECT_SUMMARY_FIELDS, WORKFLOW_LIST_FIELDS, WORKFLOW_SUMMARY_FIELDS
+from auth import create_access_token, password_hasher, PasswordHasherOverloaded
 from aws_services import AWSServices
+from token_cache import token_cache, UserSnapshot
+from dashboard import dashboard_stats_query, dashboard_stats_from_row, dashboard_cache
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, keyset_filter, keyset_order, parse_fields, paginate, select_fields, columns_for
+from workflow_engine import WorkflowEngine
+from workflow_versions import record_version, latest_version, get_version, materialize, diff_versions
+from textract_jobs import TextractJobRunner, TEXTRACT_JOB_KIND, execution_channel
+from websocket_manager import manager
+from route_helpers import owned_project_query, owned_workflow_query, found_or_404, token_user_id, remember_user
+from route_helpers import project_response, workflow_response, workflow_list_items
+import async_routes
 
 # Load environment variables
 load_dotenv()
@@ -21,11 +34,20 @@ load_dotenv()
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Take over Textract jobs whose worker stopped renewing its lease, e.g. after a restart
+    recovery = asyncio.create_task(textract_jobs.run_recovery())
+    yield
+    recovery.cancel()
+    await manager.shutdown()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="AI Platform API",
     description="AI Consulting Platform Backend API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -35,28 +57,36 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
+# Serve the project, workflow and dashboard endpoints from AsyncSession handlers
+# when enabled; routes registered first take precedence over the sync handlers
+if ASYNC_DB_ENABLED:
+    app.include_router(async_routes.router)
+
 # Initialize AWS services
 aws_services = AWSServices()
+workflow_engine = WorkflowEngine(aws_services)
+textract_jobs = TextractJobRunner(aws_services, notifier=manager)
 
 # Security
 security = HTTPBearer()
 
+def _user_for_token(token: str, db: Session) -> UserSnapshot:
+    """Authenticate a bearer token, raising 401 when it is not valid"""
+    # Recently verified tokens skip signature verification and the users lookup
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached.user
+    
+    payload, user_id = token_user_id(token)
+    user = db.query(User).filter(User.id == user_id).first()
+    return remember_user(token, payload, user)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
     """Get current authenticated user"""
-    try:
-        payload = verify_token(credentials.credentials)
-        user_id = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        user = db.query(User).filter(User.id == user_id).first()
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user
-    except Exception as e:
-        raise HTTPException(status_code=401, detail="Invalid token")
+    return _user_for_token(credentials.credentials, db)
 
 # Health check endpoint
 @app.get("/")
@@ -69,6 +99,19 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "timestamp": datetime.utcnow()}
 
+@app.get("/metrics")
+async def get_metrics():
+    """Internal worker pool metrics"""
+    return {
+        "password_hashing": password_hasher.get_stats(),
+        "token_cache": token_cache.get_stats(),
+        "database_pool": get_pool_stats(),
+        "aws_clients": aws_services.get_client_stats(),
+        "result_cache": aws_services.result_cache.get_stats(),
+        "comprehend_batching": aws_services.get_batch_stats(),
+        "textract_jobs": textract_jobs.get_stats()
+    }
+
 # Authentication endpoints
 @app.post("/auth/register", response_model=UserResponse)
 async def register(user_data: UserCreate, db: Session = Depends(get_db)):
@@ -79,7 +122,10 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create new user
-    hashed_password = get_password_hash(user_data.password)
+    try:
+        hashed_password = await password_hasher.hash(user_data.password)
+    except PasswordHasherOverloaded:
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
     user = User(
         email=user_data.email,
         hashed_password=hashed_password,
@@ -104,7 +150,15 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
 async def login(user_data: UserLogin, db: Session = Depends(get_db)):
     """Login user"""
     user = db.query(User).filter(User.email == user_data.email).first()
-    if not user or not verify_password(user_data.password, user.hashed_password):
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    try:
+        password_valid = await password_hasher.verify(user_data.password, user.hashed_password)
+    except PasswordHasherOverloaded:
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+    
+    if not password_valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     if not user.is_active:
@@ -115,39 +169,48 @@ async def login(user_data: UserLogin, db: Session = Depends(get_db)):
 
 # Dashboard endpoints
 @app.get("/dashboard/stats")
-async def get_dashboard_stats(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_dashboard_stats(current_user: UserSnapshot = Depends(get_current_user), db: Session = Depends(get_db)):
     """Get dashboard statistics"""
-    total_projects = db.query(Project).filter(Project.owner_id == current_user.id).count()
-    active_workflows = db.query(Workflow).join(Project).filter(
-        Project.owner_id == current_user.id,
-        Workflow.status == "active"
-    ).count()
+    stats = dashboard_cache.get(current_user.id)
+    if stats is None:
+        row = db.execute(dashboard_stats_query(current_user.id)).one()
+        stats = dashboard_stats_from_row(row)
+        dashboard_cache.set(current_user.id, stats)
     
-    return {
-        "total_projects": total_projects,
-        "active_workflows": active_workflows,
-        "completed_tasks": 0,  # TODO: Implement task tracking
-        "ai_services_used": 3  # Static for now
-    }
+    return stats
 
 # Project endpoints
-@app.get("/projects", response_model=List[ProjectResponse])
-async def get_projects(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Get user's projects"""
-    projects = db.query(Project).filter(Project.owner_id == current_user.id).all()
-    return [ProjectResponse(
-        id=p.id,
-        name=p.name,
-        description=p.description,
-        industry=p.industry,
-        objectives=p.objectives,
-        status=p.status,
-        created_at=p.created_at,
-        updated_at=p.updated_at
-    ) for p in projects]
+def _get_owned_project(db: Session, project_id: int, user_id: int) -> Project:
+    """Load a project owned by the user or raise 404"""
+    return found_or_404(db.execute(owned_project_query(project_id, user_id)).scalar_one_or_none(), "Project not found")
+
+@app.get("/projects", response_model=List[ProjectListItem], response_model_exclude_unset=True)
+async def get_projects(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    summary: bool = False,
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get user's projects, one keyset page at a time"""
+    selected = parse_fields(fields, PROJECT_LIST_FIELDS, PROJECT_SUMMARY_FIELDS if summary else PROJECT_LIST_FIELDS)
+    
+    query = db.query(Project).options(load_only(*columns_for(Project, selected))).filter(
+        Project.owner_id == current_user.id
+    )
+    if cursor:
+        query = query.filter(keyset_filter(Project, cursor))
+    rows = query.order_by(*keyset_order(Project)).limit(limit + 1).all()
+    
+    projects, next_cursor = paginate(rows, limit)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return [select_fields(p, selected) for p in projects]
 
 @app.post("/projects", response_model=ProjectResponse)
-async def create_project(project_data: ProjectCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def create_project(project_data: ProjectCreate, current_user: UserSnapshot = Depends(get_current_user), db: Session = Depends(get_db)):
     """Create a new project"""
     project = Project(
         name=project_data.name,
@@ -160,187 +223,349 @@ async def create_project(project_data: ProjectCreate, current_user: User = Depen
     db.add(project)
     db.commit()
     db.refresh(project)
+    dashboard_cache.invalidate(current_user.id)
     
-    return ProjectResponse(
-        id=project.id,
-        name=project.name,
-        description=project.description,
-        industry=project.industry,
-        objectives=project.objectives,
-        status=project.status,
-        created_at=project.created_at,
-        updated_at=project.updated_at
-    )
+    return project_response(project)
 
 @app.get("/projects/{project_id}", response_model=ProjectResponse)
-async def get_project(project_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_project(project_id: int, current_user: UserSnapshot = Depends(get_current_user), db: Session = Depends(get_db)):
     """Get a specific project"""
-    project = db.query(Project).filter(
-        Project.id == project_id,
-        Project.owner_id == current_user.id
-    ).first()
+    project = _get_owned_project(db, project_id, current_user.id)
     
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found")
-    
-    return ProjectResponse(
-        id=project.id,
-        name=project.name,
-        description=project.description,
-        industry=project.industry,
-        objectives=project.objectives,
-        status=project.status,
-        created_at=project.created_at,
-        updated_at=project.updated_at
-    )
+    return project_response(project)
 
 # Workflow endpoints
-@app.get("/projects/{project_id}/workflows", response_model=List[WorkflowResponse])
-async def get_workflows(project_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Get workflows for a project"""
-    # Verify project ownership
-    project = db.query(Project).filter(
-        Project.id == project_id,
-        Project.owner_id == current_user.id
-    ).first()
+@app.get("/projects/{project_id}/workflows", response_model=List[WorkflowListItem], response_model_exclude_unset=True)
+async def get_workflows(
+    project_id: int,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    summary: bool = False,
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get workflows for a project, one keyset page at a time"""
+    _get_owned_project(db, project_id, current_user.id)
+    
+    selected = parse_fields(fields, WORKFLOW_LIST_FIELDS, WORKFLOW_SUMMARY_FIELDS if summary else WORKFLOW_LIST_FIELDS)
+    
+    # Only the requested columns are loaded, so summaries never fetch the graph
+    query = db.query(Workflow).options(load_only(*columns_for(Workflow, selected))).filter(
+        Workflow.project_id == project_id
+    )
+    if cursor:
+        query = query.filter(keyset_filter(Workflow, cursor))
+    rows = query.order_by(*keyset_order(Workflow)).limit(limit + 1).all()
     
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found")
-    
-    workflows = db.query(Workflow).filter(Workflow.project_id == project_id).all()
-    return [WorkflowResponse(
-        id=w.id,
-        name=w.name,
-        description=w.description,
-        status=w.status,
-        nodes=json.loads(w.nodes) if w.nodes else [],
-        edges=json.loads(w.edges) if w.edges else [],
-        created_at=w.created_at,
-        updated_at=w.updated_at
-    ) for w in workflows]
+    workflows, next_cursor = paginate(rows, limit)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    
+    return workflow_list_items(workflows, selected)
 
 @app.post("/projects/{project_id}/workflows", response_model=WorkflowResponse)
 async def create_workflow(
     project_id: int, 
     workflow_data: WorkflowCreate, 
-    current_user: User = Depends(get_current_user), 
+    current_user: UserSnapshot = Depends(get_current_user), 
     db: Session = Depends(get_db)
 ):
     """Create a new workflow"""
-    # Verify project ownership
-    project = db.query(Project).filter(
-        Project.id == project_id,
-        Project.owner_id == current_user.id
-    ).first()
-    
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found")
+    _get_owned_project(db, project_id, current_user.id)
     
     workflow = Workflow(
         name=workflow_data.name,
         description=workflow_data.description,
         project_id=project_id,
-        nodes=json.dumps(workflow_data.nodes) if workflow_data.nodes else "[]",
-        edges=json.dumps(workflow_data.edges) if workflow_data.edges else "[]"
+        nodes=workflow_data.nodes or [],
+        edges=workflow_data.edges or []
     )
     
     db.add(workflow)
+    db.flush()
+    record_version(db, workflow.id, workflow.nodes, workflow.edges, author_id=current_user.id)
     db.commit()
     db.refresh(workflow)
+    dashboard_cache.invalidate(current_user.id)
     
-    return WorkflowResponse(
-        id=workflow.id,
-        name=workflow.name,
-        description=workflow.description,
-        status=workflow.status,
-        nodes=json.loads(workflow.nodes) if workflow.nodes else [],
-        edges=json.loads(workflow.edges) if workflow.edges else [],
-        created_at=workflow.created_at,
-        updated_at=workflow.updated_at
-    )
+    return workflow_response(workflow)
 
 @app.put("/workflows/{workflow_id}", response_model=WorkflowResponse)
 async def update_workflow(
     workflow_id: int,
     workflow_data: WorkflowCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: UserSnapshot = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Update a workflow"""
-    workflow = db.query(Workflow).join(Project).filter(
-        Workflow.id == workflow_id,
-        Project.owner_id == current_user.id
-    ).first()
-    
-    if not workflow:
-        raise HTTPException(status_code=404, detail="Workflow not found")
+    workflow = _get_owned_workflow(db, workflow_id, current_user.id)
     
     workflow.name = workflow_data.name
     workflow.description = workflow_data.description
-    workflow.nodes = json.dumps(workflow_data.nodes) if workflow_data.nodes else "[]"
-    workflow.edges = json.dumps(workflow_data.edges) if workflow_data.edges else "[]"
+    workflow.nodes = workflow_data.nodes or []
+    workflow.edges = workflow_data.edges or []
     workflow.updated_at = datetime.utcnow()
+    saved = record_version(db, workflow.id, workflow.nodes, workflow.edges, author_id=current_user.id)
     
     db.commit()
     db.refresh(workflow)
+    dashboard_cache.invalidate(current_user.id)
+    # Collaboration sessions editing the workflow would otherwise save over this update
+    await manager.reload_workflow(workflow.id, saved.version)
     
-    return WorkflowResponse(
-        id=workflow.id,
-        name=workflow.name,
-        description=workflow.description,
-        status=workflow.status,
-        nodes=json.loads(workflow.nodes) if workflow.nodes else [],
-        edges=json.loads(workflow.edges) if workflow.edges else [],
-        created_at=workflow.created_at,
-        updated_at=workflow.updated_at
+    return workflow_response(workflow)
+
+def _get_owned_workflow(db: Session, workflow_id: int, user_id: int) -> Workflow:
+    """Load a workflow in one of the user's projects or raise 404"""
+    return found_or_404(db.execute(owned_workflow_query(workflow_id, user_id)).scalar_one_or_none(), "Workflow not found")
+
+def _get_workflow_version(db: Session, workflow_id: int, version: int) -> WorkflowVersion:
+    workflow_version = get_version(db, workflow_id, version)
+    if not workflow_version:
+        raise HTTPException(status_code=404, detail="Workflow version not found")
+    return workflow_version
+
+def _version_response(version: WorkflowVersion) -> WorkflowVersionResponse:
+    return WorkflowVersionResponse(
+        version=version.version,
+        graph_hash=version.graph_hash,
+        node_count=len(version.nodes or []),
+        edge_count=len(version.edges or []),
+        restored_from=version.restored_from,
+        author_id=version.author_id,
+        created_at=version.created_at
     )
 
-@app.post("/workflows/{workflow_id}/execute")
+# Workflow version endpoints
+@app.get("/workflows/{workflow_id}/versions", response_model=List[WorkflowVersionResponse])
+async def get_workflow_versions(
+    workflow_id: int,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[int] = None,
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """List a workflow's versions, newest first"""
+    _get_owned_workflow(db, workflow_id, current_user.id)
+    
+    query = db.query(WorkflowVersion).filter(WorkflowVersion.workflow_id == workflow_id)
+    if before is not None:
+        query = query.filter(WorkflowVersion.version < before)
+    versions = query.order_by(WorkflowVersion.version.desc()).limit(limit).all()
+    
+    return [_version_response(v) for v in versions]
+
+@app.get("/workflows/{workflow_id}/versions/{version}", response_model=WorkflowVersionDetail)
+async def get_workflow_version(
+    workflow_id: int,
+    version: int,
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get the full graph of a workflow version"""
+    _get_owned_workflow(db, workflow_id, current_user.id)
+    workflow_version = _get_workflow_version(db, workflow_id, version)
+    
+    nodes, edges = materialize(db, workflow_version)
+    return WorkflowVersionDetail(**_version_response(workflow_version).model_dump(), nodes=nodes, edges=edges)
+
+@app.get("/workflows/{workflow_id}/diff")
+async def diff_workflow_versions(
+    workflow_id: int,
+    from_version: int,
+    to_version: Optional[int] = None,
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Nodes and edges added, changed or removed between two versions (default: up to the latest)"""
+    _get_owned_workflow(db, workflow_id, current_user.id)
+    
+    old = _get_workflow_version(db, workflow_id, from_version)
+    if to_version is None:
+        new = latest_version(db, workflow_id)
+    else:
+        new = _get_workflow_version(db, workflow_id, to_version)
+    
+    return diff_versions(db, old, new)
+
+@app.post("/workflows/{workflow_id}/versions/{version}/restore", response_model=WorkflowResponse)
+async def restore_workflow_version(
+    workflow_id: int,
+    version: int,
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Roll a workflow back to an earlier version, recorded as a new version"""
+    workflow = _get_owned_workflow(db, workflow_id, current_user.id)
+    workflow_version = _get_workflow_version(db, workflow_id, version)
+    
+    workflow.nodes, workflow.edges = materialize(db, workflow_version)
+    workflow.updated_at = datetime.utcnow()
+    saved = record_version(db, workflow.id, workflow.nodes, workflow.edges, author_id=current_user.id, restored_from=version)
+    
+    db.commit()
+    db.refresh(workflow)
+    # Collaboration sessions editing the workflow would otherwise save over the restore
+    await manager.reload_workflow(workflow.id, saved.version)
+    
+    return workflow_response(workflow)
+
+@app.post("/workflows/{workflow_id}/execute", response_model=WorkflowExecutionResponse)
 async def execute_workflow(
     workflow_id: int,
-    current_user: User = Depends(get_current_user),
+    input_data: Optional[Dict[str, Any]] = Body(None),
+    current_user: UserSnapshot = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Execute a workflow"""
-    workflow = db.query(Workflow).join(Project).filter(
-        Workflow.id == workflow_id,
-        Project.owner_id == current_user.id
-    ).first()
+    workflow = _get_owned_workflow(db, workflow_id, current_user.id)
     
-    if not workflow:
-        raise HTTPException(status_code=404, detail="Workflow not found")
-    
-    # Update workflow status
+    # Mark the workflow as running for the duration of the execution
+    previous_status = workflow.status
     workflow.status = "running"
     workflow.updated_at = datetime.utcnow()
     db.commit()
     
-    # TODO: Implement actual workflow execution logic
-    # For now, just return success
-    return {"message": "Workflow execution started", "workflow_id": workflow_id}
+    try:
+        execution = await workflow_engine.execute(db, workflow, input_data)
+    finally:
+        workflow.status = previous_status
+        db.commit()
+        dashboard_cache.invalidate(current_user.id)
+    
+    return WorkflowExecutionResponse(
+        id=execution.id,
+        workflow_id=execution.workflow_id,
+        status=execution.status,
+        input_data=execution.input_data,
+        output_data=execution.output_data,
+        error_message=execution.error_message,
+        execution_time=execution.execution_time,
+        started_at=execution.started_at,
+        completed_at=execution.completed_at
+    )
 
 # AI Services endpoints
+def _upload_key(user_id: int, filename: Optional[str]) -> str:
+    """S3 key for a user's upload; the random prefix keeps same-named files apart"""
+    return f"uploads/{user_id}/{uuid.uuid4().hex}/{os.path.basename(filename or '') or 'upload'}"
+
 @app.post("/ai/textract/analyze")
 async def analyze_document(
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user)
+    current_user: UserSnapshot = Depends(get_current_user)
 ):
     """Analyze document with AWS Textract"""
     try:
-        content = await file.read()
-        result = aws_services.analyze_document(content)
-        return {"result": result, "filename": file.filename}
+        # Stream the upload to S3 instead of reading it into memory
+        s3_uri = await aws_services.upload_file(file, _upload_key(current_user.id, file.filename), content_type=file.content_type)
+        result = await aws_services.analyze_document(s3_uri)
+        return {"result": result, "filename": file.filename, "s3_uri": s3_uri}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Document analysis failed: {str(e)}")
 
+@app.post("/ai/textract/jobs", status_code=202)
+async def start_document_analysis_job(
+    workflow_id: int = Form(...),
+    file: UploadFile = File(...),
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Start an asynchronous Textract analysis of a multi-page document
+    
+    Returns immediately; poll GET /ai/textract/jobs/{execution_id} or connect
+    to /ws/executions/{execution_id} for textract_progress messages.
+    """
+    _get_owned_workflow(db, workflow_id, current_user.id)
+    
+    try:
+        s3_uri = await aws_services.upload_file(file, _upload_key(current_user.id, file.filename), content_type=file.content_type)
+        execution = await textract_jobs.start(db, workflow_id, s3_uri, file.filename)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Document analysis failed: {str(e)}")
+    
+    return {
+        "execution_id": execution.id,
+        "job_id": execution.input_data["job_id"],
+        "status": execution.status,
+        "channel": execution_channel(execution.id)
+    }
+
+def _get_owned_textract_job(db: Session, execution_id: int, user_id: int) -> WorkflowExecution:
+    execution = db.query(WorkflowExecution).join(Workflow).join(Project).filter(
+        WorkflowExecution.id == execution_id,
+        Project.owner_id == user_id
+    ).first()
+    
+    if not execution or (execution.input_data or {}).get("kind") != TEXTRACT_JOB_KIND:
+        raise HTTPException(status_code=404, detail="Analysis job not found")
+    return execution
+
+@app.get("/ai/textract/jobs/{execution_id}", response_model=WorkflowExecutionResponse)
+async def get_document_analysis_job(
+    execution_id: int,
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get the progress or result of an asynchronous Textract analysis"""
+    execution = _get_owned_textract_job(db, execution_id, current_user.id)
+    
+    return WorkflowExecutionResponse(
+        id=execution.id,
+        workflow_id=execution.workflow_id,
+        status=execution.status,
+        input_data=execution.input_data,
+        output_data=execution.output_data,
+        error_message=execution.error_message,
+        execution_time=execution.execution_time,
+        started_at=execution.started_at,
+        completed_at=execution.completed_at
+    )
+
+@app.websocket("/ws/executions/{execution_id}")
+async def execution_progress(
+    websocket: WebSocket,
+    execution_id: int,
+    token: str = Query(...),
+    encoding: Optional[str] = Query(None),
+    db: Session = Depends(get_db)
+):
+    """Stream textract_progress messages of an asynchronous Textract analysis
+    
+    Browsers cannot set headers on WebSocket requests, so the access token is
+    passed as the ``token`` query parameter.
+    """
+    try:
+        current_user = _user_for_token(token, db)
+        _get_owned_textract_job(db, execution_id, current_user.id)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    finally:
+        # Release the connection before the socket settles in for the job's lifetime
+        db.close()
+    
+    # Progress subscribers only listen, so they are not expected to answer pings
+    await manager.connect(websocket, execution_channel(execution_id), current_user.id, current_user.full_name,
+                          encoding=encoding, listen_only=True)
+    try:
+        while True:
+            await manager.handle_message(websocket, await websocket.receive_json())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        manager.disconnect(websocket)
+
 @app.post("/ai/comprehend/sentiment")
 async def analyze_sentiment(
     text: Dict[str, str],
-    current_user: User = Depends(get_current_user)
+    current_user: UserSnapshot = Depends(get_current_user)
 ):
     """Analyze text sentiment with AWS Comprehend"""
     try:
-        result = aws_services.analyze_sentiment(text["text"])
+        result = await aws_services.analyze_sentiment(text["text"])
         return {"result": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Sentiment analysis failed: {str(e)}")
@@ -348,13 +573,14 @@ async def analyze_sentiment(
 @app.post("/ai/rekognition/analyze")
 async def analyze_image(
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user)
+    current_user: UserSnapshot = Depends(get_current_user)
 ):
     """Analyze image with AWS Rekognition"""
     try:
-        content = await file.read()
-        result = aws_services.analyze_image(content)
-        return {"result": result, "filename": file.filename}
+        # Stream the upload to S3 instead of reading it into memory
+        s3_uri = await aws_services.upload_file(file, _upload_key(current_user.id, file.filename), content_type=file.content_type)
+        result = await aws_services.analyze_image(s3_uri)
+        return {"result": result, "filename": file.filename, "s3_uri": s3_uri}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Image analysis failed: {str(e)}")
 
@@ -0,0 +1,79 @@
+import json
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Union
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Wire encodings a collaboration client can negotiate.
+# JSON text frames stay the default for clients that ask for nothing else.
+DEFAULT_ENCODING = 'json'
+SUPPORTED_ENCODINGS = ('msgpack', 'json') if msgpack is not None else ('json',)
+
+def negotiate_encoding(requested: Optional[str]) -> str:
+    """Pick the first supported encoding from a client's comma-separated preference list"""
+    for encoding in (requested or '').split(','):
+        encoding = encoding.strip().lower()
+        if encoding in SUPPORTED_ENCODINGS:
+            return encoding
+    return DEFAULT_ENCODING
+
+def epoch_millis(timestamp: str) -> int:
+    """Convert a naive UTC ISO timestamp to epoch milliseconds"""
+    return int(datetime.fromisoformat(timestamp).replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+def _compact(message: Dict[str, Any]) -> Dict[str, Any]:
+    compact = dict(message)
+    if isinstance(compact.get('timestamp'), str):
+        compact['timestamp'] = epoch_millis(compact['timestamp'])
+    if compact.get('type') == 'cursor_batch':
+        compact['updates'] = [
+            [update['user_id'], update.get('cursor_data'), update.get('selection_data')]
+            for update in compact['updates']
+        ]
+    return compact
+
+def encode_message(message: Dict[str, Any], encoding: str = DEFAULT_ENCODING) -> Union[str, bytes]:
+    """Serialize a collaboration message for the given wire encoding
+
+    ``msgpack`` frames are binary, carry ``timestamp`` as epoch milliseconds
+    and send each cursor_batch update as a positional
+    ``[user_id, cursor_data, selection_data]`` array.
+    """
+    if encoding == 'json':
+        return json.dumps(message)
+    return msgpack.packb(_compact(message))
+
+def encode_entry(key: Any, value: Any, encoding: str = DEFAULT_ENCODING) -> Union[str, bytes]:
+    """Serialize one key/value pair of a map, to be joined by encode_map"""
+    if encoding == 'json':
+        return f"{json.dumps(str(key))}: {json.dumps(value)}"
+    return msgpack.packb(key) + msgpack.packb(value)
+
+def encode_map(entries: List[Union[str, bytes]], encoding: str = DEFAULT_ENCODING) -> Union[str, bytes]:
+    """Join pre-encoded entries into a map, to be spliced in by encode_message_with_map
+
+    Lets a large, slowly changing map be kept encoded entry by entry, so
+    only changed entries are ever serialized again.
+    """
+    if encoding == 'json':
+        return f"{{{', '.join(entries)}}}"
+    return msgpack.Packer().pack_map_header(len(entries)) + b''.join(entries)
+
+def encode_message_with_map(message: Dict[str, Any], field: str, encoded_map: Union[str, bytes],
+                            encoding: str = DEFAULT_ENCODING) -> Union[str, bytes]:
+    """Serialize a message plus a ``field`` holding a map built by encode_map"""
+    if encoding == 'json':
+        head = json.dumps(message)
+        separator = ', ' if len(head) > 2 else ''
+        return f"{head[:-1]}{separator}{json.dumps(field)}: {encoded_map}}}"
+
+    compact = _compact(message)
+    packer = msgpack.Packer()
+    parts = [packer.pack_map_header(len(compact) + 1)]
+    for key, value in compact.items():
+        parts.append(packer.pack(key) + packer.pack(value))
+    parts.append(packer.pack(field) + encoded_map)
+    return b''.join(parts)
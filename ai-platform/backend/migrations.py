@@ -0,0 +1,96 @@
+import json
+from typing import Any
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+
+from models import Project, Workflow, WorkflowExecution
+
+def _decode_graph(value: Any) -> Any:
+    """Decode a graph stored as a JSON-encoded string inside a JSON column"""
+    while isinstance(value, str):
+        value = json.loads(value) if value else []
+    return value
+
+def migrate_workflow_graph_encoding(db: Session, batch_size: int = 500) -> int:
+    """Rewrite string-encoded Workflow.nodes/edges as native JSON
+    
+    Earlier versions stored json.dumps() output in the JSON columns, so every
+    graph was encoded twice. Safe to run repeatedly; returns rows rewritten.
+    """
+    migrated = 0
+    last_id = 0
+    
+    while True:
+        rows = db.query(Workflow.id, Workflow.nodes, Workflow.edges).filter(
+            Workflow.id > last_id
+        ).order_by(Workflow.id).limit(batch_size).all()
+        if not rows:
+            break
+        
+        for workflow_id, nodes, edges in rows:
+            if isinstance(nodes, str) or isinstance(edges, str):
+                db.query(Workflow).filter(Workflow.id == workflow_id).update(
+                    {
+                        Workflow.nodes: _decode_graph(nodes),
+                        Workflow.edges: _decode_graph(edges)
+                    },
+                    synchronize_session=False
+                )
+                migrated += 1
+        
+        db.commit()
+        last_id = rows[-1][0]
+    
+    return migrated
+
+def add_execution_lease_columns(db: Session) -> int:
+    """Add the Textract job lease columns to a workflow_executions table created before them
+    
+    create_all() never alters existing tables. Safe to run repeatedly;
+    returns columns added.
+    """
+    bind = db.get_bind()
+    existing = {column['name'] for column in inspect(bind).get_columns(WorkflowExecution.__tablename__)}
+    added = 0
+    
+    for column in (WorkflowExecution.worker_id, WorkflowExecution.lease_expires_at):
+        if column.name not in existing:
+            column_type = column.type.compile(dialect=bind.dialect)
+            db.execute(text(f"ALTER TABLE {WorkflowExecution.__tablename__} ADD COLUMN {column.name} {column_type}"))
+            added += 1
+    
+    db.commit()
+    return added
+
+def add_keyset_indexes(db: Session) -> int:
+    """Create the (parent, created_at, id) indexes that list pagination seeks on
+    
+    create_all() skips tables that already exist, so databases created before
+    keyset pagination lack them. Safe to run repeatedly; returns indexes created.
+    """
+    connection = db.connection()
+    created = 0
+    
+    for model in (Project, Workflow):
+        existing = {index['name'] for index in inspect(connection).get_indexes(model.__tablename__)}
+        for index in model.__table_args__:
+            if index.name not in existing:
+                index.create(bind=connection)
+                created += 1
+    
+    db.commit()
+    return created
+
+if __name__ == "__main__":
+    from database import SessionLocal
+    
+    db = SessionLocal()
+    try:
+        count = migrate_workflow_graph_encoding(db)
+        print(f"Migrated {count} workflow graphs to native JSON")
+        count = add_execution_lease_columns(db)
+        print(f"Added {count} Textract job lease columns")
+        count = add_keyset_indexes(db)
+        print(f"Created {count} list pagination indexes")
+    finally:
+        db.close()
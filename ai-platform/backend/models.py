@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, JSON, Float, Enum
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, JSON, Float, Enum, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -58,6 +58,9 @@ class Project(Base):
     workflows = relationship("Workflow", back_populates="project")
     consultant_projects = relationship("ConsultantProject", back_populates="project")
     collaboration_sessions = relationship("CollaborationSession", back_populates="project")
+    
+    # Supports keyset pagination of an owner's projects
+    __table_args__ = (Index("ix_projects_owner_created_id", "owner_id", "created_at", "id"),)
 
 class Workflow(Base):
     __tablename__ = "workflows"
@@ -77,6 +80,10 @@ class Workflow(Base):
     # Relationships
     project = relationship("Project", back_populates="workflows")
     executions = relationship("WorkflowExecution", back_populates="workflow")
+    versions = relationship("WorkflowVersion", back_populates="workflow")
+    
+    # Supports keyset pagination of a project's workflows
+    __table_args__ = (Index("ix_workflows_project_created_id", "project_id", "created_at", "id"),)
 
 class WorkflowExecution(Base):
     __tablename__ = "workflow_executions"
@@ -90,10 +97,38 @@ class WorkflowExecution(Base):
     execution_time = Column(Float)  # Execution time in seconds
     started_at = Column(DateTime(timezone=True), server_default=func.now())
     completed_at = Column(DateTime)
+    # Worker following an asynchronous job, and when its claim lapses unless renewed
+    worker_id = Column(String)
+    lease_expires_at = Column(DateTime)
     
     # Relationships
     workflow = relationship("Workflow", back_populates="executions")
 
+class WorkflowGraphObject(Base):
+    __tablename__ = "workflow_graph_objects"
+    
+    # SHA-256 of the canonical JSON of a single node or edge; rows are immutable
+    hash = Column(String(64), primary_key=True)
+    content = Column(JSON, nullable=False)
+
+class WorkflowVersion(Base):
+    __tablename__ = "workflow_versions"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    workflow_id = Column(Integer, ForeignKey("workflows.id"), nullable=False)
+    version = Column(Integer, nullable=False)
+    graph_hash = Column(String(64), nullable=False)  # Hash of the whole node/edge manifest
+    nodes = Column(JSON)  # [[node_id, object_hash], ...] in graph order
+    edges = Column(JSON)  # [[edge_id, object_hash], ...] in graph order
+    restored_from = Column(Integer)  # Version this one was restored from
+    author_id = Column(Integer, ForeignKey("users.id"))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    # Relationships
+    workflow = relationship("Workflow", back_populates="versions")
+    
+    __table_args__ = (Index("ix_workflow_versions_workflow_version", "workflow_id", "version", unique=True),)
+
 class AIModel(Base):
     __tablename__ = "ai_models"
     
@@ -0,0 +1,76 @@
+import base64
+import json
+from datetime import datetime
+from typing import List, Optional, Tuple, Set, Sequence
+from fastapi import HTTPException
+from sqlalchemy import and_, or_, select, func
+
+# Page size limits for list endpoints
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# Response header carrying the cursor of the next page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Encode a (created_at, id) position as an opaque cursor"""
+    raw = json.dumps([created_at.isoformat() if created_at else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return (datetime.fromisoformat(created_at) if created_at else None), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_filter(model, cursor: str):
+    """Filter for rows strictly after the cursor in (created_at, id) order"""
+    created_at, row_id = decode_cursor(cursor)
+    # Compare against the stored timestamp of the cursor row (a primary key
+    # lookup) so precision and storage format always match; the encoded value
+    # only matters if that row has since been deleted
+    anchor = func.coalesce(
+        select(model.created_at).where(model.id == row_id).scalar_subquery(),
+        created_at
+    )
+    return or_(
+        model.created_at > anchor,
+        and_(model.created_at == anchor, model.id > row_id)
+    )
+
+def keyset_order(model) -> list:
+    return [model.created_at.asc(), model.id.asc()]
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str], default: Sequence[str]) -> List[str]:
+    """Parse a comma-separated ``fields=`` projection, always including id"""
+    if not fields:
+        selected = list(default)
+    else:
+        selected = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = set(selected) - set(allowed)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+
+    if "id" not in selected:
+        selected.insert(0, "id")
+    return selected
+
+def paginate(rows: list, limit: int) -> Tuple[list, Optional[str]]:
+    """Trim a limit+1 result to one page and return the next page's cursor"""
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    last = page[-1]
+    return page, encode_cursor(last.created_at, last.id)
+
+def select_fields(row, fields: Sequence[str]) -> dict:
+    """Build a list item containing only the requested fields"""
+    return {field: getattr(row, field) for field in fields}
+
+def columns_for(model, fields: Set[str]) -> list:
+    """Model columns to load for a projection, plus the keyset columns"""
+    names = (set(fields) & set(model.__table__.columns.keys())) | {"id", "created_at"}
+    return [getattr(model, name) for name in sorted(names)]
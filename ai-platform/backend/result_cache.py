@@ -0,0 +1,233 @@
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Awaitable, Callable, Optional, Sequence, Tuple
+
+# Analysis result cache configuration
+RESULT_CACHE_TTL_SECONDS = float(os.getenv('RESULT_CACHE_TTL_SECONDS', '86400'))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '1024'))
+# Directory of the on-disk tier; the disk tier is disabled when unset
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR')
+# Most files kept in the disk tier, and seconds between sweeps removing expired ones
+RESULT_CACHE_DISK_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_DISK_MAX_ENTRIES', '100000'))
+RESULT_CACHE_DISK_SWEEP_INTERVAL = float(os.getenv('RESULT_CACHE_DISK_SWEEP_INTERVAL', '3600'))
+
+# Bump when the shape of cached results changes so old entries are ignored
+RESULT_FORMAT_VERSION = '1'
+
+def sha256_digest(data: Any) -> str:
+    """SHA-256 hex digest of bytes or text"""
+    if isinstance(data, str):
+        data = data.encode()
+    return hashlib.sha256(data).hexdigest()
+
+class DiskCacheTier:
+    """Second cache tier of JSON files, shared by the workers on a host
+
+    Each file's modification time is set to its entry's expiry, so sweeps
+    find expired entries from directory listings alone. An expired entry is
+    deleted when read, and writes sweep the directory every
+    ``sweep_interval`` seconds, also removing the entries expiring soonest
+    while there are more than ``max_entries``.
+    """
+
+    def __init__(self, directory: str, max_entries: int = RESULT_CACHE_DISK_MAX_ENTRIES,
+                 sweep_interval: float = RESULT_CACHE_DISK_SWEEP_INTERVAL):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        # The first write sweeps what earlier processes left behind
+        self.next_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+        self.evicted = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def read(self, key: str) -> Optional[Tuple[float, Any]]:
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            expires_at, value = entry['expires_at'], entry['value']
+        except (OSError, ValueError, KeyError):
+            return None
+        if expires_at <= time.time():
+            self.evicted += self._remove(path)
+            return None
+        return expires_at, value
+
+    def write(self, key: str, expires_at: float, value: Any):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file and rename so readers never see a partial entry
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({'expires_at': expires_at, 'value': value}, f)
+        os.utime(temp_path, (expires_at, expires_at))
+        os.replace(temp_path, path)
+
+        if time.time() >= self.next_sweep:
+            self.sweep()
+
+    def sweep(self) -> int:
+        """Delete expired entries, then the soonest expiring ones over max_entries; returns files removed"""
+        # One sweep at a time per process; another worker sweeping too only finds files already gone
+        if not self._sweep_lock.acquire(blocking=False):
+            return 0
+        try:
+            self.next_sweep = time.time() + self.sweep_interval
+            now = time.time()
+            removed = 0
+            live = []
+            for path, expires_at in self._files():
+                if expires_at <= now:
+                    removed += self._remove(path)
+                else:
+                    live.append((expires_at, path))
+
+            if len(live) > self.max_entries:
+                live.sort()
+                for _, path in live[:len(live) - self.max_entries]:
+                    removed += self._remove(path)
+            self.evicted += removed
+            return removed
+        finally:
+            self._sweep_lock.release()
+
+    def _files(self):
+        try:
+            subdirectories = [entry.path for entry in os.scandir(self.directory) if entry.is_dir()]
+        except OSError:
+            return
+        for subdirectory in subdirectories:
+            try:
+                entries = list(os.scandir(subdirectory))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    modified = entry.stat().st_mtime
+                except OSError:
+                    continue
+                # Temporary files carry their write time; ones outliving a sweep interval were abandoned
+                yield entry.path, modified if entry.name.endswith('.json') else modified + self.sweep_interval
+
+    def _remove(self, path: str) -> int:
+        try:
+            os.remove(path)
+            return 1
+        except OSError:
+            return 0
+
+class ResultCache:
+    """Two-tier TTL cache of AI analysis results keyed by content hash
+
+    Keys combine the operation, the service API version, the requested
+    features and a SHA-256 of the input, so the same document or text is
+    analyzed once whoever submits it. Concurrent requests for a key that is
+    being computed wait for that computation instead of repeating it; it
+    runs in a task of its own, so it completes even if the caller that
+    started it is cancelled.
+    """
+
+    def __init__(self, ttl_seconds: float = RESULT_CACHE_TTL_SECONDS, max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+                 disk_tier: Optional[DiskCacheTier] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.disk_tier = disk_tier
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(operation: str, content_digest: str, features: Sequence[Any] = (), api_version: str = '') -> str:
+        raw = json.dumps([RESULT_FORMAT_VERSION, operation, api_version, sorted(map(str, features)), content_digest])
+        return sha256_digest(raw)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached result for key, computing and caching it on a miss"""
+        value = await self._get(key)
+        if value is not None:
+            return copy.deepcopy(value)
+
+        task = self._pending.get(key)
+        if task is None:
+            self.misses += 1
+            # The cache owns the computation so cancelling any one caller leaves it running for the others
+            task = asyncio.ensure_future(self._compute(key, compute))
+            self._pending[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return copy.deepcopy(await asyncio.shield(task))
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        value = await compute()
+        await self._set(key, value)
+        return value
+
+    def _finish(self, key: str, task: asyncio.Future):
+        if self._pending.get(key) is task:
+            del self._pending[key]
+        # Waiters receive the error; every caller may have been cancelled
+        if not task.cancelled():
+            task.exception()
+
+    async def _get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return entry[1]
+            del self._entries[key]
+
+        if self.disk_tier is not None:
+            entry = await asyncio.get_running_loop().run_in_executor(None, self.disk_tier.read, key)
+            if entry is not None and entry[0] > time.time():
+                self._remember(key, entry)
+                self.disk_hits += 1
+                return entry[1]
+        return None
+
+    async def _set(self, key: str, value: Any):
+        entry = (time.time() + self.ttl_seconds, value)
+        self._remember(key, entry)
+        if self.disk_tier is not None:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.disk_tier.write, key, *entry)
+            except OSError:
+                # The memory tier still holds the result
+                pass
+
+    def _remember(self, key: str, entry: Tuple[float, Any]):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache size and hit/miss counts per tier"""
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'disk_tier': self.disk_tier is not None,
+            'disk_evictions': self.disk_tier.evicted if self.disk_tier is not None else 0,
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses
+        }
+
+def create_result_cache() -> ResultCache:
+    """Build the result cache configured by the RESULT_CACHE_* settings"""
+    return ResultCache(disk_tier=DiskCacheTier(RESULT_CACHE_DIR) if RESULT_CACHE_DIR else None)
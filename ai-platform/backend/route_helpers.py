@@ -0,0 +1,80 @@
+from typing import Any, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.sql import Select
+
+from models import User, Project, Workflow
+from schemas import ProjectResponse, WorkflowResponse
+from auth import verify_token
+from token_cache import token_cache, UserSnapshot
+from pagination import select_fields
+
+# Ownership queries, token checks and response building shared by the sync
+# handlers in main.py and the AsyncSession handlers in async_routes.py.
+# Queries are built with select() so either kind of session can run them.
+
+def owned_project_query(project_id: int, user_id: int) -> Select:
+    """Select a project owned by the user"""
+    return select(Project).where(Project.id == project_id, Project.owner_id == user_id)
+
+def owned_workflow_query(workflow_id: int, user_id: int) -> Select:
+    """Select a workflow in one of the user's projects"""
+    return select(Workflow).join(Project).where(Workflow.id == workflow_id, Project.owner_id == user_id)
+
+def found_or_404(instance: Any, detail: str) -> Any:
+    """Return the loaded row, or raise 404 when the query found nothing"""
+    if instance is None:
+        raise HTTPException(status_code=404, detail=detail)
+    return instance
+
+def token_user_id(token: str) -> Tuple[Dict[str, Any], int]:
+    """Verify a bearer token and return its payload and user id, raising 401 when it is not valid"""
+    payload = verify_token(token)
+    try:
+        return payload, int(payload["sub"])
+    except (TypeError, KeyError, ValueError):
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+def remember_user(token: str, payload: Dict[str, Any], user: Optional[User]) -> UserSnapshot:
+    """Cache the token's user, raising 401 when the user is missing or inactive"""
+    if user is None or not user.is_active:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    snapshot = UserSnapshot.from_user(user)
+    token_cache.set(token, payload, snapshot)
+    return snapshot
+
+def project_response(project: Project) -> ProjectResponse:
+    return ProjectResponse(
+        id=project.id,
+        name=project.name,
+        description=project.description,
+        industry=project.industry,
+        objectives=project.objectives,
+        status=project.status,
+        created_at=project.created_at,
+        updated_at=project.updated_at
+    )
+
+def workflow_response(workflow: Workflow) -> WorkflowResponse:
+    return WorkflowResponse(
+        id=workflow.id,
+        name=workflow.name,
+        description=workflow.description,
+        status=workflow.status,
+        nodes=workflow.nodes or [],
+        edges=workflow.edges or [],
+        created_at=workflow.created_at,
+        updated_at=workflow.updated_at
+    )
+
+def workflow_list_items(workflows: List[Workflow], selected: List[str]) -> List[Dict[str, Any]]:
+    """Project workflows onto the selected fields; a missing graph is returned as an empty list"""
+    items = []
+    for workflow in workflows:
+        item = select_fields(workflow, selected)
+        for field in ("nodes", "edges"):
+            if field in item:
+                item[field] = item[field] or []
+        items.append(item)
+    return items
@@ -37,11 +37,25 @@ class ProjectResponse(ProjectBase):
     id: int
     status: str
     created_at: datetime
-    updated_at: datetime
+    updated_at: Optional[datetime] = None
     
     class Config:
         from_attributes = True
 
+class ProjectListItem(BaseModel):
+    """Project list entry; only the fields requested with ``fields=`` are returned"""
+    id: int
+    name: Optional[str] = None
+    description: Optional[str] = None
+    industry: Optional[str] = None
+    objectives: Optional[str] = None
+    status: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+PROJECT_LIST_FIELDS = ["id", "name", "description", "industry", "objectives", "status", "created_at", "updated_at"]
+PROJECT_SUMMARY_FIELDS = ["id", "name", "status", "created_at", "updated_at"]
+
 # Workflow schemas
 class WorkflowBase(BaseModel):
     name: str
@@ -56,11 +70,39 @@ class WorkflowResponse(WorkflowBase):
     id: int
     status: str
     created_at: datetime
-    updated_at: datetime
+    updated_at: Optional[datetime] = None
     
     class Config:
         from_attributes = True
 
+class WorkflowListItem(BaseModel):
+    """Workflow list entry; only the fields requested with ``fields=`` are returned"""
+    id: int
+    name: Optional[str] = None
+    description: Optional[str] = None
+    status: Optional[str] = None
+    nodes: Optional[List[Any]] = None
+    edges: Optional[List[Any]] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+WORKFLOW_LIST_FIELDS = ["id", "name", "description", "status", "nodes", "edges", "created_at", "updated_at"]
+# Summary mode leaves out the node/edge graph
+WORKFLOW_SUMMARY_FIELDS = ["id", "name", "description", "status", "created_at", "updated_at"]
+
+class WorkflowVersionResponse(BaseModel):
+    version: int
+    graph_hash: str
+    node_count: int
+    edge_count: int
+    restored_from: Optional[int] = None
+    author_id: Optional[int] = None
+    created_at: Optional[datetime] = None
+
+class WorkflowVersionDetail(WorkflowVersionResponse):
+    nodes: List[Any] = []
+    edges: List[Any] = []
+
 # Workflow execution schemas
 class WorkflowExecutionResponse(BaseModel):
     id: int
@@ -69,6 +111,7 @@ class WorkflowExecutionResponse(BaseModel):
     input_data: Optional[Dict[str, Any]] = None
     output_data: Optional[Dict[str, Any]] = None
     error_message: Optional[str] = None
+    execution_time: Optional[float] = None
     started_at: datetime
     completed_at: Optional[datetime] = None
     
@@ -0,0 +1,147 @@
+import os
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+import async_routes
+from async_routes import get_current_user_async
+from database import get_async_db
+from models import Base, User, Project, Workflow, WorkflowVersion
+from token_cache import token_cache, UserSnapshot
+from auth import create_access_token
+from dashboard import dashboard_cache
+
+# The async handlers run against aiosqlite, sharing a file with a sync engine used for setup
+TEST_DATABASE_PATH = "./test_async.db"
+engine = create_engine(f"sqlite:///{TEST_DATABASE_PATH}", connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(f"sqlite+aiosqlite:///{TEST_DATABASE_PATH}", poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+Base.metadata.create_all(bind=engine)
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+# Mounted the way main.py mounts it when ASYNC_DB_ENABLED is set
+app = FastAPI()
+app.include_router(async_routes.router)
+app.dependency_overrides[get_async_db] = override_get_async_db
+
+client = TestClient(app)
+
+@pytest.fixture
+def test_user():
+    db = TestingSessionLocal()
+    user = User(
+        email="async@example.com",
+        hashed_password="not-used",
+        full_name="Async User",
+        company="Test Company"
+    )
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    app.dependency_overrides[get_current_user_async] = lambda: UserSnapshot.from_user(user)
+    yield user
+    app.dependency_overrides.pop(get_current_user_async, None)
+    dashboard_cache.invalidate(user.id)
+    db.query(WorkflowVersion).delete()
+    db.query(Workflow).delete()
+    db.query(Project).delete()
+    db.delete(user)
+    db.commit()
+    db.close()
+
+def teardown_module(module):
+    engine.dispose()
+    if os.path.exists(TEST_DATABASE_PATH):
+        os.remove(TEST_DATABASE_PATH)
+
+def create_project(name="Async Project"):
+    response = client.post("/projects", json={"name": name, "description": "A test project"})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+def test_create_and_get_project(test_user):
+    project_id = create_project()
+
+    response = client.get(f"/projects/{project_id}")
+    assert response.status_code == 200
+    assert response.json()["name"] == "Async Project"
+    assert client.get("/projects/999999").status_code == 404
+
+def test_get_projects_keyset_pagination(test_user):
+    for i in range(3):
+        create_project(f"Project {i}")
+
+    first = client.get("/projects", params={"limit": 2, "fields": "name"})
+    assert first.status_code == 200
+    assert [p["name"] for p in first.json()] == ["Project 0", "Project 1"]
+    # The id is always returned alongside the requested fields
+    assert set(first.json()[0]) == {"id", "name"}
+
+    second = client.get("/projects", params={"limit": 2, "fields": "name", "cursor": first.headers["X-Next-Cursor"]})
+    assert [p["name"] for p in second.json()] == ["Project 2"]
+    assert "X-Next-Cursor" not in second.headers
+
+def test_create_update_and_list_workflows(test_user):
+    project_id = create_project()
+    nodes = [{"id": "a", "type": "trigger"}]
+
+    created = client.post(f"/projects/{project_id}/workflows", json={
+        "name": "Async Workflow",
+        "description": "A test workflow",
+        "nodes": nodes,
+        "edges": []
+    })
+    assert created.status_code == 200
+    workflow_id = created.json()["id"]
+    assert created.json()["nodes"] == nodes
+
+    updated = client.put(f"/workflows/{workflow_id}", json={
+        "name": "Renamed Workflow",
+        "description": "A test workflow",
+        "nodes": nodes + [{"id": "b", "type": "action"}],
+        "edges": [{"id": "e1", "source": "a", "target": "b"}]
+    })
+    assert updated.status_code == 200
+    assert updated.json()["name"] == "Renamed Workflow"
+    assert len(updated.json()["nodes"]) == 2
+
+    listed = client.get(f"/projects/{project_id}/workflows", params={"summary": "true"})
+    assert listed.status_code == 200
+    assert [w["name"] for w in listed.json()] == ["Renamed Workflow"]
+    assert "nodes" not in listed.json()[0]
+
+    # Both saves were recorded as versions
+    db = TestingSessionLocal()
+    versions = [v.version for v in db.query(WorkflowVersion).filter(WorkflowVersion.workflow_id == workflow_id)]
+    db.close()
+    assert sorted(versions) == [1, 2]
+
+    assert client.put("/workflows/999999", json={"name": "Missing", "description": ""}).status_code == 404
+
+def test_dashboard_stats_invalidated_on_project_create(test_user):
+    before = client.get("/dashboard/stats")
+    assert before.status_code == 200
+    assert before.json()["total_projects"] == 0
+
+    create_project()
+    after = client.get("/dashboard/stats").json()
+    assert after["total_projects"] == 1
+    assert "active_workflows" in after
+
+def test_bearer_tokens_authenticate_against_the_async_session(test_user):
+    app.dependency_overrides.pop(get_current_user_async)
+    token = create_access_token(data={"sub": str(test_user.id)})
+
+    response = client.get("/dashboard/stats", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert client.get("/dashboard/stats", headers={"Authorization": "Bearer invalid"}).status_code == 401
+    token_cache.clear()
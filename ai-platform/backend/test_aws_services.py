@@ -0,0 +1,454 @@
+import asyncio
+import os
+import time
+import pytest
+from botocore.exceptions import ClientError
+
+from aws_services import AWSServices
+from result_cache import ResultCache, DiskCacheTier
+from comprehend_batcher import MicroBatcher, BatchFailed
+
+
+class SlowAWSServices(AWSServices):
+    """AWSServices with the AWS calls replaced by fixed delays"""
+
+    delay = 0.2
+
+    async def analyze_document(self, s3_uri):
+        await asyncio.sleep(self.delay)
+        return {'text': f'text of {s3_uri}'}
+
+    async def analyze_image(self, s3_uri):
+        await asyncio.sleep(self.delay)
+        return {'labels': [], 'text': []}
+
+    async def analyze_sentiment(self, text):
+        await asyncio.sleep(self.delay)
+        return {'sentiment': 'NEUTRAL', 'source': text}
+
+
+DOCUMENT_WORKFLOW = {
+    'id': 'doc-workflow',
+    'steps': [
+        {'id': 'contract', 'type': 'document_analysis', 'config': {'input_uri': 's3://bucket/contract.pdf'}},
+        {'id': 'photo_1', 'type': 'image_analysis', 'config': {'input_uri': 's3://bucket/1.png'}},
+        {'id': 'photo_2', 'type': 'image_analysis', 'config': {'input_uri': 's3://bucket/2.png'}},
+        {'id': 'tone', 'type': 'sentiment_analysis', 'config': {'input_step': 'contract'}}
+    ]
+}
+
+@pytest.mark.asyncio
+async def test_independent_steps_run_concurrently():
+    services = SlowAWSServices()
+    started = time.perf_counter()
+    result = await services.execute_workflow(DOCUMENT_WORKFLOW)
+    elapsed = time.perf_counter() - started
+
+    assert result['status'] == 'completed'
+    assert list(result['results']) == ['contract', 'photo_1', 'photo_2', 'tone']
+    assert result['results']['tone']['source'] == 'text of s3://bucket/contract.pdf'
+    # Textract and both images overlap; only the sentiment step waits on Textract
+    assert elapsed < 0.55
+
+@pytest.mark.asyncio
+async def test_concurrency_cap_limits_parallel_steps():
+    services = SlowAWSServices()
+    started = time.perf_counter()
+    result = await services.execute_workflow(dict(DOCUMENT_WORKFLOW, max_concurrency=1))
+    elapsed = time.perf_counter() - started
+
+    assert result['status'] == 'completed'
+    assert elapsed >= 0.8
+
+@pytest.mark.asyncio
+async def test_circular_input_steps_fail():
+    services = SlowAWSServices()
+    result = await services.execute_workflow({
+        'id': 'loop',
+        'steps': [
+            {'id': 'a', 'type': 'sentiment_analysis', 'config': {'input_step': 'b'}},
+            {'id': 'b', 'type': 'sentiment_analysis', 'config': {'input_step': 'a'}}
+        ]
+    })
+
+    assert result['status'] == 'failed'
+    assert 'Circular' in result['error']
+
+@pytest.mark.asyncio
+async def test_client_calls_run_off_the_event_loop():
+    services = AWSServices()
+    client = services.async_clients['textract']
+
+    class BlockingClient:
+        def analyze_document(self, **kwargs):
+            time.sleep(0.2)
+            return {'Blocks': []}
+
+    client.client = BlockingClient()
+    client.max_concurrency = 2
+
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticking = asyncio.ensure_future(ticker())
+    started = time.perf_counter()
+    await asyncio.gather(*(services._call('textract', 'analyze_document') for _ in range(4)))
+    elapsed = time.perf_counter() - started
+    ticking.cancel()
+
+    # Four 0.2s calls with a limit of two take two rounds, and the loop keeps ticking
+    assert 0.35 < elapsed < 0.6
+    assert ticks > 10
+    assert services.get_client_stats()['textract']['in_flight'] == 0
+
+class RecordingS3Client:
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, method):
+        def call(**kwargs):
+            self.calls.append((method, kwargs))
+            if method == 'create_multipart_upload':
+                return {'UploadId': 'upload-1'}
+            if method == 'upload_part':
+                return {'ETag': f"etag-{kwargs['PartNumber']}"}
+            return {}
+        return call
+
+class ChunkedUpload:
+    """Async file-like object in the style of UploadFile"""
+
+    def __init__(self, size: int):
+        self.remaining = size
+        self.largest_read = 0
+
+    async def read(self, size: int = -1) -> bytes:
+        count = min(size, self.remaining)
+        self.remaining -= count
+        self.largest_read = max(self.largest_read, count)
+        return b'x' * count
+
+@pytest.mark.asyncio
+async def test_upload_streams_large_files_as_multipart(monkeypatch):
+    monkeypatch.setattr('aws_services.S3_MULTIPART_CHUNK_SIZE', 1024)
+    services = AWSServices()
+    services.data_bucket = 'bucket'
+    s3 = services.async_clients['s3'].client = RecordingS3Client()
+
+    upload = ChunkedUpload(2500)
+    uri = await services.upload_file(upload, 'uploads/contract.pdf')
+
+    assert uri == 's3://bucket/uploads/contract.pdf'
+    assert upload.largest_read == 1024
+    methods = [method for method, _ in s3.calls]
+    assert methods == ['create_multipart_upload', 'upload_part', 'upload_part', 'upload_part', 'complete_multipart_upload']
+    assert [len(kwargs['Body']) for method, kwargs in s3.calls if method == 'upload_part'] == [1024, 1024, 452]
+    assert s3.calls[-1][1]['MultipartUpload']['Parts'][2] == {'PartNumber': 3, 'ETag': 'etag-3'}
+
+@pytest.mark.asyncio
+async def test_upload_small_stream_uses_single_put(monkeypatch):
+    monkeypatch.setattr('aws_services.S3_MULTIPART_CHUNK_SIZE', 1024)
+    services = AWSServices()
+    s3 = services.async_clients['s3'].client = RecordingS3Client()
+
+    await services.upload_file(ChunkedUpload(100), 'small.png')
+
+    assert [method for method, _ in s3.calls] == ['put_object']
+
+@pytest.mark.asyncio
+async def test_failed_abort_does_not_hide_the_upload_error(monkeypatch, caplog):
+    monkeypatch.setattr('aws_services.S3_MULTIPART_CHUNK_SIZE', 1024)
+    services = AWSServices()
+    s3 = services.async_clients['s3'].client = RecordingS3Client()
+
+    def fail(operation):
+        def call(**kwargs):
+            s3.calls.append((operation, kwargs))
+            raise ClientError({'Error': {'Code': 'InternalError', 'Message': f'{operation} failed'}}, operation)
+        return call
+    s3.upload_part = fail('UploadPart')
+    s3.abort_multipart_upload = fail('AbortMultipartUpload')
+
+    with pytest.raises(Exception, match='UploadPart failed'):
+        await services.upload_file(ChunkedUpload(2500), 'uploads/contract.pdf')
+
+    assert [method for method, _ in s3.calls][-1] == 'AbortMultipartUpload'
+    assert 'Failed to abort multipart upload upload-1' in caplog.text
+
+@pytest.mark.asyncio
+async def test_document_analysis_pages_wait_for_job_then_follow_tokens():
+    services = AWSServices()
+    responses = [
+        {'JobStatus': 'IN_PROGRESS'},
+        {'JobStatus': 'SUCCEEDED', 'Blocks': [{'Id': '1'}], 'NextToken': 'next'},
+        {'JobStatus': 'SUCCEEDED', 'Blocks': [{'Id': '2'}]}
+    ]
+    requests = []
+
+    class TextractClient:
+        def get_document_analysis(self, **kwargs):
+            requests.append(kwargs)
+            return responses.pop(0)
+
+    services.async_clients['textract'].client = TextractClient()
+    pages = [page async for page in services.document_analysis_pages('job-1', poll_interval=0.01)]
+
+    assert [page['Blocks'][0]['Id'] for page in pages] == ['1', '2']
+    assert requests[-1] == {'JobId': 'job-1', 'NextToken': 'next'}
+
+def test_resolve_blocks_rebuilds_tables_and_key_values():
+    from textract_blocks import resolve_blocks
+
+    def word(block_id, text):
+        return {'Id': block_id, 'BlockType': 'WORD', 'Text': text, 'Confidence': 99.0}
+
+    def cell(block_id, row, column, *word_ids):
+        return {'Id': block_id, 'BlockType': 'CELL', 'RowIndex': row, 'ColumnIndex': column, 'Confidence': 90.0,
+                'Relationships': [{'Type': 'CHILD', 'Ids': list(word_ids)}]}
+
+    blocks = [
+        {'Id': 'line', 'BlockType': 'LINE', 'Text': 'Invoice 42', 'Confidence': 80.0},
+        {'Id': 'table', 'BlockType': 'TABLE', 'Page': 1, 'Confidence': 95.0,
+         'Relationships': [{'Type': 'CHILD', 'Ids': ['c11', 'c12', 'c21', 'c22']}]},
+        cell('c11', 1, 1, 'w1'), cell('c12', 1, 2, 'w2'), cell('c21', 2, 1, 'w3', 'w4'), cell('c22', 2, 2),
+        word('w1', 'Item'), word('w2', 'Price'), word('w3', 'Blue'), word('w4', 'widget'),
+        {'Id': 'key', 'BlockType': 'KEY_VALUE_SET', 'EntityTypes': ['KEY'], 'Confidence': 70.0,
+         'Relationships': [{'Type': 'VALUE', 'Ids': ['value']}, {'Type': 'CHILD', 'Ids': ['w5']}]},
+        {'Id': 'value', 'BlockType': 'KEY_VALUE_SET', 'EntityTypes': ['VALUE'], 'Confidence': 60.0,
+         'Relationships': [{'Type': 'CHILD', 'Ids': ['w6', 'check']}]},
+        word('w5', 'Paid:'), word('w6', 'Yes'),
+        {'Id': 'check', 'BlockType': 'SELECTION_ELEMENT', 'SelectionStatus': 'SELECTED', 'Confidence': 99.0}
+    ]
+
+    result = resolve_blocks(blocks)
+
+    assert result['text'] == 'Invoice 42'
+    assert result['tables'][0]['rows'] == [['Item', 'Price'], ['Blue widget', '']]
+    assert result['forms'] == [{'id': 'key', 'page': None, 'confidence': 70.0, 'key': 'Paid:',
+                                'value': 'Yes SELECTED', 'value_confidence': 60.0}]
+    assert result['confidence_stats'] == {'count': len(blocks), 'min': 60.0, 'max': 99.0}
+
+def test_resolve_blocks_is_linear():
+    from textract_blocks import resolve_blocks
+
+    # A 100x30 table: 3,000 cells and as many words
+    cells, words = [], []
+    for row in range(1, 101):
+        for column in range(1, 31):
+            cells.append({'Id': f'c{row}.{column}', 'BlockType': 'CELL', 'RowIndex': row, 'ColumnIndex': column,
+                          'Relationships': [{'Type': 'CHILD', 'Ids': [f'w{row}.{column}']}]})
+            words.append({'Id': f'w{row}.{column}', 'BlockType': 'WORD', 'Text': 'x', 'Confidence': 99.0})
+    table = {'Id': 'table', 'BlockType': 'TABLE', 'Relationships': [{'Type': 'CHILD', 'Ids': [c['Id'] for c in cells]}]}
+
+    started = time.perf_counter()
+    result = resolve_blocks([table] + cells + words)
+    assert time.perf_counter() - started < 0.1
+    assert len(result['tables'][0]['rows']) == 100
+
+class CountingComprehendClient:
+    def __init__(self):
+        self.calls = 0
+
+    def batch_detect_sentiment(self, TextList, LanguageCode):
+        self.calls += 1
+        time.sleep(0.05)
+        return {
+            'ResultList': [
+                {'Index': index, 'Sentiment': 'POSITIVE', 'SentimentScore': {'Positive': 0.9}}
+                for index in range(len(TextList))
+            ],
+            'ErrorList': []
+        }
+
+@pytest.mark.asyncio
+async def test_repeat_analyses_are_served_from_cache():
+    services = AWSServices()
+    services.result_cache = ResultCache()
+    comprehend = services.async_clients['comprehend'].client = CountingComprehendClient()
+
+    first, second = await asyncio.gather(
+        services.analyze_sentiment('great contract'),
+        services.analyze_sentiment('great contract')
+    )
+    started = time.perf_counter()
+    third = await services.analyze_sentiment('great contract')
+    elapsed = time.perf_counter() - started
+    await services.analyze_sentiment('another contract')
+
+    assert first == second == third == {'sentiment': 'POSITIVE', 'confidence_scores': {'Positive': 0.9}}
+    # Concurrent requests share one call and the repeat does not reach Comprehend
+    assert comprehend.calls == 2
+    assert elapsed < 0.01
+    third['sentiment'] = 'changed'
+    assert (await services.analyze_sentiment('great contract'))['sentiment'] == 'POSITIVE'
+    assert services.result_cache.get_stats()['misses'] == 2
+
+@pytest.mark.asyncio
+async def test_document_cache_is_keyed_by_content_and_shared_through_disk(tmp_path):
+    services = AWSServices()
+    services.result_cache = ResultCache(disk_tier=DiskCacheTier(str(tmp_path)))
+    objects = {
+        's3://bucket/a/contract.pdf': {'Metadata': {'sha256': 'abc'}, 'ETag': '"1"'},
+        's3://bucket/b/copy.pdf': {'Metadata': {'sha256': 'abc'}, 'ETag': '"2"'},
+        's3://bucket/c/other.pdf': {'Metadata': {}, 'ETag': '"3"'}
+    }
+    analyzed = []
+
+    class S3Client:
+        def head_object(self, Bucket, Key):
+            return objects[f"s3://{Bucket}/{Key}"]
+
+    class TextractClient:
+        def analyze_document(self, Document, FeatureTypes):
+            analyzed.append(Document['S3Object']['Name'])
+            return {'Blocks': [{'Id': '1', 'BlockType': 'LINE', 'Text': 'Total', 'Confidence': 99.0}]}
+
+    services.async_clients['s3'].client = S3Client()
+    services.async_clients['textract'].client = TextractClient()
+
+    for uri in objects:
+        assert (await services.analyze_document(uri))['text'] == 'Total'
+    assert analyzed == ['a/contract.pdf', 'c/other.pdf']
+
+    # A new process starts with an empty memory tier but finds the results on disk
+    services.result_cache = ResultCache(disk_tier=DiskCacheTier(str(tmp_path)))
+    await services.analyze_document('s3://bucket/b/copy.pdf')
+    assert analyzed == ['a/contract.pdf', 'c/other.pdf']
+    assert services.result_cache.get_stats()['disk_hits'] == 1
+
+@pytest.mark.asyncio
+async def test_expired_results_are_recomputed():
+    cache = ResultCache(ttl_seconds=0.05)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return {'value': len(calls)}
+
+    key = ResultCache.make_key('comprehend.detect_sentiment', 'sha256:abc', ['en'], '2017-11-27')
+    assert (await cache.get_or_compute(key, compute)) == {'value': 1}
+    assert (await cache.get_or_compute(key, compute)) == {'value': 1}
+    await asyncio.sleep(0.06)
+    assert (await cache.get_or_compute(key, compute)) == {'value': 2}
+    assert key != ResultCache.make_key('comprehend.detect_sentiment', 'sha256:abc', ['en'], '2018-01-01')
+
+@pytest.mark.asyncio
+async def test_cancelling_a_caller_does_not_cancel_the_shared_computation():
+    cache = ResultCache()
+    release = asyncio.Event()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await release.wait()
+        return {'value': 'computed'}
+
+    first = asyncio.create_task(cache.get_or_compute('key', compute))
+    second = asyncio.create_task(cache.get_or_compute('key', compute))
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await second == {'value': 'computed'}
+    assert first.cancelled()
+    assert calls == [1]
+    assert (await cache.get_or_compute('key', compute)) == {'value': 'computed'}
+    assert cache.get_stats()['misses'] == 1
+
+def test_disk_tier_evicts_expired_and_excess_entries(tmp_path):
+    tier = DiskCacheTier(str(tmp_path), max_entries=2, sweep_interval=3600)
+    now = time.time()
+    # Sweep only when asked to
+    tier.next_sweep = now + 3600
+    tier.write('aa-expired', now - 1, {'value': 0})
+    assert tier.read('aa-expired') is None
+    assert not os.path.exists(tier._path('aa-expired'))
+
+    for index, key in enumerate(['ab-first', 'bc-second', 'cd-third']):
+        tier.write(key, now + 60 + index, {'value': index})
+    tier.write('de-expired', now - 1, {'value': -1})
+    abandoned = os.path.join(str(tmp_path), 'ab', 'ab-first.json.1.2.tmp')
+    open(abandoned, 'w').close()
+    os.utime(abandoned, (now - 7200, now - 7200))
+
+    # The expired entry, the abandoned temporary file and the entry expiring soonest go
+    assert tier.sweep() == 3
+    remaining = sorted(name for _, _, names in os.walk(str(tmp_path)) for name in names)
+    assert remaining == ['bc-second.json', 'cd-third.json']
+    assert tier.read('cd-third') == (now + 62, {'value': 2})
+    assert tier.evicted == 4
+
+    # A new process sweeps on its first write
+    restarted = DiskCacheTier(str(tmp_path), max_entries=1)
+    restarted.write('ef-latest', now + 120, {'value': 3})
+    assert [name for _, _, names in os.walk(str(tmp_path)) for name in names] == ['ef-latest.json']
+
+class BatchComprehendClient:
+    def __init__(self):
+        self.batches = []
+        self.single = []
+
+    def batch_detect_sentiment(self, TextList, LanguageCode):
+        self.batches.append(list(TextList))
+        results, errors = [], []
+        for index, text in enumerate(TextList):
+            if text == 'bad review':
+                errors.append({'Index': index, 'ErrorCode': 'INTERNAL_SERVER_ERROR', 'ErrorMessage': 'try again'})
+            else:
+                results.append({'Index': index, 'Sentiment': text.upper(), 'SentimentScore': {}})
+        # Comprehend does not promise any order within the lists
+        return {'ResultList': results[::-1], 'ErrorList': errors}
+
+    def detect_entities(self, Text, LanguageCode):
+        self.single.append(Text)
+        return {'Entities': [{'Text': 'ACME', 'Type': 'ORGANIZATION', 'Score': 0.99}]}
+
+@pytest.mark.asyncio
+async def test_concurrent_sentiment_requests_share_batch_calls():
+    services = AWSServices()
+    comprehend = services.async_clients['comprehend'].client = BatchComprehendClient()
+    texts = [f'review {i}' for i in range(60)] + ['bad review']
+
+    results = await asyncio.gather(*[services.analyze_sentiment(text) for text in texts], return_exceptions=True)
+
+    # 61 reviews take three BatchDetectSentiment calls of at most 25 documents
+    assert sorted(len(batch) for batch in comprehend.batches) == [11, 25, 25]
+    assert [result['sentiment'] for result in results[:60]] == [text.upper() for text in texts[:60]]
+    # A failed document fails only its own request
+    assert isinstance(results[60], Exception)
+    assert 'INTERNAL_SERVER_ERROR' in str(results[60])
+    stats = services.get_batch_stats()['sentiment']
+    assert stats['batches'] == 3
+    assert stats['documents'] == 61
+    assert stats['pending'] == 0
+
+@pytest.mark.asyncio
+async def test_failed_batch_call_gives_each_request_its_own_error():
+    async def run_batch(texts):
+        raise RuntimeError('throttled')
+
+    batcher = MicroBatcher(run_batch, window=0.01)
+    errors = await asyncio.gather(*[batcher.submit(f'review {i}') for i in range(3)], return_exceptions=True)
+
+    assert all(isinstance(error, BatchFailed) and str(error) == 'throttled' for error in errors)
+    assert len({id(error) for error in errors}) == 3
+    assert len({id(error.__cause__) for error in errors}) == 1
+    assert isinstance(errors[0].__cause__, RuntimeError)
+
+@pytest.mark.asyncio
+async def test_oversized_documents_skip_entity_batches():
+    services = AWSServices()
+    comprehend = services.async_clients['comprehend'].client = BatchComprehendClient()
+    long_text = 'ACME ' * 2000
+
+    entities = await services.extract_entities(long_text)
+
+    assert entities == [{'text': 'ACME', 'type': 'ORGANIZATION', 'confidence': 0.99}]
+    assert comprehend.single == [long_text]
+    assert services.get_batch_stats()['entities']['batches'] == 0
@@ -1,13 +1,22 @@
+import asyncio
 import pytest
+from datetime import datetime, timedelta
+from starlette.websockets import WebSocketDisconnect
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
+import main
 from main import app, get_current_user
 from database import get_db, Base
-from models import User, Project, Workflow
-from auth import get_password_hash
+from models import User, Project, Workflow, WorkflowVersion, WorkflowGraphObject, WorkflowExecution
+from collab_graph import WorkflowGraphStore, GraphConflict
+from auth import get_password_hash, password_hasher
+from token_cache import token_cache
+from migrations import migrate_workflow_graph_encoding, add_execution_lease_columns, add_keyset_indexes
+from textract_jobs import TextractJobRunner, TEXTRACT_JOB_KIND
+import json
 
 # Test database setup
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
@@ -17,6 +26,10 @@ engine = create_engine(
     poolclass=StaticPool,
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Job runners use the database from executor threads, so like in production
+# each thread gets its own connection instead of sharing the static one
+job_engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+JobSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=job_engine)
 
 Base.metadata.create_all(bind=engine)
 
@@ -117,6 +130,24 @@ def test_login_invalid_credentials():
     assert response.status_code == 401
     assert "Invalid credentials" in response.json()["detail"]
 
+def test_login_overloaded_password_pool(test_user, monkeypatch):
+    monkeypatch.setattr(password_hasher, "max_inflight", 0)
+    response = client.post("/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpassword"
+    })
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert password_hasher.get_stats()["rejected"] >= 1
+
+def test_metrics():
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["password_hashing"]["queued"] == 0
+    assert "textract" in data["aws_clients"]
+    assert data["result_cache"]["misses"] >= 0
+
 def test_get_dashboard_stats(auth_headers):
     response = client.get("/dashboard/stats", headers=auth_headers)
     assert response.status_code == 200
@@ -126,6 +157,16 @@ def test_get_dashboard_stats(auth_headers):
     assert "completed_tasks" in data
     assert "ai_services_used" in data
 
+def test_dashboard_stats_invalidated_on_project_create(auth_headers):
+    before = client.get("/dashboard/stats", headers=auth_headers).json()
+    client.post("/projects", json={
+        "name": "Dashboard Project",
+        "description": "Counts towards the dashboard"
+    }, headers=auth_headers)
+    
+    after = client.get("/dashboard/stats", headers=auth_headers).json()
+    assert after["total_projects"] == before["total_projects"] + 1
+
 def test_create_project(auth_headers):
     response = client.post("/projects", json={
         "name": "Test Project",
@@ -204,6 +245,366 @@ def test_get_workflows(auth_headers):
     assert len(data) >= 1
     assert data[0]["name"] == "Test Workflow"
 
+def test_get_workflows_keyset_pagination(auth_headers):
+    project_response = client.post("/projects", json={
+        "name": "Paged Project",
+        "description": "A project with several workflows"
+    }, headers=auth_headers)
+    project_id = project_response.json()["id"]
+    for i in range(3):
+        client.post(f"/projects/{project_id}/workflows", json={
+            "name": f"Workflow {i}",
+            "description": "A test workflow",
+            "nodes": [{"id": "1", "type": "input"}]
+        }, headers=auth_headers)
+    
+    first = client.get(f"/projects/{project_id}/workflows?limit=2", headers=auth_headers)
+    assert first.status_code == 200
+    assert [w["name"] for w in first.json()] == ["Workflow 0", "Workflow 1"]
+    cursor = first.headers["X-Next-Cursor"]
+    
+    second = client.get(f"/projects/{project_id}/workflows?limit=2&cursor={cursor}", headers=auth_headers)
+    assert [w["name"] for w in second.json()] == ["Workflow 2"]
+    assert "X-Next-Cursor" not in second.headers
+
+def test_get_workflows_field_projection(auth_headers):
+    project_response = client.post("/projects", json={
+        "name": "Projection Project",
+        "description": "A test project"
+    }, headers=auth_headers)
+    project_id = project_response.json()["id"]
+    client.post(f"/projects/{project_id}/workflows", json={
+        "name": "Big Workflow",
+        "description": "A test workflow",
+        "nodes": [{"id": "1", "type": "input"}]
+    }, headers=auth_headers)
+    
+    summary = client.get(f"/projects/{project_id}/workflows?summary=true", headers=auth_headers).json()
+    assert summary[0]["name"] == "Big Workflow"
+    assert "nodes" not in summary[0] and "edges" not in summary[0]
+    
+    projected = client.get(f"/projects/{project_id}/workflows?fields=name,nodes", headers=auth_headers).json()
+    assert set(projected[0]) == {"id", "name", "nodes"}
+    assert projected[0]["nodes"] == [{"id": "1", "type": "input"}]
+    
+    response = client.get(f"/projects/{project_id}/workflows?fields=secret", headers=auth_headers)
+    assert response.status_code == 400
+
+def test_workflow_versions_diff_and_restore(auth_headers):
+    project_id = client.post("/projects", json={
+        "name": "Versioned Project",
+        "description": "A test project"
+    }, headers=auth_headers).json()["id"]
+    
+    start = {"id": "1", "type": "input", "position": {"x": 0, "y": 0}}
+    workflow_id = client.post(f"/projects/{project_id}/workflows", json={
+        "name": "Versioned Workflow",
+        "description": "A test workflow",
+        "nodes": [start],
+        "edges": []
+    }, headers=auth_headers).json()["id"]
+    
+    moved = {**start, "position": {"x": 50, "y": 0}}
+    output = {"id": "2", "type": "output"}
+    for nodes in ([moved, output], [moved, output]):
+        client.put(f"/workflows/{workflow_id}", json={
+            "name": "Versioned Workflow",
+            "description": "A test workflow",
+            "nodes": nodes,
+            "edges": [{"id": "e1", "source": "1", "target": "2"}]
+        }, headers=auth_headers)
+    
+    # The unchanged second save does not add a version
+    versions = client.get(f"/workflows/{workflow_id}/versions", headers=auth_headers).json()
+    assert [v["version"] for v in versions] == [2, 1]
+    assert versions[0]["node_count"] == 2
+    
+    diff = client.get(f"/workflows/{workflow_id}/diff?from_version=1", headers=auth_headers).json()
+    assert diff["nodes"] == {"added": [output], "changed": [moved], "removed": []}
+    assert diff["edges"]["added"] == [{"id": "e1", "source": "1", "target": "2"}]
+    
+    response = client.post(f"/workflows/{workflow_id}/versions/1/restore", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["nodes"] == [start]
+    
+    latest = client.get(f"/workflows/{workflow_id}/versions/3", headers=auth_headers).json()
+    assert latest["restored_from"] == 1
+    assert latest["graph_hash"] == versions[1]["graph_hash"]
+    assert latest["nodes"] == [start] and latest["edges"] == []
+    
+    assert client.get(f"/workflows/{workflow_id}/versions/9", headers=auth_headers).status_code == 404
+
+def test_session_graph_saves_do_not_overwrite_http_saves(auth_headers):
+    project_id = client.post("/projects", json={
+        "name": "Template Project",
+        "description": "A test project"
+    }, headers=auth_headers).json()["id"]
+    
+    # Workflows created from the same template share their graph objects
+    template = [{"id": "1", "type": "input"}, {"id": "2", "type": "output"}]
+    workflow_ids = [client.post(f"/projects/{project_id}/workflows", json={
+        "name": f"From template {i}",
+        "description": "A test workflow",
+        "nodes": template,
+        "edges": []
+    }, headers=auth_headers).json()["id"] for i in range(2)]
+    
+    store = WorkflowGraphStore()
+    nodes, edges, base_version = store.load(workflow_ids[0], project_id)
+    assert nodes == template and base_version == 1
+    assert store.load(workflow_ids[0], project_id + 1) is None
+    
+    client.put(f"/workflows/{workflow_ids[0]}", json={
+        "name": "From template 0",
+        "description": "Edited over HTTP",
+        "nodes": template[:1],
+        "edges": []
+    }, headers=auth_headers)
+    
+    with pytest.raises(GraphConflict):
+        store.save(workflow_ids[0], project_id, nodes + [{"id": "3"}], edges, base_version)
+    assert store.save(workflow_ids[0], project_id, nodes + [{"id": "3"}], edges, base_version=2) == 3
+    
+    db = TestingSessionLocal()
+    assert db.get(Workflow, workflow_ids[0]).nodes == nodes + [{"id": "3"}]
+    hashes = [digest for version in db.query(WorkflowVersion).filter(WorkflowVersion.workflow_id.in_(workflow_ids))
+              for _, digest in version.nodes]
+    assert db.query(WorkflowGraphObject).filter(WorkflowGraphObject.hash.in_(hashes)).count() == len(set(hashes)) == 3
+    db.close()
+
+def test_textract_job_records_progress(auth_headers, monkeypatch):
+    project_id = client.post("/projects", json={
+        "name": "Contracts",
+        "description": "A test project"
+    }, headers=auth_headers).json()["id"]
+    workflow_id = client.post(f"/projects/{project_id}/workflows", json={
+        "name": "Contract Review",
+        "description": "A test workflow"
+    }, headers=auth_headers).json()["id"]
+    
+    async def upload_file(file, key, content_type=None):
+        return f"s3://bucket/{key}"
+    
+    async def start_document_analysis(s3_uri):
+        return "job-1"
+    
+    async def document_analysis_pages(job_id):
+        for page in (1, 2):
+            yield {
+                "JobStatus": "SUCCEEDED",
+                "DocumentMetadata": {"Pages": 2},
+                "Blocks": [{"BlockType": "LINE", "Text": f"line {page}", "Confidence": 90.0 + page, "Page": page}]
+            }
+    
+    followed = []
+    async def follow(execution_id, job_id):
+        followed.append((execution_id, job_id))
+    
+    monkeypatch.setattr(main.aws_services, "upload_file", upload_file)
+    monkeypatch.setattr(main.aws_services, "start_document_analysis", start_document_analysis)
+    monkeypatch.setattr(main.aws_services, "document_analysis_pages", document_analysis_pages)
+    monkeypatch.setattr(main.textract_jobs, "session_factory", TestingSessionLocal)
+    real_follow = main.textract_jobs.follow
+    monkeypatch.setattr(main.textract_jobs, "follow", follow)
+    
+    response = client.post("/ai/textract/jobs", data={"workflow_id": workflow_id},
+                           files={"file": ("contract.pdf", b"%PDF", "application/pdf")}, headers=auth_headers)
+    assert response.status_code == 202
+    execution_id = response.json()["execution_id"]
+    assert response.json()["channel"] == f"execution:{execution_id}"
+    assert followed == [(execution_id, "job-1")]
+    
+    job = client.get(f"/ai/textract/jobs/{execution_id}", headers=auth_headers).json()
+    assert job["status"] == "running"
+    assert job["output_data"]["job_status"] == "IN_PROGRESS"
+    
+    asyncio.run(real_follow(execution_id, "job-1"))
+    
+    job = client.get(f"/ai/textract/jobs/{execution_id}", headers=auth_headers).json()
+    assert job["status"] == "completed"
+    assert job["output_data"]["text"] == "line 1\nline 2"
+    assert job["output_data"]["pages_processed"] == job["output_data"]["document_pages"] == 2
+    assert job["output_data"]["confidence"] == 91.5
+
+def create_textract_execution(auth_headers, status="running", started_at=None, worker_id=None, lease_expires_at=None):
+    project_id = client.post("/projects", json={
+        "name": "Invoices",
+        "description": "A test project"
+    }, headers=auth_headers).json()["id"]
+    workflow_id = client.post(f"/projects/{project_id}/workflows", json={
+        "name": "Invoice Review",
+        "description": "A test workflow"
+    }, headers=auth_headers).json()["id"]
+    
+    db = TestingSessionLocal()
+    execution = WorkflowExecution(
+        workflow_id=workflow_id,
+        status=status,
+        input_data={"kind": TEXTRACT_JOB_KIND, "job_id": f"job-{workflow_id}"},
+        output_data={"job_status": "IN_PROGRESS", "pages_processed": 0},
+        started_at=started_at or datetime.utcnow(),
+        worker_id=worker_id,
+        lease_expires_at=lease_expires_at
+    )
+    db.add(execution)
+    db.commit()
+    execution_id = execution.id
+    db.close()
+    return execution_id
+
+def test_textract_progress_websocket(auth_headers):
+    execution_id = create_textract_execution(auth_headers, status="completed")
+    token = auth_headers["Authorization"].split()[1]
+    
+    with client.websocket_connect(f"/ws/executions/{execution_id}?token={token}") as websocket:
+        assert websocket.receive_json()["type"] == "user_joined"
+        assert websocket.receive_json()["type"] == "session_state"
+        websocket.portal.call(main.textract_jobs._notify, execution_id, "running", {"job_id": "job-1", "pages_processed": 1})
+        message = websocket.receive_json()
+        assert message["type"] == "textract_progress"
+        assert message["execution_id"] == execution_id
+        assert message["pages_processed"] == 1
+        # Progress subscribers are never evicted for not answering pings
+        subscribers = [info for info in main.manager.connection_users.values() if info["session_id"] == f"execution:{execution_id}"]
+        assert [info["listen_only"] for info in subscribers] == [True]
+    
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect(f"/ws/executions/{execution_id}?token=invalid") as websocket:
+            websocket.receive_json()
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect(f"/ws/executions/999999?token={token}") as websocket:
+            websocket.receive_json()
+
+class FakeTextract:
+    async def document_analysis_pages(self, job_id):
+        yield {
+            "JobStatus": "SUCCEEDED",
+            "DocumentMetadata": {"Pages": 1},
+            "Blocks": [{"BlockType": "LINE", "Text": job_id, "Confidence": 99.0, "Page": 1}]
+        }
+
+def test_textract_jobs_resume_after_restart(auth_headers):
+    stale_id = create_textract_execution(auth_headers, started_at=datetime.utcnow() - timedelta(hours=2))
+    fresh_id = create_textract_execution(auth_headers, worker_id="stopped", lease_expires_at=datetime.utcnow() - timedelta(minutes=1))
+    leased_id = create_textract_execution(auth_headers, worker_id="busy", lease_expires_at=datetime.utcnow() + timedelta(minutes=1))
+    
+    runner = TextractJobRunner(FakeTextract(), session_factory=JobSessionLocal, timeout=3600)
+    other_node = TextractJobRunner(FakeTextract(), session_factory=JobSessionLocal, timeout=3600)
+    
+    async def recover():
+        resumed = await runner.recover()
+        # Jobs already being followed are not resumed twice, and other nodes find them claimed
+        assert await runner.recover() == 0
+        assert await other_node.recover() == 0
+        await asyncio.gather(*runner.tasks.values())
+        return resumed
+    
+    assert asyncio.run(recover()) == 2
+    assert runner.get_stats()["resumed"] == 2
+    
+    db = TestingSessionLocal()
+    stale, fresh, leased = (db.get(WorkflowExecution, i) for i in (stale_id, fresh_id, leased_id))
+    assert stale.status == "failed"
+    assert "did not finish within" in stale.error_message
+    assert fresh.status == "completed"
+    assert fresh.output_data["text"] == fresh.input_data["job_id"]
+    assert fresh.worker_id == runner.worker_id
+    # A job whose worker still renews its lease is left alone
+    assert (leased.status, leased.worker_id) == ("running", "busy")
+    db.close()
+
+def test_textract_follower_stops_once_its_lease_is_taken_over(auth_headers):
+    execution_id = create_textract_execution(auth_headers, worker_id="new-owner", lease_expires_at=datetime.utcnow() + timedelta(minutes=1))
+    runner = TextractJobRunner(FakeTextract(), session_factory=JobSessionLocal, timeout=3600)
+    
+    asyncio.run(runner.follow(execution_id, "job-1"))
+    
+    db = TestingSessionLocal()
+    execution = db.get(WorkflowExecution, execution_id)
+    assert (execution.status, execution.output_data["pages_processed"]) == ("running", 0)
+    assert runner.get_stats()["completed"] == runner.get_stats()["failed"] == 0
+    db.close()
+
+def test_comprehend_sentiment(auth_headers, monkeypatch):
+    async def analyze_sentiment(text):
+        return {"sentiment": "POSITIVE", "confidence_scores": {"Positive": 0.98}}
+    
+    monkeypatch.setattr(main.aws_services, "analyze_sentiment", analyze_sentiment)
+    response = client.post("/ai/comprehend/sentiment", json={"text": "Great product"}, headers=auth_headers)
+    
+    assert response.status_code == 200
+    assert response.json()["result"]["sentiment"] == "POSITIVE"
+
+def test_migrate_string_encoded_workflow_graphs(test_user):
+    db = TestingSessionLocal()
+    project = Project(name="Legacy Project", description="Old rows", owner_id=test_user.id)
+    db.add(project)
+    db.commit()
+    workflow = Workflow(
+        name="Legacy Workflow",
+        project_id=project.id,
+        nodes=json.dumps([{"id": "1", "type": "input"}]),
+        edges=json.dumps([])
+    )
+    db.add(workflow)
+    db.commit()
+    
+    assert migrate_workflow_graph_encoding(db) >= 1
+    db.expire_all()
+    assert workflow.nodes == [{"id": "1", "type": "input"}]
+    assert workflow.edges == []
+    # A second run finds nothing left to rewrite
+    assert migrate_workflow_graph_encoding(db) == 0
+    db.close()
+
+def test_lease_columns_added_to_existing_executions_table():
+    legacy_engine = create_engine("sqlite://")
+    with legacy_engine.begin() as connection:
+        connection.execute(text("CREATE TABLE workflow_executions (id INTEGER PRIMARY KEY, status VARCHAR)"))
+    db = sessionmaker(bind=legacy_engine)()
+    
+    assert add_execution_lease_columns(db) == 2
+    columns = {column["name"] for column in inspect(legacy_engine).get_columns("workflow_executions")}
+    assert {"worker_id", "lease_expires_at"} <= columns
+    # A second run finds nothing left to add
+    assert add_execution_lease_columns(db) == 0
+    db.close()
+
+def test_keyset_indexes_added_to_existing_tables():
+    legacy_engine = create_engine("sqlite://")
+    with legacy_engine.begin() as connection:
+        connection.execute(text("CREATE TABLE projects (id INTEGER PRIMARY KEY, owner_id INTEGER, created_at DATETIME)"))
+        connection.execute(text("CREATE TABLE workflows (id INTEGER PRIMARY KEY, project_id INTEGER, created_at DATETIME)"))
+    db = sessionmaker(bind=legacy_engine)()
+    
+    assert add_keyset_indexes(db) == 2
+    legacy = inspect(legacy_engine)
+    assert [index["column_names"] for index in legacy.get_indexes("projects")] == [["owner_id", "created_at", "id"]]
+    assert [index["column_names"] for index in legacy.get_indexes("workflows")] == [["project_id", "created_at", "id"]]
+    # A second run finds nothing left to create
+    assert add_keyset_indexes(db) == 0
+    db.close()
+
+def test_current_user_served_from_token_cache(auth_headers):
+    client.get("/projects", headers=auth_headers)
+    hits = token_cache.get_stats()["hits"]
+    
+    response = client.get("/projects", headers=auth_headers)
+    assert response.status_code == 200
+    assert token_cache.get_stats()["hits"] == hits + 1
+
+def test_deactivated_user_token_invalidated(auth_headers, test_user):
+    assert client.get("/dashboard/stats", headers=auth_headers).status_code == 200
+    
+    db = TestingSessionLocal()
+    user = db.query(User).filter(User.id == test_user.id).first()
+    user.is_active = False
+    db.commit()
+    db.close()
+    
+    response = client.get("/dashboard/stats", headers=auth_headers)
+    assert response.status_code == 401
+
 def test_unauthorized_access():
     response = client.get("/projects")
     assert response.status_code == 403
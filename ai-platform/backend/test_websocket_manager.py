@@ -0,0 +1,455 @@
+import asyncio
+import json
+import time
+import msgpack
+import pytest
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from models import Base, CollaborationSession
+from websocket_manager import ConnectionManager, CollaborationHandler
+from collab_graph import GraphConflict
+from backplane import InMemoryHub, InMemoryBackplane
+
+
+class FakeWebSocket:
+    """Records sent frames; send_delay simulates a slow client"""
+
+    def __init__(self, send_delay: float = 0.0, fail: bool = False):
+        self.send_delay = send_delay
+        self.fail = fail
+        self.sent = []
+        self.accepted = False
+        self.closed = False
+
+    async def accept(self):
+        self.accepted = True
+
+    async def send_text(self, data: str):
+        if self.fail:
+            raise RuntimeError("connection closed")
+        await asyncio.sleep(self.send_delay)
+        self.sent.append(data)
+
+    async def send_bytes(self, data: bytes):
+        await self.send_text(data)
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+
+    def messages(self, message_type: str = None):
+        decoded = [msgpack.unpackb(frame, strict_map_key=False) if isinstance(frame, bytes) else json.loads(frame) for frame in self.sent]
+        return [m for m in decoded if message_type is None or m['type'] == message_type]
+
+
+created_managers = []
+
+def make_manager(**kwargs) -> ConnectionManager:
+    manager = ConnectionManager(**kwargs)
+    created_managers.append(manager)
+    return manager
+
+@pytest.fixture(autouse=True)
+def shutdown_managers(event_loop):
+    yield
+    # Leave no writer, heartbeat or flusher task running once the test's loop closes
+    while created_managers:
+        event_loop.run_until_complete(created_managers.pop().shutdown())
+
+
+async def join(manager: ConnectionManager, session_id: str, count: int, project_id: int = None, **kwargs):
+    sockets = []
+    for user_id in range(1, count + 1):
+        websocket = FakeWebSocket(**kwargs)
+        await manager.connect(websocket, session_id, user_id, f"User {user_id}", project_id=project_id)
+        sockets.append(websocket)
+    return sockets
+
+@pytest.mark.asyncio
+async def test_broadcast_sends_concurrently():
+    manager = make_manager()
+    sockets = await join(manager, "session", 5)
+    await asyncio.sleep(0.05)
+    for websocket in sockets:
+        websocket.send_delay = 0.1
+
+    started = time.perf_counter()
+    await manager.handle_chat_message("session", 1, "User 1", "hello", sockets[0])
+    # Broadcasting only queues the message on each connection's writer
+    assert time.perf_counter() - started < 0.05
+
+    await asyncio.sleep(0.3)
+    for websocket in sockets[1:]:
+        assert websocket.messages('chat_message')[0]['message'] == "hello"
+    assert sockets[0].messages('chat_message') == []
+
+@pytest.mark.asyncio
+async def test_slow_and_failed_sockets_are_dropped():
+    manager = make_manager(send_timeout=0.05)
+    sockets = await join(manager, "session", 3)
+    await asyncio.sleep(0.05)
+    sockets[1].send_delay = 1.0
+    sockets[2].fail = True
+
+    await manager.handle_chat_message("session", 1, "User 1", "hello", None)
+    await asyncio.sleep(0.2)
+
+    assert sockets[0].messages('chat_message')[0]['message'] == "hello"
+    assert manager.active_connections["session"] == [sockets[0]]
+
+@pytest.mark.asyncio
+async def test_full_queue_drops_cursor_batches_but_keeps_chat():
+    manager = make_manager(queue_size=3)
+    sockets = await join(manager, "session", 2)
+    await asyncio.sleep(0.05)
+    sockets[1].send_delay = 10
+
+    # The stalled writer holds one message; the queue fills with cursor batches
+    for x in range(6):
+        await manager.broadcast_to_session("session", {'type': 'cursor_batch', 'updates': [{'user_id': 1, 'cursor_data': {'x': x}}]}, sockets[0])
+    await manager.handle_chat_message("session", 1, "User 1", "still here", sockets[0])
+
+    writer = manager.writers[sockets[1]]
+    queued = [json.loads(payload)['type'] for payload, _ in writer.queue]
+    assert queued.count('chat_message') == 1
+    assert writer.depth == 3
+
+    stats = manager.get_session_stats("session")
+    assert stats['dropped_messages'] == writer.dropped > 0
+    assert stats['max_queue_depth'] == 3
+
+@pytest.mark.asyncio
+async def test_client_behind_on_undroppable_messages_is_disconnected():
+    # Room for the joins' user_joined and session_state messages
+    manager = make_manager(queue_size=3)
+    sockets = await join(manager, "session", 2)
+    await asyncio.sleep(0.05)
+    sockets[1].send_delay = 10
+
+    for i in range(5):
+        await manager.handle_chat_message("session", 1, "User 1", f"message {i}", sockets[0])
+
+    assert sockets[1] not in manager.writers
+    assert manager.active_connections["session"] == [sockets[0]]
+
+@pytest.mark.asyncio
+async def test_cursor_updates_coalesced_into_batches():
+    manager = make_manager(cursor_tick_ms=20)
+    sockets = await join(manager, "session", 3)
+
+    for x in range(10):
+        await manager.handle_cursor_update("session", 1, {'x': x}, sockets[0])
+        await manager.handle_cursor_update("session", 2, {'x': -x}, sockets[1])
+    await manager.handle_selection_update("session", 2, {'node': 'a'}, sockets[1])
+    await asyncio.sleep(0.1)
+
+    batches = sockets[2].messages('cursor_batch')
+    assert len(batches) == 1
+    updates = {update['user_id']: update for update in batches[0]['updates']}
+    assert updates[1] == {'user_id': 1, 'cursor_data': {'x': 9}}
+    assert updates[2] == {'user_id': 2, 'cursor_data': {'x': -9}, 'selection_data': {'node': 'a'}}
+    assert manager.presence_flushers == {}
+
+@pytest.mark.asyncio
+async def test_backplane_fans_out_across_nodes():
+    hub = InMemoryHub()
+    node_a = make_manager(backplane=InMemoryBackplane(hub))
+    node_b = make_manager(backplane=InMemoryBackplane(hub))
+    sender, local = await join(node_a, "session", 2)
+    remote = FakeWebSocket()
+    await node_b.connect(remote, "session", 3, "User 3")
+    await asyncio.sleep(0.05)
+
+    await node_a.handle_chat_message("session", 1, "User 1", "hello", sender)
+    await asyncio.sleep(0.05)
+
+    assert local.messages('chat_message')[0]['message'] == "hello"
+    assert remote.messages('chat_message')[0]['message'] == "hello"
+    assert sender.messages('chat_message') == []
+    # Each broadcast is published once, whatever the number of nodes
+    assert node_a.backplane.published == 3
+    assert node_b.backplane.received == 2
+
+    node_b.disconnect(remote)
+    await asyncio.sleep(0.05)
+    assert hub.subscribers["session"] == {node_a.backplane}
+    assert sender.messages('user_left')[0]['user_id'] == 3
+
+class FakeGraphStore:
+    """Holds workflow 1 of project 10 and workflow 2 of project 20"""
+
+    def __init__(self, nodes, edges):
+        self.graphs = {(1, 10): (nodes, edges), (2, 20): ([], [])}
+        self.versions = {1: 1, 2: 1}
+        self.saved = []
+
+    def load(self, workflow_id, project_id):
+        graph = self.graphs.get((workflow_id, project_id))
+        return (*graph, self.versions[workflow_id]) if graph is not None else None
+
+    def save(self, workflow_id, project_id, nodes, edges, base_version=None):
+        if base_version != self.versions[workflow_id]:
+            raise GraphConflict(workflow_id)
+        self.saved.append((workflow_id, nodes, edges))
+        self.graphs[(workflow_id, project_id)] = (nodes, edges)
+        self.versions[workflow_id] += 1
+        return self.versions[workflow_id]
+
+    def save_elsewhere(self, workflow_id, project_id, nodes, edges):
+        """A save made over HTTP, outside any session"""
+        self.graphs[(workflow_id, project_id)] = (nodes, edges)
+        self.versions[workflow_id] += 1
+        return self.versions[workflow_id]
+
+@pytest.mark.asyncio
+async def test_workflow_updates_broadcast_deltas_and_save_debounced_snapshots():
+    nodes = [{'id': 'a', 'position': {'x': 0, 'y': 0}}, {'id': 'b', 'position': {'x': 100, 'y': 0}}]
+    store = FakeGraphStore(nodes, [{'id': 'e1', 'source': 'a', 'target': 'b'}])
+    manager = make_manager(graph_store=store, snapshot_interval=0.05)
+    editor, viewer = await join(manager, "session", 2, project_id=10)
+
+    for x in range(5):
+        await manager.handle_workflow_update("session", 1, {
+            'workflow_id': 1, 'patch_id': x, 'ops': [{'op': 'move_node', 'id': 'a', 'position': {'x': x, 'y': 0}}]
+        }, editor)
+    await manager.handle_workflow_update("session", 1, {
+        'workflow_id': 1, 'patch_id': 'rm', 'ops': [{'op': 'remove_node', 'id': 'b'}, {'op': 'remove_edge', 'id': 'e1'}]
+    }, editor)
+    await asyncio.sleep(0.1)
+
+    patches = viewer.messages('workflow_patch')
+    assert [patch['version'] for patch in patches] == [1, 2, 3, 4, 5, 6]
+    assert patches[0]['ops'] == [{'op': 'move_node', 'id': 'a', 'position': {'x': 0, 'y': 0}}]
+    assert patches[-1]['ops'] == [{'op': 'remove_node', 'id': 'b', 'removed_edges': ['e1']}]
+    assert editor.messages('workflow_patch') == []
+
+    ack = editor.messages('workflow_patch_ack')[-1]
+    assert ack['patch_id'] == 'rm' and ack['version'] == 6
+    assert ack['rejected'][0]['op'] == {'op': 'remove_edge', 'id': 'e1'}
+
+    assert store.saved == [(1, [{'id': 'a', 'position': {'x': 4, 'y': 0}}], [])]
+
+@pytest.mark.asyncio
+async def test_full_graph_update_is_diffed_into_operations():
+    nodes = [{'id': 'a', 'position': {'x': 0, 'y': 0}}, {'id': 'b', 'position': {'x': 100, 'y': 0}}]
+    store = FakeGraphStore(nodes, [])
+    manager = make_manager(graph_store=store, snapshot_interval=10)
+    editor, viewer = await join(manager, "session", 2, project_id=10)
+
+    await manager.handle_workflow_update("session", 1, {
+        'workflow_id': 1,
+        'nodes': [{'id': 'a', 'position': {'x': 5, 'y': 5}}, {'id': 'b', 'position': {'x': 100, 'y': 0}}, {'id': 'c', 'position': {'x': 0, 'y': 0}}],
+        'edges': [{'id': 'e1', 'source': 'a', 'target': 'c'}]
+    }, editor)
+    await asyncio.sleep(0.05)
+
+    assert viewer.messages('workflow_patch')[0]['ops'] == [
+        {'op': 'move_node', 'id': 'a', 'position': {'x': 5, 'y': 5}},
+        {'op': 'add_node', 'node': {'id': 'c', 'position': {'x': 0, 'y': 0}}},
+        {'op': 'add_edge', 'edge': {'id': 'e1', 'source': 'a', 'target': 'c'}}
+    ]
+
+    # The last user leaving writes the pending snapshot straight away
+    manager.disconnect(editor)
+    manager.disconnect(viewer)
+    await asyncio.sleep(0.05)
+    assert len(store.saved) == 1 and manager.graphs == {}
+
+@pytest.mark.asyncio
+async def test_workflows_of_other_projects_cannot_be_opened():
+    store = FakeGraphStore([{'id': 'a'}], [])
+    manager = make_manager(graph_store=store, snapshot_interval=0.01)
+    editor, = await join(manager, "session", 1, project_id=10)
+    outsider = FakeWebSocket()
+    await manager.connect(outsider, "no-project", 2, "User 2")
+
+    await manager.handle_workflow_update("session", 1, {
+        'workflow_id': 2, 'patch_id': 'p1', 'ops': [{'op': 'add_node', 'node': {'id': 'x'}}]
+    }, editor)
+    await manager.handle_workflow_sync("session", 2, editor)
+    await manager.handle_workflow_sync("no-project", 1, outsider)
+    await asyncio.sleep(0.05)
+
+    errors = editor.messages('workflow_error')
+    assert [error['patch_id'] for error in errors] == ['p1', None]
+    assert editor.messages('workflow_snapshot') == []
+    assert outsider.messages('workflow_error') and outsider.messages('workflow_snapshot') == []
+    assert manager.graphs == {} and store.saved == []
+
+@pytest.mark.asyncio
+async def test_graphs_reload_after_saves_outside_the_session():
+    store = FakeGraphStore([{'id': 'a'}], [])
+    manager = make_manager(graph_store=store, snapshot_interval=10)
+    editor, viewer = await join(manager, "session", 2, project_id=10)
+    await manager.handle_workflow_update("session", 1, {'workflow_id': 1, 'ops': [{'op': 'add_node', 'node': {'id': 'b'}}]}, editor)
+
+    # A restore over HTTP replaces the session graph, unsaved edits included
+    version = store.save_elsewhere(1, 10, [{'id': 'restored'}], [])
+    await manager.reload_workflow(1, version)
+    await asyncio.sleep(0.05)
+
+    snapshot = editor.messages('workflow_snapshot')[-1]
+    assert snapshot['nodes'] == [{'id': 'restored'}] and snapshot['version'] == 2
+    assert viewer.messages('workflow_snapshot')[-1] == snapshot
+    assert manager.graphs["session"].saved_version == version and not manager.graphs["session"].dirty
+    await manager.save_workflow_graph("session")
+    assert store.saved == []
+
+    # A save on another node is only noticed when the session saves; the stored graph wins
+    await manager.handle_workflow_update("session", 1, {'workflow_id': 1, 'ops': [{'op': 'add_node', 'node': {'id': 'c'}}]}, editor)
+    store.save_elsewhere(1, 10, [{'id': 'other-node'}], [])
+    await manager.save_workflow_graph("session")
+    await asyncio.sleep(0.05)
+
+    assert store.saved == []
+    assert editor.messages('workflow_snapshot')[-1]['nodes'] == [{'id': 'other-node'}]
+    assert manager.graphs["session"].saved_version == store.versions[1]
+
+@pytest.mark.asyncio
+async def test_session_activity_flushed_in_bulk():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    SessionFactory = sessionmaker(bind=engine)
+    db = SessionFactory()
+    db.add_all([CollaborationSession(session_id=name, active_users=[]) for name in ("one", "two")])
+    db.commit()
+
+    manager = make_manager(session_factory=SessionFactory, activity_flush_interval=0.05)
+    await join(manager, "one", 2)
+    sockets = await join(manager, "two", 1)
+    for x in range(20):
+        await manager.handle_cursor_update("one", 1, {'x': x}, None)
+    manager.disconnect(sockets[0])
+    await asyncio.sleep(0.1)
+
+    assert manager.pending_activity == {}
+    db.expire_all()
+    active = {row.session_id: row.active_users for row in db.query(CollaborationSession)}
+    assert active == {"one": [1, 2], "two": []}
+
+    CollaborationHandler.bulk_update_activity(db, [("two", [], datetime.utcnow() - timedelta(hours=2))])
+    assert CollaborationHandler.cleanup_inactive_sessions(db, hours=1) == 1
+    assert [row.session_id for row in db.query(CollaborationSession)] == ["one"]
+    db.close()
+
+@pytest.mark.asyncio
+async def test_msgpack_clients_get_compact_cursor_batches():
+    manager = make_manager(cursor_tick_ms=10)
+    sender, json_client = await join(manager, "session", 2)
+    compact_client = FakeWebSocket()
+    await manager.connect(compact_client, "session", 3, "User 3", encoding="cbor, msgpack")
+    await asyncio.sleep(0.05)
+
+    await manager.handle_cursor_update("session", 1, {'x': 1, 'y': 2}, sender)
+    await asyncio.sleep(0.05)
+
+    assert all(isinstance(frame, bytes) for frame in compact_client.sent)
+    batch = compact_client.messages('cursor_batch')[0]
+    assert batch['updates'] == [[1, {'x': 1, 'y': 2}, None]]
+    assert isinstance(batch['timestamp'], int)
+    assert abs(batch['timestamp'] - time.time() * 1000) < 5000
+
+    assert json_client.messages('cursor_batch')[0]['updates'] == [{'user_id': 1, 'cursor_data': {'x': 1, 'y': 2}}]
+
+@pytest.mark.asyncio
+async def test_session_state_encodes_each_user_once(monkeypatch):
+    import websocket_manager
+    entry_encodes, message_types = [], []
+    encode_entry, encode_message = websocket_manager.encode_entry, websocket_manager.encode_message
+    monkeypatch.setattr(websocket_manager, 'encode_entry', lambda *args: entry_encodes.append(args[0]) or encode_entry(*args))
+    monkeypatch.setattr(websocket_manager, 'encode_message', lambda message, *args: message_types.append(message['type']) or encode_message(message, *args))
+
+    manager = make_manager()
+    sockets = await join(manager, "session", 50)
+    # Each join encodes only the joining user's entry, never the whole user list
+    assert entry_encodes == list(range(1, 51))
+    assert 'session_state' not in message_types
+
+    # The cached map is reused, but every send carries its own timestamp
+    await manager.send_session_state(sockets[0], "session")
+    cached = manager.sessions["session"]['state_maps']['json']
+    await asyncio.sleep(0.01)
+    await manager.send_session_state(sockets[0], "session")
+    assert manager.sessions["session"]['state_maps']['json'] is cached
+    await asyncio.sleep(0.05)
+    first, second = sockets[0].messages('session_state')[-2:]
+    assert second['timestamp'] > first['timestamp']
+
+    # A cursor move re-encodes only the mover's entry
+    await manager.handle_cursor_update("session", 1, {'x': 3}, sockets[0])
+    assert entry_encodes == list(range(1, 51)) + [1]
+    await manager.send_session_state(sockets[1], "session")
+    await asyncio.sleep(0.05)
+
+    state = sockets[1].messages('session_state')[-1]
+    assert len(state['active_users']) == 50
+    assert state['active_users']['1']['cursor_position'] == {'x': 3}
+    assert state['active_users']['2']['current_selection'] is None
+    assert isinstance(state['active_users']['50']['connected_at'], str)
+
+    # A msgpack client encodes the entries for its encoding once
+    compact_client = FakeWebSocket()
+    await manager.connect(compact_client, "session", 51, "User 51", encoding="msgpack")
+    assert len(entry_encodes) == 51 + 1 + 51
+    await asyncio.sleep(0.05)
+    assert len(compact_client.messages('session_state')[0]['active_users']) == 51
+    assert 'session_state' not in message_types
+
+    manager.disconnect(sockets[1])
+    assert manager.sessions["session"]['state_maps'] == {}
+    assert 2 not in manager.sessions["session"]['state_entries']['json']
+    assert 2 not in manager.sessions["session"]['state_entries']['msgpack']
+
+@pytest.mark.asyncio
+async def test_joiner_sees_cursors_of_idle_users():
+    manager = make_manager()
+    idle, = await join(manager, "session", 1)
+    await manager.handle_cursor_update("session", 1, {'x': 5, 'y': 7}, idle)
+    await manager.handle_selection_update("session", 1, {'node_ids': ['a']}, idle)
+
+    joiner = FakeWebSocket()
+    await manager.connect(joiner, "session", 2, "User 2")
+    await asyncio.sleep(0.05)
+
+    state = joiner.messages('session_state')[0]
+    assert state['active_users']['1']['cursor_position'] == {'x': 5, 'y': 7}
+    assert state['active_users']['1']['current_selection'] == {'node_ids': ['a']}
+    assert state['active_users']['2']['cursor_position'] is None
+
+@pytest.mark.asyncio
+async def test_unresponsive_sockets_are_reaped():
+    manager = make_manager(ping_interval=0.02, ping_timeout=0.06)
+    alive, busy, silent_one, silent_two = await join(manager, "session", 4)
+
+    for x in range(8):
+        await asyncio.sleep(0.02)
+        await manager.handle_message(alive, {'type': 'pong'})
+        # Any message keeps a client alive, even without pongs
+        await manager.handle_message(busy, {'type': 'cursor_update', 'data': {'x': x}})
+    await asyncio.sleep(0.02)
+
+    assert manager.active_connections["session"] == [alive, busy]
+    assert manager.evicted_connections == 2
+    assert silent_one.closed and silent_two.closed and not alive.closed
+    assert alive.messages('ping')
+    assert sorted(m['user_id'] for m in alive.messages('user_left')) == [3, 4]
+    assert alive.messages('cursor_batch')[0]['updates'][0]['user_id'] == 2
+
+@pytest.mark.asyncio
+async def test_listen_only_sockets_outlive_the_ping_timeout():
+    manager = make_manager(ping_interval=0.02, ping_timeout=0.06)
+    listener = FakeWebSocket()
+    await manager.connect(listener, "execution:1", 1, "User 1", listen_only=True)
+
+    # Several timeouts pass without the client sending anything
+    await asyncio.sleep(0.2)
+    await manager.broadcast_to_session("execution:1", {'type': 'textract_progress', 'pages_processed': 3})
+    await asyncio.sleep(0.02)
+
+    assert manager.active_connections["execution:1"] == [listener]
+    assert manager.evicted_connections == 0
+    assert not listener.closed
+    assert listener.messages('textract_progress')[0]['pages_processed'] == 3
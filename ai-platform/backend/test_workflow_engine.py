@@ -0,0 +1,80 @@
+import asyncio
+import pytest
+
+from workflow_engine import WorkflowEngine, WorkflowGraph, WorkflowGraphError
+
+
+class FakeAWSServices:
+    """Stand-in for AWSServices that sleeps instead of calling AWS"""
+
+    def __init__(self, delay: float = 0.2):
+        self.delay = delay
+
+    async def analyze_sentiment(self, text):
+        await asyncio.sleep(self.delay)
+        return {'sentiment': 'POSITIVE', 'confidence_scores': {}}
+
+    async def extract_key_phrases(self, text):
+        await asyncio.sleep(self.delay)
+        return [{'text': text, 'confidence': 1.0}]
+
+
+SENTIMENT_NODES = [
+    {"id": "start", "type": "input"},
+    {"id": "sentiment", "type": "comprehend", "data": {"config": {"analysis_type": "sentiment"}}},
+    {"id": "key_phrases", "type": "comprehend", "data": {"config": {"analysis_type": "key_phrases"}}},
+    {"id": "categorization", "type": "custom"},
+    {"id": "output", "type": "output"}
+]
+
+SENTIMENT_EDGES = [
+    {"id": "e1", "source": "start", "target": "sentiment"},
+    {"id": "e2", "source": "start", "target": "key_phrases"},
+    {"id": "e3", "source": "sentiment", "target": "categorization"},
+    {"id": "e4", "source": "key_phrases", "target": "categorization"},
+    {"id": "e5", "source": "categorization", "target": "output"}
+]
+
+def test_graph_topological_order():
+    graph = WorkflowGraph(SENTIMENT_NODES, SENTIMENT_EDGES)
+    assert graph.order[0] == "start"
+    assert graph.order[-1] == "output"
+    assert set(graph.dependencies["categorization"]) == {"sentiment", "key_phrases"}
+
+def test_graph_rejects_cycles():
+    nodes = [{"id": "a", "type": "input"}, {"id": "b", "type": "output"}]
+    edges = [{"source": "a", "target": "b"}, {"source": "b", "target": "a"}]
+    with pytest.raises(WorkflowGraphError):
+        WorkflowGraph(nodes, edges)
+
+def test_graph_rejects_unknown_nodes():
+    with pytest.raises(WorkflowGraphError):
+        WorkflowGraph([{"id": "a"}], [{"id": "e1", "source": "a", "target": "missing"}])
+
+@pytest.mark.asyncio
+async def test_independent_branches_run_concurrently():
+    engine = WorkflowEngine(FakeAWSServices(delay=0.2))
+    outcome = await engine.run(SENTIMENT_NODES, SENTIMENT_EDGES, {"text": "Great care"})
+
+    assert outcome["status"] == "completed"
+    # Two 0.2s branches in parallel take roughly one branch, not the sum
+    assert outcome["execution_time"] < 0.35
+    timings = outcome["node_timings"]
+    assert timings["sentiment"]["started_at"] < timings["key_phrases"]["finished_at"]
+    assert timings["categorization"]["status"] == "skipped"
+    # Pass-through nodes hand their upstream results on to the output node
+    assert set(outcome["results"]["output"]) == {"sentiment", "key_phrases"}
+
+@pytest.mark.asyncio
+async def test_failed_node_fails_the_run():
+    class FailingAWSServices(FakeAWSServices):
+        async def analyze_sentiment(self, text):
+            raise Exception("Sentiment analysis failed")
+
+    engine = WorkflowEngine(FailingAWSServices(delay=0))
+    outcome = await engine.run(SENTIMENT_NODES, SENTIMENT_EDGES, {"text": "Great care"})
+
+    assert outcome["status"] == "failed"
+    assert "Sentiment analysis failed" in outcome["error"]
+    assert outcome["node_timings"]["sentiment"]["status"] == "failed"
+    assert "output" not in outcome["results"]
@@ -0,0 +1,94 @@
+from typing import Dict, Any, List, Optional
+
+def _related_ids(block: Dict[str, Any], relationship_type: str) -> List[str]:
+    ids = []
+    for relationship in block.get('Relationships', []):
+        if relationship['Type'] == relationship_type:
+            ids.extend(relationship['Ids'])
+    return ids
+
+def _child_text(block: Dict[str, Any], index: Dict[str, Dict[str, Any]]) -> str:
+    """Text of a cell, key or value: its WORD children, with selection marks as their status"""
+    words = []
+    for child_id in _related_ids(block, 'CHILD'):
+        child = index.get(child_id)
+        if child is None:
+            continue
+        if child['BlockType'] == 'WORD':
+            words.append(child['Text'])
+        elif child['BlockType'] == 'SELECTION_ELEMENT':
+            words.append(child['SelectionStatus'])
+    return ' '.join(words)
+
+def _resolve_table(table: Dict[str, Any], index: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    cells = [index[cell_id] for cell_id in _related_ids(table, 'CHILD')
+             if cell_id in index and index[cell_id]['BlockType'] == 'CELL']
+    row_count = max((cell['RowIndex'] for cell in cells), default=0)
+    column_count = max((cell['ColumnIndex'] for cell in cells), default=0)
+
+    rows = [[''] * column_count for _ in range(row_count)]
+    for cell in cells:
+        rows[cell['RowIndex'] - 1][cell['ColumnIndex'] - 1] = _child_text(cell, index)
+
+    return {
+        'id': table['Id'],
+        'page': table.get('Page'),
+        'confidence': table.get('Confidence', 0),
+        'rows': rows
+    }
+
+def _resolve_key_value(key: Dict[str, Any], index: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    value_ids = _related_ids(key, 'VALUE')
+    value: Optional[Dict[str, Any]] = index.get(value_ids[0]) if value_ids else None
+
+    return {
+        'id': key['Id'],
+        'page': key.get('Page'),
+        'confidence': key.get('Confidence', 0),
+        'key': _child_text(key, index),
+        'value': _child_text(value, index) if value is not None else '',
+        'value_confidence': value.get('Confidence', 0) if value is not None else 0
+    }
+
+def resolve_blocks(blocks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Reconstruct text, tables and key-value pairs from a Textract block list
+
+    One pass indexes every block by Id while collecting lines, tables, form
+    keys and confidence stats. Tables and key-value pairs are then rebuilt
+    through the CHILD/VALUE relationships; each block belongs to at most one
+    cell, key or value, so the whole response is resolved in linear time.
+    """
+    index: Dict[str, Dict[str, Any]] = {}
+    lines, tables, keys = [], [], []
+    confidence_total, confidence_count = 0.0, 0
+    confidence_min, confidence_max = None, None
+
+    for block in blocks:
+        index[block['Id']] = block
+
+        confidence = block.get('Confidence')
+        if confidence is not None:
+            confidence_total += confidence
+            confidence_count += 1
+            confidence_min = confidence if confidence_min is None else min(confidence_min, confidence)
+            confidence_max = confidence if confidence_max is None else max(confidence_max, confidence)
+
+        block_type = block['BlockType']
+        if block_type == 'LINE':
+            lines.append(block['Text'])
+        elif block_type == 'TABLE':
+            tables.append(block)
+        elif block_type == 'KEY_VALUE_SET' and 'KEY' in block.get('EntityTypes', []):
+            keys.append(block)
+
+    return {
+        'text': '\n'.join(lines),
+        'tables': [_resolve_table(table, index) for table in tables],
+        'forms': [_resolve_key_value(key, index) for key in keys],
+        'confidence': confidence_total / confidence_count if confidence_count else 0,
+        'confidence_stats': {
+            'count': confidence_count,
+            'min': confidence_min or 0,
+            'max': confidence_max or 0
+        }
+    }
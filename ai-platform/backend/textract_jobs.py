@@ -0,0 +1,257 @@
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Callable, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from models import WorkflowExecution
+from database import SessionLocal
+
+# input_data marker of executions that track an asynchronous Textract job
+TEXTRACT_JOB_KIND = 'textract_job'
+
+# Seconds after it started that a job still running is given up and marked failed
+TEXTRACT_JOB_TIMEOUT = float(os.getenv('TEXTRACT_JOB_TIMEOUT', '3600'))
+# Seconds a worker's claim on a job lasts unless renewed; another worker takes over an expired claim
+TEXTRACT_JOB_LEASE_SECONDS = float(os.getenv('TEXTRACT_JOB_LEASE_SECONDS', '60'))
+
+def execution_channel(execution_id: int) -> str:
+    """Collaboration session a client joins to receive an execution's progress"""
+    return f"execution:{execution_id}"
+
+def _seconds_since(started_at: Optional[datetime]) -> float:
+    if started_at is None:
+        return 0.0
+    if started_at.tzinfo is not None:
+        started_at = started_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return (datetime.utcnow() - started_at).total_seconds()
+
+class JobLeaseLost(Exception):
+    """Raised when another worker has taken over the job being followed"""
+    pass
+
+class TextractJobRunner:
+    """Follows asynchronous Textract jobs in the background
+    
+    Each job is tracked by a WorkflowExecution whose output_data holds the
+    progress while the job runs and the extracted text once it completes.
+    Progress is also broadcast as ``textract_progress`` messages to the
+    execution's collaboration channel.
+    
+    A job is followed by the one worker holding its lease. The lease is
+    renewed while the job runs, and every write is fenced on it, so when a
+    worker dies another one claims the job once the lease expires and the
+    two never both write.
+    """
+    
+    def __init__(self, aws_services, notifier=None, session_factory: Callable[[], Session] = SessionLocal,
+                 timeout: float = TEXTRACT_JOB_TIMEOUT, lease_seconds: float = TEXTRACT_JOB_LEASE_SECONDS):
+        self.aws_services = aws_services
+        # ConnectionManager used to push progress to subscribed clients
+        self.notifier = notifier
+        self.session_factory = session_factory
+        self.timeout = timeout
+        self.lease_seconds = lease_seconds
+        # Identifies this worker's leases
+        self.worker_id = uuid.uuid4().hex
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self.completed = 0
+        self.failed = 0
+        self.resumed = 0
+    
+    async def start(self, db: Session, workflow_id: int, s3_uri: str, filename: str = None) -> WorkflowExecution:
+        """Start a Textract job for a document in S3 and follow it in the background"""
+        job_id = await self.aws_services.start_document_analysis(s3_uri)
+        
+        execution = WorkflowExecution(
+            workflow_id=workflow_id,
+            status='running',
+            input_data={'kind': TEXTRACT_JOB_KIND, 's3_uri': s3_uri, 'filename': filename, 'job_id': job_id},
+            output_data={'job_id': job_id, 'job_status': 'IN_PROGRESS', 'pages_processed': 0, 'document_pages': None},
+            worker_id=self.worker_id,
+            lease_expires_at=self._lease_expiry()
+        )
+        db.add(execution)
+        db.commit()
+        db.refresh(execution)
+        
+        self.tasks[execution.id] = asyncio.create_task(self.follow(execution.id, job_id))
+        return execution
+    
+    async def recover(self) -> int:
+        """Claim and resume the running jobs whose worker's lease has expired
+        
+        Jobs past the timeout are marked failed straight away. Textract keeps
+        job results for days, so the others pick up where they stopped.
+        """
+        resumed = 0
+        for execution_id, input_data in await self._run_db(self._orphaned_jobs):
+            input_data = input_data or {}
+            if input_data.get('kind') != TEXTRACT_JOB_KIND or execution_id in self.tasks:
+                continue
+            # Another worker may claim the same job first
+            if not await self._run_db(self._claim, execution_id):
+                continue
+            self.tasks[execution_id] = asyncio.create_task(self.follow(execution_id, input_data.get('job_id')))
+            resumed += 1
+        self.resumed += resumed
+        return resumed
+    
+    async def run_recovery(self):
+        """Recover orphaned jobs now and then once per lease period"""
+        while True:
+            await self.recover()
+            await asyncio.sleep(self.lease_seconds)
+    
+    async def follow(self, execution_id: int, job_id: str):
+        """Stream a job's result pages into its execution record
+        
+        Every write uses its own short-lived session, run off the event loop,
+        so no database connection is held while Textract is being polled.
+        """
+        heartbeat = asyncio.create_task(self._renew_lease(execution_id))
+        try:
+            progress, started_at = await self._run_db(self._read, execution_id)
+            remaining = self.timeout - _seconds_since(started_at)
+            try:
+                result = await asyncio.wait_for(self._collect(execution_id, job_id, progress), timeout=max(remaining, 0))
+                status, error_message, output_data = 'completed', None, {**progress, **result}
+            except JobLeaseLost:
+                # The worker that took over records the outcome
+                return
+            except asyncio.TimeoutError:
+                status, error_message = 'failed', f"Textract job {job_id} did not finish within {self.timeout:.0f} seconds"
+                output_data = {**progress, 'job_status': 'FAILED'}
+            except Exception as e:
+                status, error_message, output_data = 'failed', str(e), {**progress, 'job_status': 'FAILED'}
+            
+            if not await self._run_db(
+                self._write,
+                execution_id,
+                {
+                    'status': status,
+                    'error_message': error_message,
+                    'output_data': output_data,
+                    'execution_time': _seconds_since(started_at),
+                    'completed_at': datetime.utcnow()
+                }
+            ):
+                return
+            if status == 'completed':
+                self.completed += 1
+            else:
+                self.failed += 1
+            await self._notify(execution_id, status, progress)
+        finally:
+            heartbeat.cancel()
+            self.tasks.pop(execution_id, None)
+    
+    async def _renew_lease(self, execution_id: int):
+        # Keeps the lease while Textract is polled between page writes
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await self._run_db(self._write, execution_id, {}):
+                return
+    
+    async def _collect(self, execution_id: int, job_id: str, progress: Dict[str, Any]) -> Dict[str, Any]:
+        lines = []
+        confidence_total, confidence_count = 0.0, 0
+        table_count, form_count = 0, 0
+        
+        async for page in self.aws_services.document_analysis_pages(job_id):
+            # Only per-page counters are kept; each page's blocks are dropped once processed
+            for block in page.get('Blocks', []):
+                if 'Confidence' in block:
+                    confidence_total += block['Confidence']
+                    confidence_count += 1
+                if block['BlockType'] == 'LINE':
+                    lines.append(block['Text'])
+                elif block['BlockType'] == 'TABLE':
+                    table_count += 1
+                elif block['BlockType'] == 'KEY_VALUE_SET' and 'KEY' in block.get('EntityTypes', []):
+                    form_count += 1
+                progress['pages_processed'] = max(progress.get('pages_processed') or 0, block.get('Page', 0))
+            
+            progress.update(
+                job_status=page['JobStatus'],
+                document_pages=page.get('DocumentMetadata', {}).get('Pages')
+            )
+            if not await self._run_db(self._write, execution_id, {'output_data': dict(progress)}):
+                raise JobLeaseLost(execution_id)
+            await self._notify(execution_id, 'running', progress)
+        
+        return {
+            'text': '\n'.join(lines),
+            'table_count': table_count,
+            'form_count': form_count,
+            'confidence': confidence_total / confidence_count if confidence_count else 0
+        }
+    
+    def _lease_expiry(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+    
+    def _orphaned_jobs(self, db: Session):
+        return db.query(WorkflowExecution.id, WorkflowExecution.input_data).filter(
+            WorkflowExecution.status == 'running',
+            or_(WorkflowExecution.lease_expires_at.is_(None), WorkflowExecution.lease_expires_at < datetime.utcnow())
+        ).all()
+    
+    def _claim(self, db: Session, execution_id: int) -> bool:
+        # Conditional UPDATE, so of several workers racing for a job exactly one wins
+        claimed = db.query(WorkflowExecution).filter(
+            WorkflowExecution.id == execution_id,
+            WorkflowExecution.status == 'running',
+            or_(WorkflowExecution.lease_expires_at.is_(None), WorkflowExecution.lease_expires_at < datetime.utcnow())
+        ).update({'worker_id': self.worker_id, 'lease_expires_at': self._lease_expiry()}, synchronize_session=False)
+        db.commit()
+        return claimed == 1
+    
+    def _read(self, db: Session, execution_id: int):
+        execution = db.get(WorkflowExecution, execution_id)
+        return dict(execution.output_data or {}), execution.started_at
+    
+    def _write(self, db: Session, execution_id: int, values: Dict[str, Any]) -> bool:
+        """Update the execution and renew the lease; False when this worker no longer holds it"""
+        written = db.query(WorkflowExecution).filter(
+            WorkflowExecution.id == execution_id,
+            WorkflowExecution.worker_id == self.worker_id
+        ).update({**values, 'lease_expires_at': self._lease_expiry()}, synchronize_session=False)
+        db.commit()
+        return written == 1
+    
+    async def _run_db(self, operation: Callable, *args):
+        def run():
+            db = self.session_factory()
+            try:
+                return operation(db, *args)
+            finally:
+                db.close()
+        return await asyncio.get_running_loop().run_in_executor(None, run)
+    
+    async def _notify(self, execution_id: int, status: str, progress: Dict[str, Any]):
+        if self.notifier is None:
+            return
+        try:
+            await self.notifier.broadcast_to_session(execution_channel(execution_id), {
+                'type': 'textract_progress',
+                'execution_id': execution_id,
+                'status': status,
+                'job_id': progress.get('job_id'),
+                'pages_processed': progress.get('pages_processed'),
+                'document_pages': progress.get('document_pages'),
+                'timestamp': datetime.utcnow().isoformat()
+            })
+        except Exception:
+            # Subscribers can still poll the execution
+            pass
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'running': len(self.tasks),
+            'completed': self.completed,
+            'failed': self.failed,
+            'resumed': self.resumed
+        }
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Set
+from sqlalchemy import event
+
+from models import User, UserRole
+
+# Token cache configuration
+TOKEN_CACHE_TTL_SECONDS = float(os.getenv("TOKEN_CACHE_TTL_SECONDS", "60"))
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000"))
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """Lightweight, session-independent copy of the authenticated user"""
+    id: int
+    email: str
+    full_name: str
+    company: Optional[str]
+    role: Optional[UserRole]
+    is_active: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserSnapshot":
+        return cls(
+            id=user.id,
+            email=user.email,
+            full_name=user.full_name,
+            company=user.company,
+            role=user.role,
+            is_active=user.is_active
+        )
+
+@dataclass
+class CachedToken:
+    claims: Dict[str, Any]
+    user: UserSnapshot
+    expires_at: float
+
+class TokenCache:
+    """In-process TTL/LRU cache of verified tokens and their users
+
+    Entries are keyed by a SHA-256 of the token so raw tokens are never kept in
+    memory, and never outlive the token's own ``exp`` claim. User changes only
+    evict entries in the process that made them; other workers serve theirs
+    until the TTL expires.
+    """
+
+    def __init__(self, ttl_seconds: float = TOKEN_CACHE_TTL_SECONDS, max_entries: int = TOKEN_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CachedToken]" = OrderedDict()
+        self._keys_by_user: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Optional[CachedToken]:
+        """Return the cached entry for a token, if present and not expired"""
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= time.time():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, token: str, claims: Dict[str, Any], user: UserSnapshot):
+        """Cache a verified token and its user snapshot"""
+        expires_at = time.time() + self.ttl_seconds
+        if claims.get("exp"):
+            expires_at = min(expires_at, float(claims["exp"]))
+
+        key = self._key(token)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = CachedToken(claims=claims, user=user, expires_at=expires_at)
+            self._keys_by_user.setdefault(user.id, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def invalidate_user(self, user_id: int):
+        """Drop every cached token belonging to a user"""
+        with self._lock:
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._keys_by_user.get(entry.user.id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_user[entry.user.id]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache size and hit/miss counts"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+# Global token cache instance
+token_cache = TokenCache()
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target: User):
+    """Evict cached tokens whenever a user row is updated, deactivated or deleted"""
+    token_cache.invalidate_user(target.id)
@@ -1,57 +1,240 @@
 import json
 import asyncio
-from typing import Dict, List, Set
+import logging
+import os
+import time
+from collections import deque
+from typing import Dict, List, Set, Deque, Tuple, Callable, Union
 from fastapi import WebSocket, WebSocketDisconnect
+from sqlalchemy import update, delete, case, cast, literal, JSON
 from sqlalchemy.orm import Session
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid
 
 from models import CollaborationSession, User
-from database import get_db
+from database import get_db, SessionLocal
+from backplane import Backplane, create_backplane
+from collab_graph import GraphConflict, SessionGraph, WorkflowGraphStore
+from message_codec import DEFAULT_ENCODING, encode_message, encode_entry, encode_map, encode_message_with_map, negotiate_encoding
+
+logger = logging.getLogger(__name__)
+
+# Seconds a single socket may take to accept a message before it is dropped
+WEBSOCKET_SEND_TIMEOUT = float(os.getenv('WEBSOCKET_SEND_TIMEOUT', '5'))
+# Maximum number of messages buffered per connection
+WEBSOCKET_QUEUE_SIZE = int(os.getenv('WEBSOCKET_QUEUE_SIZE', '256'))
+
+# Interval at which coalesced cursor/selection updates are broadcast
+WEBSOCKET_CURSOR_TICK_MS = int(os.getenv('WEBSOCKET_CURSOR_TICK_MS', '40'))
+
+# Seconds between bulk writes of session presence and last activity
+SESSION_ACTIVITY_FLUSH_INTERVAL = float(os.getenv('SESSION_ACTIVITY_FLUSH_INTERVAL', '5'))
+# How often inactive sessions are deleted, and after how many hours of inactivity
+SESSION_CLEANUP_INTERVAL = float(os.getenv('SESSION_CLEANUP_INTERVAL', '3600'))
+SESSION_INACTIVE_HOURS = int(os.getenv('SESSION_INACTIVE_HOURS', '24'))
+
+# Seconds between persisted snapshots of a session's workflow graph
+WORKFLOW_SNAPSHOT_INTERVAL = float(os.getenv('WORKFLOW_SNAPSHOT_INTERVAL', '2'))
+
+# Seconds between heartbeat pings, and without a pong before a socket is evicted
+WEBSOCKET_PING_INTERVAL = float(os.getenv('WEBSOCKET_PING_INTERVAL', '20'))
+WEBSOCKET_PING_TIMEOUT = float(os.getenv('WEBSOCKET_PING_TIMEOUT', '45'))
+
+# Message types a lagging client can miss; the next update supersedes them
+DROPPABLE_MESSAGE_TYPES = {'cursor_batch', 'ping'}
+
+class ConnectionWriter:
+    """Bounded outbound queue for one WebSocket, drained by its own writer task
+    
+    When the queue is full, droppable messages are discarded (newest first,
+    then queued ones to make room for other messages). A client whose queue is
+    full of messages that cannot be dropped is reported through on_failure.
+    """
+    
+    def __init__(self, websocket: WebSocket, on_failure: Callable[[WebSocket], None],
+                 max_size: int = WEBSOCKET_QUEUE_SIZE, send_timeout: float = WEBSOCKET_SEND_TIMEOUT,
+                 encoding: str = DEFAULT_ENCODING):
+        self.websocket = websocket
+        # Wire encoding negotiated by the client
+        self.encoding = encoding
+        self.on_failure = on_failure
+        self.max_size = max_size
+        self.send_timeout = send_timeout
+        self.queue: Deque[Tuple[Union[str, bytes], bool]] = deque()
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+        self._ready = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+    
+    @property
+    def depth(self) -> int:
+        return len(self.queue)
+    
+    def enqueue(self, payload: Union[str, bytes], droppable: bool = False) -> bool:
+        """Queue a serialized message; returns False if the client is hopelessly behind"""
+        if len(self.queue) >= self.max_size:
+            if droppable:
+                self.dropped += 1
+                return True
+            if not self._evict_droppable():
+                return False
+        
+        self.queue.append((payload, droppable))
+        self._ready.set()
+        return True
+    
+    def _evict_droppable(self) -> bool:
+        for index, (_, droppable) in enumerate(self.queue):
+            if droppable:
+                del self.queue[index]
+                self.dropped += 1
+                return True
+        return False
+    
+    async def _run(self):
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                
+                payload, _ = self.queue.popleft()
+                if isinstance(payload, bytes):
+                    send = self.websocket.send_bytes(payload)
+                else:
+                    send = self.websocket.send_text(payload)
+                await asyncio.wait_for(send, timeout=self.send_timeout)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Connection is closed or too slow to accept a message
+            self.on_failure(self.websocket)
+    
+    def close(self):
+        """Stop the writer task and discard anything still queued"""
+        # wait_for() can swallow the cancellation when a send completes at the
+        # same moment, so the loop also stops on the flag
+        self.closed = True
+        self._task.cancel()
+        self.queue.clear()
+        self._ready.set()
 
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, send_timeout: float = WEBSOCKET_SEND_TIMEOUT, queue_size: int = WEBSOCKET_QUEUE_SIZE,
+                 cursor_tick_ms: int = WEBSOCKET_CURSOR_TICK_MS, backplane: Backplane = None,
+                 graph_store: WorkflowGraphStore = None, snapshot_interval: float = WORKFLOW_SNAPSHOT_INTERVAL,
+                 session_factory: Callable[[], Session] = SessionLocal,
+                 activity_flush_interval: float = SESSION_ACTIVITY_FLUSH_INTERVAL,
+                 cleanup_interval: float = SESSION_CLEANUP_INTERVAL,
+                 ping_interval: float = WEBSOCKET_PING_INTERVAL, ping_timeout: float = WEBSOCKET_PING_TIMEOUT):
+        # Shares session messages with the other backend nodes
+        self.node_id = uuid.uuid4().hex
+        self.backplane = backplane or create_backplane('memory')
+        self.backplane.set_handler(self._deliver_from_backplane)
+        self.graph_store = graph_store or WorkflowGraphStore()
+        self.snapshot_interval = snapshot_interval
+        # Workflow graph being edited, by session
+        self.graphs: Dict[str, SessionGraph] = {}
+        # Scheduled snapshot write of each session's graph
+        self.graph_savers: Dict[str, asyncio.Task] = {}
+        self.session_factory = session_factory
+        self.activity_flush_interval = activity_flush_interval
+        self.cleanup_interval = cleanup_interval
+        # Last activity not yet written to collaboration_sessions, by session
+        self.pending_activity: Dict[str, datetime] = {}
+        self.activity_task: asyncio.Task = None
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.heartbeat_task: asyncio.Task = None
+        self.evicted_connections = 0
+        self.send_timeout = send_timeout
+        self.queue_size = queue_size
+        self.cursor_tick = cursor_tick_ms / 1000
+        # Latest unsent cursor/selection per user, by session
+        self.pending_presence: Dict[str, Dict[int, Dict]] = {}
+        # Scheduled flush of pending presence updates, by session
+        self.presence_flushers: Dict[str, asyncio.Task] = {}
+        # Outbound writer for each connection
+        self.writers: Dict[WebSocket, ConnectionWriter] = {}
         # Store active connections by session_id
         self.active_connections: Dict[str, List[WebSocket]] = {}
         # Store user info for each connection
         self.connection_users: Dict[WebSocket, Dict] = {}
         # Store session info
         self.sessions: Dict[str, Dict] = {}
+        # Fire-and-forget work, such as announcing departures, awaited on shutdown
+        self.background_tasks: Set[asyncio.Task] = set()
 
-    async def connect(self, websocket: WebSocket, session_id: str, user_id: int, user_name: str):
-        """Accept a new WebSocket connection"""
+    async def connect(self, websocket: WebSocket, session_id: str, user_id: int, user_name: str,
+                      encoding: str = None, project_id: int = None, listen_only: bool = False):
+        """Accept a new WebSocket connection
+        
+        encoding is the client's comma-separated list of preferred wire
+        encodings (for example from an ``?encoding=msgpack`` query parameter);
+        clients that send none get JSON text frames. project_id is the
+        CollaborationSession's project; only that project's workflows can be
+        edited in the session, and sessions without one cannot edit workflows.
+        listen_only marks clients that only receive messages and so never
+        answer pings; they are not evicted for being silent.
+        """
         await websocket.accept()
         
         # Initialize session if it doesn't exist
         if session_id not in self.active_connections:
             self.active_connections[session_id] = []
+            # Receive the session's messages from other nodes
+            await self.backplane.subscribe(session_id)
             self.sessions[session_id] = {
+                'project_id': project_id,
                 'active_users': {},
                 'created_at': datetime.utcnow(),
-                'last_activity': datetime.utcnow()
+                'last_activity': datetime.utcnow(),
+                # Messages dropped for connections that have since left
+                'dropped_messages': 0,
+                # Encoded session_state entry of each active user, by wire encoding
+                'state_entries': {},
+                # Encoded active_users map by wire encoding, reset whenever an entry changes
+                'state_maps': {}
             }
         
         # Add connection to session
         self.active_connections[session_id].append(websocket)
+        self.writers[websocket] = ConnectionWriter(
+            websocket, self.disconnect, max_size=self.queue_size, send_timeout=self.send_timeout,
+            encoding=negotiate_encoding(encoding)
+        )
         
         # Store user info for this connection
         self.connection_users[websocket] = {
             'user_id': user_id,
             'user_name': user_name,
             'session_id': session_id,
-            'connected_at': datetime.utcnow()
+            # Identifies the connection in messages relayed through the backplane
+            'connection_id': uuid.uuid4().hex,
+            'connected_at': datetime.utcnow(),
+            # Monotonic time of the client's last message of any kind
+            'last_seen': time.monotonic(),
+            'listen_only': listen_only
         }
         
-        # Add user to session
+        # Add user to session; entries are kept JSON-ready for session_state
         self.sessions[session_id]['active_users'][user_id] = {
             'user_name': user_name,
-            'connected_at': datetime.utcnow(),
+            'connected_at': datetime.utcnow().isoformat(),
             'cursor_position': None,
             'current_selection': None
         }
+        self._update_state_entry(session_id, user_id)
         
         # Update last activity
-        self.sessions[session_id]['last_activity'] = datetime.utcnow()
+        self._touch(session_id)
+        if self.activity_task is None or self.activity_task.done():
+            self.activity_task = asyncio.create_task(self._run_activity_flusher())
+        if self.heartbeat_task is None or self.heartbeat_task.done():
+            self.heartbeat_task = asyncio.create_task(self._run_heartbeat())
         
         # Notify other users in the session
         await self.broadcast_user_joined(session_id, user_id, user_name)
@@ -67,50 +250,131 @@ class ConnectionManager:
             user_id = user_info['user_id']
             user_name = user_info['user_name']
             
+            # Stop the connection's writer
+            writer = self.writers.pop(websocket, None)
+            if writer is not None:
+                writer.close()
+            
             # Remove connection from session
             if session_id in self.active_connections:
                 self.active_connections[session_id].remove(websocket)
+                if writer is not None:
+                    self.sessions[session_id]['dropped_messages'] += writer.dropped
                 
                 # Remove user from session
                 if user_id in self.sessions[session_id]['active_users']:
                     del self.sessions[session_id]['active_users'][user_id]
+                    self._update_state_entry(session_id, user_id)
+                self.pending_presence.get(session_id, {}).pop(user_id, None)
+                self._touch(session_id)
                 
                 # Clean up empty sessions
                 if not self.active_connections[session_id]:
                     del self.active_connections[session_id]
                     del self.sessions[session_id]
-                else:
-                    # Notify other users that this user left
-                    asyncio.create_task(
-                        self.broadcast_user_left(session_id, user_id, user_name)
-                    )
+                    self.pending_presence.pop(session_id, None)
+                    flusher = self.presence_flushers.pop(session_id, None)
+                    if flusher is not None:
+                        flusher.cancel()
+                
+                # Notify other users, who may be connected to other nodes, that this user left
+                task = asyncio.create_task(self._leave_session(session_id, user_id, user_name))
+                self.background_tasks.add(task)
+                task.add_done_callback(self.background_tasks.discard)
             
             # Remove user info
             del self.connection_users[websocket]
 
+    async def shutdown(self):
+        """Disconnect and close every socket, then stop the background tasks
+        
+        Sessions left empty persist their workflow graphs as usual.
+        """
+        websockets = list(self.connection_users)
+        writer_tasks = [writer._task for writer in self.writers.values()]
+        for websocket in websockets:
+            self.disconnect(websocket)
+        await asyncio.gather(*self.background_tasks, return_exceptions=True)
+        
+        tasks = [self.heartbeat_task, self.activity_task, *self.presence_flushers.values(), *self.graph_savers.values()]
+        tasks = [task for task in tasks if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, *writer_tasks, return_exceptions=True)
+        await asyncio.gather(
+            *[asyncio.wait_for(websocket.close(code=1001), timeout=self.send_timeout) for websocket in websockets],
+            return_exceptions=True
+        )
+
     async def send_personal_message(self, message: dict, websocket: WebSocket):
         """Send a message to a specific WebSocket connection"""
         try:
-            await websocket.send_text(json.dumps(message))
+            writer = self.writers.get(websocket)
+            if writer is not None and not writer.enqueue(encode_message(message, writer.encoding)):
+                self.disconnect(websocket)
         except:
             # Connection might be closed
             pass
 
     async def broadcast_to_session(self, session_id: str, message: dict, exclude_websocket: WebSocket = None):
-        """Broadcast a message to all connections in a session"""
-        if session_id in self.active_connections:
-            disconnected = []
-            for connection in self.active_connections[session_id]:
-                if connection != exclude_websocket:
-                    try:
-                        await connection.send_text(json.dumps(message))
-                    except:
-                        # Connection is closed, mark for removal
-                        disconnected.append(connection)
-            
-            # Clean up disconnected connections
-            for connection in disconnected:
-                self.disconnect(connection)
+        """Broadcast a message to all connections in a session
+        
+        The message is published once to the session's backplane channel;
+        every node subscribed to the session, this one included, fans it out
+        to its own sockets.
+        """
+        exclude_id = None
+        if exclude_websocket in self.connection_users:
+            exclude_id = self.connection_users[exclude_websocket]['connection_id']
+        
+        envelope = json.dumps({
+            'origin': self.node_id,
+            'type': message.get('type'),
+            'exclude': exclude_id,
+            'droppable': message.get('type') in DROPPABLE_MESSAGE_TYPES,
+            'message': message
+        })
+        await self.backplane.publish(session_id, envelope)
+
+    async def _deliver_from_backplane(self, session_id: str, data: str):
+        envelope = json.loads(data)
+        if envelope['type'] == 'workflow_patch' and envelope['origin'] != self.node_id:
+            self._mirror_workflow_patch(session_id, envelope['message'])
+        elif envelope['type'] == 'workflow_snapshot' and envelope['origin'] != self.node_id:
+            self._mirror_workflow_snapshot(session_id, envelope['message'])
+        self.deliver_local(session_id, envelope['message'], envelope['droppable'], envelope['exclude'])
+
+    def deliver_local(self, session_id: str, message: dict, droppable: bool = False, exclude_id: str = None):
+        """Queue a message on this node's connections to a session
+        
+        The message is serialized once per wire encoding in use. A slow
+        client only delays itself. Clients that cannot keep up with messages
+        that must not be dropped are disconnected.
+        """
+        payloads = {}
+        overflowed = []
+        for connection in self.active_connections.get(session_id, []):
+            if exclude_id is not None and self.connection_users[connection]['connection_id'] == exclude_id:
+                continue
+            writer = self.writers.get(connection)
+            if writer is None:
+                continue
+            if writer.encoding not in payloads:
+                payloads[writer.encoding] = encode_message(message, writer.encoding)
+            if not writer.enqueue(payloads[writer.encoding], droppable):
+                overflowed.append(connection)
+        
+        # Clean up connections that fell too far behind
+        for connection in overflowed:
+            self.disconnect(connection)
+
+    async def _leave_session(self, session_id: str, user_id: int, user_name: str):
+        await self.broadcast_user_left(session_id, user_id, user_name)
+        # Stop receiving the session once its last local user is gone, unless
+        # someone rejoined in the meantime
+        if session_id not in self.active_connections:
+            await self.backplane.unsubscribe(session_id)
+            await self.close_workflow(session_id)
 
     async def broadcast_user_joined(self, session_id: str, user_id: int, user_name: str):
         """Notify session users that a new user joined"""
@@ -133,54 +397,287 @@ class ConnectionManager:
         await self.broadcast_to_session(session_id, message)
 
     async def send_session_state(self, websocket: WebSocket, session_id: str):
-        """Send current session state to a user"""
-        if session_id in self.sessions:
-            session = self.sessions[session_id]
-            message = {
-                'type': 'session_state',
-                'active_users': session['active_users'],
-                'timestamp': datetime.utcnow().isoformat()
-            }
-            await self.send_personal_message(message, websocket)
+        """Send current session state to a user
+        
+        Each active user's entry is encoded when the user joins and again
+        only when that user's own presence changes; the active_users map is
+        joined from those entries and cached per wire encoding, so a join
+        costs one entry encode however many users are in the session.
+        """
+        writer = self.writers.get(websocket)
+        if session_id not in self.sessions or writer is None:
+            return
+        
+        session = self.sessions[session_id]
+        maps = session['state_maps']
+        if writer.encoding not in maps:
+            entries = session['state_entries'].get(writer.encoding)
+            if entries is None:
+                # First client with this encoding in the session
+                entries = session['state_entries'][writer.encoding] = {
+                    user_id: encode_entry(user_id, user, writer.encoding)
+                    for user_id, user in session['active_users'].items()
+                }
+            maps[writer.encoding] = encode_map(list(entries.values()), writer.encoding)
+        
+        payload = encode_message_with_map(
+            {'type': 'session_state', 'timestamp': datetime.utcnow().isoformat()},
+            'active_users', maps[writer.encoding], writer.encoding
+        )
+        if not writer.enqueue(payload):
+            self.disconnect(websocket)
+
+    def _update_state_entry(self, session_id: str, user_id: int):
+        """Re-encode (or drop) one user's session_state entry after it changed"""
+        session = self.sessions[session_id]
+        user = session['active_users'].get(user_id)
+        for encoding, entries in session['state_entries'].items():
+            if user is None:
+                entries.pop(user_id, None)
+            else:
+                entries[user_id] = encode_entry(user_id, user, encoding)
+        session['state_maps'].clear()
 
     async def handle_cursor_update(self, session_id: str, user_id: int, cursor_data: dict, websocket: WebSocket):
         """Handle cursor position updates"""
         if session_id in self.sessions and user_id in self.sessions[session_id]['active_users']:
             self.sessions[session_id]['active_users'][user_id]['cursor_position'] = cursor_data
-            
-            message = {
-                'type': 'cursor_update',
-                'user_id': user_id,
-                'cursor_data': cursor_data,
-                'timestamp': datetime.utcnow().isoformat()
-            }
-            await self.broadcast_to_session(session_id, message, exclude_websocket=websocket)
+            self._update_state_entry(session_id, user_id)
+            self._touch(session_id)
+            self._queue_presence(session_id, user_id, 'cursor_data', cursor_data)
 
     async def handle_selection_update(self, session_id: str, user_id: int, selection_data: dict, websocket: WebSocket):
         """Handle text/element selection updates"""
         if session_id in self.sessions and user_id in self.sessions[session_id]['active_users']:
             self.sessions[session_id]['active_users'][user_id]['current_selection'] = selection_data
-            
+            self._update_state_entry(session_id, user_id)
+            self._touch(session_id)
+            self._queue_presence(session_id, user_id, 'selection_data', selection_data)
+
+    def _queue_presence(self, session_id: str, user_id: int, key: str, data: dict):
+        """Keep only the latest cursor/selection per user until the next tick"""
+        updates = self.pending_presence.setdefault(session_id, {})
+        updates.setdefault(user_id, {'user_id': user_id})[key] = data
+        
+        if session_id not in self.presence_flushers:
+            self.presence_flushers[session_id] = asyncio.create_task(self._flush_presence_after_tick(session_id))
+
+    async def _flush_presence_after_tick(self, session_id: str):
+        try:
+            await asyncio.sleep(self.cursor_tick)
+        finally:
+            self.presence_flushers.pop(session_id, None)
+        await self.flush_presence(session_id)
+
+    async def flush_presence(self, session_id: str):
+        """Broadcast all pending cursor/selection updates as one cursor_batch message
+        
+        Every recipient gets the same batch, including the sender's own entry,
+        so clients should skip updates carrying their own user_id.
+        """
+        updates = self.pending_presence.pop(session_id, None)
+        if not updates:
+            return
+        
+        message = {
+            'type': 'cursor_batch',
+            'updates': list(updates.values()),
+            'timestamp': datetime.utcnow().isoformat()
+        }
+        await self.broadcast_to_session(session_id, message)
+
+    async def handle_workflow_update(self, session_id: str, user_id: int, workflow_data: dict, websocket: WebSocket):
+        """Handle workflow changes
+        
+        workflow_data carries a workflow_id, a client patch_id and a list of
+        patch ``ops``; clients that still send the full ``nodes``/``edges``
+        are diffed against the session graph. Only the applied operations are
+        broadcast; the sender gets an ack with the new version and any
+        rejected operations.
+        """
+        graph = await self.open_workflow(session_id, workflow_data.get('workflow_id'))
+        if graph is None:
+            await self._send_workflow_error(websocket, workflow_data.get('patch_id'))
+            return
+        
+        ops = workflow_data.get('ops')
+        if ops is None:
+            ops = graph.diff(workflow_data.get('nodes'), workflow_data.get('edges'))
+        applied, rejected = graph.apply(ops)
+        
+        if applied:
+            self._touch(session_id)
             message = {
-                'type': 'selection_update',
+                'type': 'workflow_patch',
+                'workflow_id': graph.workflow_id,
                 'user_id': user_id,
-                'selection_data': selection_data,
+                'version': graph.version,
+                'ops': applied,
                 'timestamp': datetime.utcnow().isoformat()
             }
             await self.broadcast_to_session(session_id, message, exclude_websocket=websocket)
+            self._schedule_graph_save(session_id)
+        
+        await self.send_personal_message({
+            'type': 'workflow_patch_ack',
+            'workflow_id': graph.workflow_id,
+            'patch_id': workflow_data.get('patch_id'),
+            'version': graph.version,
+            'rejected': rejected
+        }, websocket)
 
-    async def handle_workflow_update(self, session_id: str, user_id: int, workflow_data: dict, websocket: WebSocket):
-        """Handle workflow changes"""
-        message = {
-            'type': 'workflow_update',
-            'user_id': user_id,
-            'workflow_data': workflow_data,
+    async def handle_workflow_sync(self, session_id: str, workflow_id: int, websocket: WebSocket):
+        """Send the full workflow graph to a client that joined or missed a version"""
+        graph = await self.open_workflow(session_id, workflow_id)
+        if graph is None:
+            await self._send_workflow_error(websocket)
+            return
+        await self.send_personal_message({'type': 'workflow_snapshot', **graph.snapshot()}, websocket)
+
+    async def _send_workflow_error(self, websocket: WebSocket, patch_id=None):
+        await self.send_personal_message({
+            'type': 'workflow_error',
+            'patch_id': patch_id,
+            'error': 'Workflow not found'
+        }, websocket)
+
+    async def open_workflow(self, session_id: str, workflow_id: int) -> SessionGraph:
+        """Get the session's graph of a workflow, loading it from the database if needed
+        
+        Returns None unless the workflow belongs to the session's project.
+        """
+        graph = self.graphs.get(session_id)
+        if graph is not None and graph.workflow_id == workflow_id:
+            return graph
+        project_id = self.sessions.get(session_id, {}).get('project_id')
+        if workflow_id is None or project_id is None:
+            return None
+        
+        loaded = await asyncio.get_running_loop().run_in_executor(None, self.graph_store.load, workflow_id, project_id)
+        if loaded is None:
+            return None
+        
+        # Another update may have loaded the graph while we waited
+        graph = self.graphs.get(session_id)
+        if graph is not None and graph.workflow_id == workflow_id:
+            return graph
+        if graph is not None:
+            # The session moved on to another workflow
+            await self.close_workflow(session_id)
+        
+        nodes, edges, saved_version = loaded
+        graph = self.graphs[session_id] = SessionGraph(
+            workflow_id, nodes, edges, project_id=project_id, saved_version=saved_version
+        )
+        return graph
+
+    async def close_workflow(self, session_id: str):
+        """Persist and drop a session's graph"""
+        saver = self.graph_savers.pop(session_id, None)
+        if saver is not None:
+            saver.cancel()
+        try:
+            await self.save_workflow_graph(session_id)
+        finally:
+            self.graphs.pop(session_id, None)
+
+    def _mirror_workflow_patch(self, session_id: str, message: dict):
+        # Keep this node's copy of the graph in step with edits made on other
+        # nodes; the originating node persists them
+        graph = self.graphs.get(session_id)
+        if graph is not None and graph.workflow_id == message['workflow_id']:
+            dirty = graph.dirty
+            graph.apply(message['ops'])
+            graph.version = message['version']
+            graph.dirty = dirty
+
+    def _mirror_workflow_snapshot(self, session_id: str, message: dict):
+        graph = self.graphs.get(session_id)
+        if graph is not None and graph.workflow_id == message['workflow_id']:
+            self.graphs[session_id] = SessionGraph(
+                graph.workflow_id, message['nodes'], message['edges'], version=message['version'],
+                project_id=graph.project_id, saved_version=graph.saved_version
+            )
+
+    async def reload_workflow(self, workflow_id: int, version: int):
+        """Reload the open graphs of a workflow saved outside its sessions (HTTP update or restore)
+        
+        version is the stored version of that save; graphs already based on
+        it keep their unsaved edits.
+        """
+        for session_id, graph in list(self.graphs.items()):
+            if graph.workflow_id == workflow_id and graph.saved_version != version:
+                await self._reload_graph(session_id)
+
+    async def _reload_graph(self, session_id: str):
+        """Replace a session's graph with the stored workflow and send it to every client"""
+        graph = self.graphs.get(session_id)
+        if graph is None:
+            return
+        saver = self.graph_savers.pop(session_id, None)
+        if saver is not None:
+            saver.cancel()
+        
+        loaded = await asyncio.get_running_loop().run_in_executor(
+            None, self.graph_store.load, graph.workflow_id, graph.project_id
+        )
+        if self.graphs.get(session_id) is not graph:
+            # Replaced or closed while loading
+            return
+        if loaded is None:
+            del self.graphs[session_id]
+            return
+        
+        nodes, edges, saved_version = loaded
+        # Bump the version so clients replace whatever they hold
+        reloaded = self.graphs[session_id] = SessionGraph(
+            graph.workflow_id, nodes, edges, version=graph.version + 1,
+            project_id=graph.project_id, saved_version=saved_version
+        )
+        await self.broadcast_to_session(session_id, {
+            'type': 'workflow_snapshot',
+            **reloaded.snapshot(),
             'timestamp': datetime.utcnow().isoformat()
-        }
-        await self.broadcast_to_session(session_id, message, exclude_websocket=websocket)
+        })
+
+    def _schedule_graph_save(self, session_id: str):
+        if session_id not in self.graph_savers:
+            self.graph_savers[session_id] = asyncio.create_task(self._save_graph_after_interval(session_id))
+
+    async def _save_graph_after_interval(self, session_id: str):
+        try:
+            await asyncio.sleep(self.snapshot_interval)
+        finally:
+            self.graph_savers.pop(session_id, None)
+        await self.save_workflow_graph(session_id)
+
+    async def save_workflow_graph(self, session_id: str):
+        """Write the session's graph to Workflow.nodes/edges if it changed"""
+        graph = self.graphs.get(session_id)
+        if graph is None or not graph.dirty:
+            return
+        
+        snapshot = graph.snapshot()
+        graph.dirty = False
+        try:
+            graph.saved_version = await asyncio.get_running_loop().run_in_executor(
+                None, self.graph_store.save, graph.workflow_id, graph.project_id,
+                snapshot['nodes'], snapshot['edges'], graph.saved_version
+            )
+        except GraphConflict:
+            # The stored workflow wins over edits made on a stale graph
+            if session_id in self.active_connections:
+                await self._reload_graph(session_id)
+        except Exception:
+            # Retry with the next snapshot
+            graph.dirty = True
+            if session_id in self.active_connections:
+                self._schedule_graph_save(session_id)
+            raise
 
     async def handle_chat_message(self, session_id: str, user_id: int, user_name: str, message_text: str, websocket: WebSocket):
         """Handle chat messages"""
+        self._touch(session_id)
         message = {
             'type': 'chat_message',
             'user_id': user_id,
@@ -192,6 +689,7 @@ class ConnectionManager:
 
     async def handle_notification(self, session_id: str, user_id: int, notification_data: dict, websocket: WebSocket):
         """Handle notifications"""
+        self._touch(session_id)
         message = {
             'type': 'notification',
             'user_id': user_id,
@@ -200,26 +698,150 @@ class ConnectionManager:
         }
         await self.broadcast_to_session(session_id, message, exclude_websocket=websocket)
 
+    async def handle_message(self, websocket: WebSocket, message: dict):
+        """Dispatch a message received from a client
+        
+        Every inbound message counts as a sign of life, so clients that are
+        busy sending are never evicted for a missed pong.
+        """
+        self.handle_pong(websocket)
+        user_info = self.connection_users.get(websocket)
+        if user_info is None:
+            return
+        
+        session_id, user_id = user_info['session_id'], user_info['user_id']
+        message_type = message.get('type')
+        data = message.get('data') or {}
+        if message_type == 'cursor_update':
+            await self.handle_cursor_update(session_id, user_id, data, websocket)
+        elif message_type == 'selection_update':
+            await self.handle_selection_update(session_id, user_id, data, websocket)
+        elif message_type == 'workflow_update':
+            await self.handle_workflow_update(session_id, user_id, data, websocket)
+        elif message_type == 'workflow_sync':
+            await self.handle_workflow_sync(session_id, data.get('workflow_id'), websocket)
+        elif message_type == 'chat_message':
+            await self.handle_chat_message(session_id, user_id, user_info['user_name'], message.get('message', ''), websocket)
+        elif message_type == 'notification':
+            await self.handle_notification(session_id, user_id, data, websocket)
+
+    def handle_pong(self, websocket: WebSocket):
+        """Record that a client is alive"""
+        if websocket in self.connection_users:
+            self.connection_users[websocket]['last_seen'] = time.monotonic()
+
+    async def _run_heartbeat(self):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            await self.reap_unresponsive()
+            self._send_pings()
+
+    def _send_pings(self):
+        message = {'type': 'ping', 'timestamp': datetime.utcnow().isoformat()}
+        payloads = {}
+        for writer in self.writers.values():
+            if writer.encoding not in payloads:
+                payloads[writer.encoding] = encode_message(message, writer.encoding)
+            writer.enqueue(payloads[writer.encoding], droppable=True)
+
+    async def reap_unresponsive(self) -> int:
+        """Disconnect and close every socket silent for longer than ping_timeout
+        
+        Each evicted user is announced to its session with user_left.
+        Listen-only sockets are kept; a dead one is dropped when a send to it
+        times out.
+        """
+        cutoff = time.monotonic() - self.ping_timeout
+        unresponsive = [
+            websocket for websocket, info in self.connection_users.items()
+            if not info['listen_only'] and info['last_seen'] < cutoff
+        ]
+        for websocket in unresponsive:
+            self.disconnect(websocket)
+        self.evicted_connections += len(unresponsive)
+        # Free the underlying connections; a dead peer may never complete the close handshake
+        await asyncio.gather(
+            *[asyncio.wait_for(websocket.close(code=1001), timeout=self.send_timeout) for websocket in unresponsive],
+            return_exceptions=True
+        )
+        return len(unresponsive)
+
+    def _touch(self, session_id: str):
+        """Record session activity; written to the database by the activity flusher"""
+        now = datetime.utcnow()
+        if session_id in self.sessions:
+            self.sessions[session_id]['last_activity'] = now
+        self.pending_activity[session_id] = now
+
+    async def _run_activity_flusher(self):
+        next_cleanup = time.monotonic() + self.cleanup_interval
+        while True:
+            await asyncio.sleep(self.activity_flush_interval)
+            try:
+                await self.flush_activity()
+                if time.monotonic() >= next_cleanup:
+                    next_cleanup = time.monotonic() + self.cleanup_interval
+                    await self._run_db(CollaborationHandler.cleanup_inactive_sessions)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error flushing collaboration activity: {str(e)}")
+
+    async def flush_activity(self):
+        """Write presence and last activity of every touched session in one bulk UPDATE"""
+        if not self.pending_activity:
+            return
+        
+        pending, self.pending_activity = self.pending_activity, {}
+        updates = [
+            (session_id, list(self.sessions[session_id]['active_users']) if session_id in self.sessions else [], last_activity)
+            for session_id, last_activity in pending.items()
+        ]
+        try:
+            await self._run_db(CollaborationHandler.bulk_update_activity, updates)
+        except Exception:
+            # Keep the updates for the next flush unless newer activity replaced them
+            for session_id, last_activity in pending.items():
+                self.pending_activity.setdefault(session_id, last_activity)
+            raise
+
+    async def _run_db(self, operation: Callable, *args):
+        def run():
+            db = self.session_factory()
+            try:
+                return operation(db, *args)
+            finally:
+                db.close()
+        return await asyncio.get_running_loop().run_in_executor(None, run)
+
     def get_session_stats(self, session_id: str) -> dict:
         """Get statistics for a session"""
         if session_id not in self.sessions:
             return {}
         
         session = self.sessions[session_id]
+        writers = [self.writers[ws] for ws in self.active_connections.get(session_id, []) if ws in self.writers]
         return {
             'session_id': session_id,
             'active_users_count': len(session['active_users']),
             'active_users': list(session['active_users'].values()),
             'created_at': session['created_at'].isoformat(),
-            'last_activity': session['last_activity'].isoformat()
+            'last_activity': session['last_activity'].isoformat(),
+            'queue_depth': sum(writer.depth for writer in writers),
+            'max_queue_depth': max((writer.depth for writer in writers), default=0),
+            'dropped_messages': session['dropped_messages'] + sum(writer.dropped for writer in writers)
         }
 
     def get_all_sessions_stats(self) -> List[dict]:
         """Get statistics for all active sessions"""
         return [self.get_session_stats(session_id) for session_id in self.sessions.keys()]
 
+    def get_backplane_stats(self) -> dict:
+        """Get message counts for the cross-node backplane"""
+        return self.backplane.get_stats()
+
 # Global connection manager instance
-manager = ConnectionManager()
+manager = ConnectionManager(backplane=create_backplane())
 
 class CollaborationHandler:
     """Handle collaboration-related database operations"""
@@ -250,26 +872,46 @@ class CollaborationHandler:
     @staticmethod
     def update_session_activity(db: Session, session_id: str, active_users: List[int]):
         """Update session activity"""
-        session = db.query(CollaborationSession).filter(
-            CollaborationSession.session_id == session_id
-        ).first()
+        CollaborationHandler.bulk_update_activity(db, [(session_id, active_users, datetime.utcnow())])
+    
+    @staticmethod
+    def bulk_update_activity(db: Session, updates: List[Tuple[str, List[int], datetime]], batch_size: int = 500):
+        """Update active users and last activity of many sessions, one UPDATE per batch"""
+        # Postgres types the CASE branches as text unless they are cast back to
+        # JSON; SQLite has no JSON type to cast to and stores the text as is
+        if db.get_bind().dialect.name == 'postgresql':
+            json_value = lambda users: cast(literal(users, JSON), JSON)
+        else:
+            json_value = lambda users: literal(users, JSON)
         
-        if session:
-            session.active_users = active_users
-            session.last_activity = datetime.utcnow()
-            db.commit()
+        for start in range(0, len(updates), batch_size):
+            batch = updates[start:start + batch_size]
+            db.execute(
+                update(CollaborationSession)
+                .where(CollaborationSession.session_id.in_([session_id for session_id, _, _ in batch]))
+                .values(
+                    active_users=case(
+                        {session_id: json_value(users) for session_id, users, _ in batch},
+                        value=CollaborationSession.session_id
+                    ),
+                    last_activity=case(
+                        {session_id: last_activity for session_id, _, last_activity in batch},
+                        value=CollaborationSession.session_id
+                    )
+                )
+                .execution_options(synchronize_session=False)
+            )
+        db.commit()
     
     @staticmethod
-    def cleanup_inactive_sessions(db: Session, hours: int = 24):
+    def cleanup_inactive_sessions(db: Session, hours: int = SESSION_INACTIVE_HOURS):
         """Clean up sessions that have been inactive for specified hours"""
         cutoff_time = datetime.utcnow() - timedelta(hours=hours)
         
-        inactive_sessions = db.query(CollaborationSession).filter(
-            CollaborationSession.last_activity < cutoff_time
-        ).all()
-        
-        for session in inactive_sessions:
-            db.delete(session)
-        
+        result = db.execute(
+            delete(CollaborationSession)
+            .where(CollaborationSession.last_activity < cutoff_time)
+            .execution_options(synchronize_session=False)
+        )
         db.commit()
-        return len(inactive_sessions)
+        return result.rowcount
@@ -0,0 +1,222 @@
+import asyncio
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Callable, Awaitable
+from sqlalchemy.orm import Session
+
+from models import Workflow, WorkflowExecution
+
+
+class WorkflowGraphError(Exception):
+    """Raised when a workflow's nodes/edges do not form a valid DAG"""
+
+
+class WorkflowGraph:
+    """Dependency graph parsed from a workflow's stored nodes and edges"""
+
+    def __init__(self, nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]]):
+        self.nodes: Dict[str, Dict[str, Any]] = {}
+        for node in nodes or []:
+            node_id = str(node.get('id'))
+            if node_id in self.nodes:
+                raise WorkflowGraphError(f"Duplicate node id: {node_id}")
+            self.nodes[node_id] = node
+
+        # Map each node to the set of nodes it depends on
+        self.dependencies: Dict[str, List[str]] = {node_id: [] for node_id in self.nodes}
+        self.dependents: Dict[str, List[str]] = {node_id: [] for node_id in self.nodes}
+        for edge in edges or []:
+            source, target = str(edge.get('source')), str(edge.get('target'))
+            if source not in self.nodes or target not in self.nodes:
+                raise WorkflowGraphError(f"Edge {edge.get('id')} references an unknown node")
+            if source not in self.dependencies[target]:
+                self.dependencies[target].append(source)
+                self.dependents[source].append(target)
+
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> List[str]:
+        """Return node ids in dependency order, rejecting cycles"""
+        remaining = {node_id: len(deps) for node_id, deps in self.dependencies.items()}
+        ready = deque(node_id for node_id, count in remaining.items() if count == 0)
+        order = []
+
+        while ready:
+            node_id = ready.popleft()
+            order.append(node_id)
+            for dependent in self.dependents[node_id]:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    ready.append(dependent)
+
+        if len(order) != len(self.nodes):
+            raise WorkflowGraphError("Workflow graph contains a cycle")
+        return order
+
+
+class WorkflowEngine:
+    """Runs workflow graphs, executing independent branches concurrently"""
+
+    def __init__(self, aws_services):
+        self.aws_services = aws_services
+        self.node_handlers: Dict[str, Callable[..., Awaitable[Any]]] = {
+            'input': self._run_input,
+            'output': self._run_output,
+            'textract': self._run_textract,
+            'comprehend': self._run_comprehend,
+            'rekognition': self._run_rekognition,
+        }
+
+    async def run(self, nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]],
+                  input_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Run a workflow graph and return node results with per-node timings
+
+        Each node starts as soon as all of its upstream nodes have finished, so
+        the total run time follows the critical path of the graph.
+        """
+        graph = WorkflowGraph(nodes, edges)
+        input_data = input_data or {}
+        results: Dict[str, Any] = {}
+        timings: Dict[str, Dict[str, Any]] = {}
+        tasks: Dict[str, asyncio.Task] = {}
+        # Inputs of pass-through nodes, handed on to their downstream nodes
+        forwarded: Dict[str, Dict[str, Any]] = {}
+        run_started = time.perf_counter()
+
+        async def run_node(node_id: str):
+            upstream = graph.dependencies[node_id]
+            if upstream:
+                await asyncio.gather(*(tasks[dep] for dep in upstream))
+
+            node = graph.nodes[node_id]
+            started = time.perf_counter()
+            timings[node_id] = {
+                'type': node.get('type'),
+                'started_at': round(started - run_started, 6),
+                'status': 'running'
+            }
+            try:
+                inputs = {}
+                for dep in upstream:
+                    if dep in forwarded:
+                        inputs.update(forwarded[dep])
+                    else:
+                        inputs[dep] = results[dep]
+
+                handler = self.node_handlers.get(node.get('type'))
+                if handler is None:
+                    # Node types without a backing service pass their inputs through
+                    forwarded[node_id] = inputs
+                    results[node_id] = {'skipped': True, 'type': node.get('type')}
+                    timings[node_id]['status'] = 'skipped'
+                else:
+                    config = (node.get('data') or {}).get('config') or {}
+                    results[node_id] = await handler(config, inputs, input_data)
+                    timings[node_id]['status'] = 'completed'
+            except Exception:
+                timings[node_id]['status'] = 'failed'
+                raise
+            finally:
+                finished = time.perf_counter()
+                timings[node_id]['finished_at'] = round(finished - run_started, 6)
+                timings[node_id]['duration'] = round(finished - started, 6)
+
+        # Tasks are created in topological order so every dependency exists first
+        for node_id in graph.order:
+            tasks[node_id] = asyncio.ensure_future(run_node(node_id))
+
+        error = None
+        try:
+            await asyncio.gather(*tasks.values())
+        except Exception as e:
+            error = e
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+        return {
+            'status': 'failed' if error else 'completed',
+            'error': str(error) if error else None,
+            'results': results,
+            'node_timings': timings,
+            'execution_time': time.perf_counter() - run_started
+        }
+
+    async def execute(self, db: Session, workflow: Workflow,
+                      input_data: Optional[Dict[str, Any]] = None) -> WorkflowExecution:
+        """Run a stored workflow and persist the run as a WorkflowExecution row"""
+        execution = WorkflowExecution(
+            workflow_id=workflow.id,
+            status='running',
+            input_data=input_data or {}
+        )
+        db.add(execution)
+        db.commit()
+        db.refresh(execution)
+
+        try:
+            outcome = await self.run(workflow.nodes or [], workflow.edges or [], input_data)
+        except WorkflowGraphError as e:
+            outcome = {
+                'status': 'failed',
+                'error': str(e),
+                'results': {},
+                'node_timings': {},
+                'execution_time': 0.0
+            }
+
+        execution.status = outcome['status']
+        execution.error_message = outcome['error']
+        execution.output_data = {
+            'results': outcome['results'],
+            'node_timings': outcome['node_timings']
+        }
+        execution.execution_time = outcome['execution_time']
+        execution.completed_at = datetime.utcnow()
+        db.commit()
+        db.refresh(execution)
+
+        return execution
+
+    async def _run_input(self, config: Dict[str, Any], inputs: Dict[str, Any],
+                         input_data: Dict[str, Any]) -> Dict[str, Any]:
+        return input_data
+
+    async def _run_output(self, config: Dict[str, Any], inputs: Dict[str, Any],
+                          input_data: Dict[str, Any]) -> Dict[str, Any]:
+        return inputs
+
+    async def _run_textract(self, config: Dict[str, Any], inputs: Dict[str, Any],
+                            input_data: Dict[str, Any]) -> Dict[str, Any]:
+        s3_uri = self._resolve_value('input_uri', config, inputs, input_data)
+        return await self.aws_services.analyze_document(s3_uri)
+
+    async def _run_rekognition(self, config: Dict[str, Any], inputs: Dict[str, Any],
+                               input_data: Dict[str, Any]) -> Dict[str, Any]:
+        s3_uri = self._resolve_value('input_uri', config, inputs, input_data)
+        return await self.aws_services.analyze_image(s3_uri)
+
+    async def _run_comprehend(self, config: Dict[str, Any], inputs: Dict[str, Any],
+                              input_data: Dict[str, Any]) -> Any:
+        text = self._resolve_value('text', config, inputs, input_data) or ''
+        analysis_type = config.get('analysis_type', 'sentiment')
+
+        if analysis_type == 'sentiment':
+            return await self.aws_services.analyze_sentiment(text)
+        elif analysis_type == 'entities':
+            return await self.aws_services.extract_entities(text)
+        elif analysis_type == 'key_phrases':
+            return await self.aws_services.extract_key_phrases(text)
+        return {'skipped': True, 'analysis_type': analysis_type}
+
+    @staticmethod
+    def _resolve_value(key: str, config: Dict[str, Any], inputs: Dict[str, Any],
+                       input_data: Dict[str, Any]) -> Any:
+        """Look up a node input in its config, then upstream results, then run input"""
+        if config.get(key):
+            return config[key]
+        for result in inputs.values():
+            if isinstance(result, dict) and result.get(key):
+                return result[key]
+        return input_data.get(key)
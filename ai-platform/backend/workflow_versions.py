@@ -0,0 +1,146 @@
+import hashlib
+import json
+from typing import Dict, Any, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from models import Workflow, WorkflowGraphObject, WorkflowVersion
+
+# Append-only, content-addressed history of workflow graphs. Every node and
+# edge is stored once under the SHA-256 of its canonical JSON; a version is
+# only a manifest of (id, hash) pairs, so a save adds rows just for the
+# nodes and edges it changed.
+
+def content_hash(obj: Any) -> str:
+    """SHA-256 of the canonical JSON encoding of a node, edge or manifest"""
+    canonical = json.dumps(obj, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def _manifest(items: List[Dict[str, Any]]) -> Tuple[List[List[str]], Dict[str, Any]]:
+    entries, objects = [], {}
+    for item in items or []:
+        digest = content_hash(item)
+        entries.append([str(item.get("id")), digest])
+        objects[digest] = item
+    return entries, objects
+
+def latest_version(db: Session, workflow_id: int) -> Optional[WorkflowVersion]:
+    return db.execute(
+        select(WorkflowVersion)
+        .where(WorkflowVersion.workflow_id == workflow_id)
+        .order_by(WorkflowVersion.version.desc())
+        .limit(1)
+    ).scalar_one_or_none()
+
+def get_version(db: Session, workflow_id: int, version: int) -> Optional[WorkflowVersion]:
+    return db.execute(
+        select(WorkflowVersion).where(WorkflowVersion.workflow_id == workflow_id, WorkflowVersion.version == version)
+    ).scalar_one_or_none()
+
+def lock_workflow(db: Session, workflow_id: int):
+    """Lock the workflow row until commit, serializing saves that number versions"""
+    db.execute(select(Workflow.id).where(Workflow.id == workflow_id).with_for_update())
+
+def _store_objects(db: Session, objects: Dict[str, Any]):
+    if not objects:
+        return
+    # Identical nodes are often saved by several workflows at once (e.g. ones
+    # created from the same template); let the database skip existing hashes
+    dialect = db.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        db.execute(
+            insert(WorkflowGraphObject)
+            .values([{"hash": digest, "content": content} for digest, content in objects.items()])
+            .on_conflict_do_nothing(index_elements=["hash"])
+        )
+        return
+
+    existing = set(db.execute(
+        select(WorkflowGraphObject.hash).where(WorkflowGraphObject.hash.in_(list(objects)))
+    ).scalars())
+    db.add_all([
+        WorkflowGraphObject(hash=digest, content=content)
+        for digest, content in objects.items() if digest not in existing
+    ])
+
+def record_version(db: Session, workflow_id: int, nodes: List[Any], edges: List[Any],
+                   author_id: Optional[int] = None, restored_from: Optional[int] = None) -> WorkflowVersion:
+    """Append a version for the given graph, storing only nodes and edges not seen before
+
+    Saving (or restoring) a graph identical to the latest version returns
+    that version instead of adding a new one. The workflow row stays locked
+    until the caller commits, so concurrent saves get consecutive versions.
+    """
+    node_entries, node_objects = _manifest(nodes)
+    edge_entries, edge_objects = _manifest(edges)
+    graph_hash = content_hash([node_entries, edge_entries])
+
+    lock_workflow(db, workflow_id)
+    latest = latest_version(db, workflow_id)
+    if latest is not None and latest.graph_hash == graph_hash:
+        return latest
+
+    _store_objects(db, {**node_objects, **edge_objects})
+
+    version = WorkflowVersion(
+        workflow_id=workflow_id,
+        version=(latest.version + 1) if latest is not None else 1,
+        graph_hash=graph_hash,
+        nodes=node_entries,
+        edges=edge_entries,
+        restored_from=restored_from,
+        author_id=author_id
+    )
+    db.add(version)
+    db.flush()
+    return version
+
+def _load_objects(db: Session, hashes) -> Dict[str, Any]:
+    hashes = list(set(hashes))
+    if not hashes:
+        return {}
+    rows = db.execute(
+        select(WorkflowGraphObject.hash, WorkflowGraphObject.content).where(WorkflowGraphObject.hash.in_(hashes))
+    ).all()
+    return {row.hash: row.content for row in rows}
+
+def materialize(db: Session, version: WorkflowVersion) -> Tuple[List[Any], List[Any]]:
+    """Rebuild the full nodes and edges of a version"""
+    entries = (version.nodes or []) + (version.edges or [])
+    objects = _load_objects(db, [digest for _, digest in entries])
+    return (
+        [objects[digest] for _, digest in version.nodes or []],
+        [objects[digest] for _, digest in version.edges or []]
+    )
+
+def _diff_entries(old_entries: List[List[str]], new_entries: List[List[str]]):
+    old, new = dict(map(tuple, old_entries or [])), dict(map(tuple, new_entries or []))
+    added = [digest for item_id, digest in new.items() if item_id not in old]
+    changed = [digest for item_id, digest in new.items() if item_id in old and old[item_id] != digest]
+    removed = [item_id for item_id in old if item_id not in new]
+    return added, changed, removed
+
+def diff_versions(db: Session, old: WorkflowVersion, new: WorkflowVersion) -> Dict[str, Any]:
+    """Nodes and edges added, changed or removed between two versions
+
+    Manifests are compared by hash, so only the added and changed objects are loaded.
+    """
+    node_diff = _diff_entries(old.nodes, new.nodes)
+    edge_diff = _diff_entries(old.edges, new.edges)
+    objects = _load_objects(db, node_diff[0] + node_diff[1] + edge_diff[0] + edge_diff[1])
+
+    def section(added, changed, removed):
+        return {
+            "added": [objects[digest] for digest in added],
+            "changed": [objects[digest] for digest in changed],
+            "removed": removed
+        }
+
+    return {
+        "from_version": old.version,
+        "to_version": new.version,
+        "nodes": section(*node_diff),
+        "edges": section(*edge_diff)
+    }